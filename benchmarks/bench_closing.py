@@ -0,0 +1,61 @@
+"""
+闭运算测试: 检查 closing_roi 与整图 closing 的结果逐像素一致, 并对比耗时
+用法: python -m benchmarks.bench_closing [图片 ...] [--counts 5 20 60 200] [--fractions 0.25 1.0]
+未指定图片时使用不同斑块数量的合成图像; 结果不一致时退出码为1
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from benchmarks.synthetic import make_image
+from image_utils.core import closing, closing_roi, foreground_tiles
+from image_utils.pipeline import Pipeline, load_image
+
+
+def best_time(func, repeat: int = 10) -> tuple:
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('images', nargs='*')
+    parser.add_argument('--counts', type=int, nargs='+', default=[5, 20, 60, 200])
+    parser.add_argument('--height', type=int, default=3000)
+    parser.add_argument('--width', type=int, default=4000)
+    parser.add_argument('--fractions', type=float, nargs='+', default=[0.3, 1.0],
+                        help='closing_roi 的 max_fraction, 1.0 表示总是按区域计算')
+    args = parser.parse_args()
+
+    if args.images:
+        sources = [(path, load_image(path)) for path in args.images]
+    else:
+        sources = [(f'synthetic-{count}', make_image(args.height, args.width, count)) for count in args.counts]
+
+    pipeline = Pipeline(backend='lut_full')
+    mismatched = False
+    print(f'{"image":<20} {"tiles(%)":>8} {"closing":>9} ' + ' '.join(f'{f"roi<={f}":>10}' for f in args.fractions))
+    for name, image in sources:
+        mask = np.ascontiguousarray(pipeline.classify(pipeline.blur(image)))
+        tiles = foreground_tiles(mask).mean() * 100
+        full_time, reference = best_time(lambda: closing(mask, kernel_size=5, iterations=5))
+        line = f'{name:<20} {tiles:>8.1f} {full_time * 1000:>7.2f}ms'
+        for fraction in args.fractions:
+            roi_time, result = best_time(lambda: closing_roi(mask, kernel_size=5, iterations=5,
+                                                             max_fraction=fraction))
+            same = np.array_equal(result, reference)
+            mismatched |= not same
+            line += f' {roi_time * 1000:>8.2f}ms' + ('' if same else ' MISMATCH')
+        print(line)
+    if mismatched:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+cluster_image 采样拟合性能测试: 对比全像素拟合与采样/MiniBatch拟合的耗时及标签差异
+用法: python -m benchmarks.bench_cluster_sampling [图片 ...] [--sizes 1000 10000 100000] [--seed 0]
+未指定图片时使用随机生成的参考图像
+"""
+import argparse
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from benchmarks.synthetic import make_image
+from image_utils.core import cluster_image
+
+
+def disagreement(labels: np.ndarray, reference: np.ndarray) -> float:
+    """
+    标签不一致的像素比例
+    :param labels: 待比较的聚类结果
+    :param reference: 全像素拟合的聚类结果
+    :return: 不一致比例
+    """
+    return float(np.count_nonzero(labels != reference)) / labels.size
+
+
+def run(image: np.ndarray, **kwargs) -> tuple:
+    start = time.perf_counter()
+    labels = cluster_image(image, n_clusters=2, **kwargs)
+    return labels, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('images', nargs='*')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.images:
+        references = [(path, np.array(Image.open(path).convert('RGB'))) for path in args.images]
+    else:
+        references = [(f'synthetic-{seed}', make_image(seed=seed)) for seed in range(3)]
+
+    print(f'{"image":<24} {"mode":<26} {"time(s)":>8} {"diff(%)":>9}')
+    for name, image in references:
+        image = cv2.GaussianBlur(image, (5, 5), 0)
+        reference, full_time = run(image)
+        print(f'{name:<24} {"kmeans full":<26} {full_time:>8.3f} {0:>9.4f}')
+        for backend in ('kmeans', 'minibatch'):
+            for method in ('random', 'strided'):
+                for size in args.sizes:
+                    labels, elapsed = run(image, backend=backend, sample_size=size, sample_method=method,
+                                          seed=args.seed)
+                    mode = f'{backend} {method} {size}'
+                    print(f'{name:<24} {mode:<26} {elapsed:>8.3f} {disagreement(labels, reference) * 100:>9.4f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+切割图像编码与保存测试: 对比各格式在OpenCV与PIL下的编码耗时与大小, 以及逐个保存与打包保存的耗时
+用法: python -m benchmarks.bench_codec [图片 ...] [--crops 200] [--levels 1 6] [--output 目录]
+未指定图片时使用合成图像; 切割图像取图像中随机位置的矩形区域, 前景切割图加上全不透明的透明通道
+"""
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from benchmarks.synthetic import make_image
+from image_utils.archive import ARCHIVES, open_archive
+from image_utils.codec import Codec
+from image_utils.pipeline import load_image
+
+
+def make_crops(image: np.ndarray, count: int, seed: int = 0, min_size: int = 64, max_size: int = 400) -> list:
+    """
+    在图像中随机取矩形区域
+    :return: [RGB切割图]
+    """
+    rng = np.random.default_rng(seed)
+    height, width = image.shape[:2]
+    crops = []
+    for _ in range(count):
+        h, w = rng.integers(min_size, max_size, size=2)
+        top, left = rng.integers(0, height - h), rng.integers(0, width - w)
+        crops.append(image[top:top + h, left:left + w])
+    return crops
+
+
+def codecs(levels: list) -> list:
+    result = []
+    for engine in ('cv2', 'pil'):
+        result += [Codec('png', level=level, engine=engine) for level in levels]
+        result += [Codec('webp', level=0, engine=engine), Codec('jpeg', quality=90, engine=engine)]
+    return result
+
+
+def bench_encode(crops: list, levels: list):
+    alpha = [np.dstack((crop, np.full(crop.shape[:2], 255, np.uint8))) for crop in crops]
+    pixels = sum(crop.shape[0] * crop.shape[1] for crop in crops)
+    print(f'{"format":<6} {"engine":<6} {"level":>5} {"RGB":>9} {"RGBA":>9} {"MB/s":>7} {"ratio":>6}')
+    for codec in codecs(levels):
+        start = time.perf_counter()
+        size = sum(len(codec.encode(crop)) for crop in crops)
+        rgb = time.perf_counter() - start
+        rgba = '-'
+        if codec.alpha:
+            start = time.perf_counter()
+            for crop in alpha:
+                codec.encode(crop)
+            rgba = f'{time.perf_counter() - start:.3f}s'
+        level = codec.level if codec.format != 'jpeg' else codec.quality
+        print(f'{codec.format:<6} {codec.engine:<6} {level:>5} {rgb:>8.3f}s {rgba:>9} '
+              f'{pixels * 3 / rgb / 1e6:>7.1f} {size / (pixels * 3):>6.3f}')
+
+
+def bench_write(crops: list, directory: Path, codec: Codec):
+    # 编码结果相同, 只比较写入方式
+    data = [codec.encode(crop) for crop in crops]
+    names = [f'{index + 1}_crop{codec.suffix}' for index in range(len(data))]
+
+    start = time.perf_counter()
+    files = directory / 'files'
+    files.mkdir()
+    for name, item in zip(names, data):
+        (files / name).write_bytes(item)
+    print(f'{"files":<6} {time.perf_counter() - start:>8.3f}s {len(data)} files')
+    for format, suffix in ARCHIVES.items():
+        start = time.perf_counter()
+        with open_archive(directory / f'crops{suffix}') as archive:
+            for name, item in zip(names, data):
+                archive.add(name, item)
+        print(f'{format:<6} {time.perf_counter() - start:>8.3f}s 1 file')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('images', nargs='*')
+    parser.add_argument('--crops', type=int, default=200, help='每张图像的切割图数量')
+    parser.add_argument('--levels', type=int, nargs='+', default=[1, 6], help='png压缩等级')
+    parser.add_argument('--output', help='测试写入的目录, 默认为临时目录; 可指定为网络存储上的目录')
+    args = parser.parse_args()
+
+    images = [load_image(path) for path in args.images] or [make_image(count=60)]
+    crops = [crop for image in images for crop in make_crops(image, args.crops)]
+    bench_encode(crops, args.levels)
+    with tempfile.TemporaryDirectory(dir=args.output) as tmp:
+        bench_write(crops, Path(tmp), Codec('png'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+get_connect_part 性能测试: 对比逐标签 np.where 的旧实现与单次统计的新实现随连通区域数量的耗时变化
+用法: python -m benchmarks.bench_connect_part [--size 4000] [--counts 10 100 500 1000]
+"""
+import argparse
+import time
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+
+from image_utils.core import get_connect_part
+
+
+def legacy_get_connect_part(image: np.ndarray, piex_threshold: int = 0) -> SimpleNamespace:
+    """旧实现, 仅用于对比"""
+    number_cls, labeled_img = cv2.connectedComponents(image, connectivity=8)
+    piex = []
+    boxes = []
+    for i in range(1, number_cls):
+        connect = np.where(labeled_img == i)
+        if len(connect[0]) < piex_threshold:
+            labeled_img[connect] = 0
+            continue
+        labeled_img[connect] = 255
+        piex.append(len(connect[0]))
+        x_min, x_max = np.min(connect[0]), np.max(connect[0])
+        y_min, y_max = np.min(connect[1]), np.max(connect[1])
+        boxes.append([x_min, y_min, x_max, y_max])
+    return SimpleNamespace(number_cls=len(piex), labeled_img=labeled_img, piex=piex, boxes=boxes)
+
+
+def make_blobs(size: int, count: int, seed: int = 0) -> np.ndarray:
+    """
+    生成包含count个随机圆形斑点的二值图像
+    :param size: 图像边长
+    :param count: 斑点数量
+    :param seed: 随机种子
+    :return: 二值图像
+    """
+    rng = np.random.default_rng(seed)
+    image = np.zeros((size, size), dtype=np.uint8)
+    for _ in range(count):
+        x, y = rng.integers(0, size, 2)
+        cv2.circle(image, (int(x), int(y)), int(rng.integers(2, 40)), 255, -1)
+    return image
+
+
+def timeit(func, *args, repeat: int = 3, **kwargs) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size', type=int, default=4000)
+    parser.add_argument('--counts', type=int, nargs='+', default=[10, 100, 500, 1000])
+    parser.add_argument('--threshold', type=int, default=3000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f'{"blobs":>8} {"labels":>8} {"legacy(s)":>12} {"stats(s)":>12} {"speedup":>8}')
+    for count in args.counts:
+        image = make_blobs(args.size, count)
+        labels = cv2.connectedComponents(image, connectivity=8)[0] - 1
+
+        # 旧实现原地把保留区域改写为255, 标签数达到255后会与第255号标签混淆, 只在此之前比对结果
+        if labels < 255:
+            old = legacy_get_connect_part(image, piex_threshold=args.threshold)
+            new = get_connect_part(image, piex_threshold=args.threshold)
+            assert old.piex == new.piex and np.array(old.boxes).tolist() == new.boxes
+            assert np.array_equal(old.labeled_img.astype(np.uint8), new.labeled_img)
+
+        legacy = timeit(legacy_get_connect_part, image, repeat=args.repeat, piex_threshold=args.threshold)
+        stats = timeit(get_connect_part, image, repeat=args.repeat, piex_threshold=args.threshold)
+        print(f'{count:>8} {labels:>8} {legacy:>12.4f} {stats:>12.4f} {legacy / stats:>8.1f}x')
+
+
+if __name__ == '__main__':
+    main()
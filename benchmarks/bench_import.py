@@ -0,0 +1,76 @@
+"""
+导入耗时测试: 在新的解释器中导入各模块, 扣除解释器本身的启动时间, 超出预算时退出码为1
+用法: python -m benchmarks.bench_import [--repeat 5] [--top 5] [--budget image_utils.api=0.5 ...]
+"""
+import argparse
+import subprocess
+import sys
+import time
+
+# 模块 -> 导入耗时预算(秒), 包与命令行入口不应加载任何重型依赖
+BUDGETS = {
+    'image_utils': 0.05,
+    'image_utils.cli': 0.05,
+    'image_utils.api': 0.6,
+    'image_utils.batch': 0.6,
+}
+
+
+def wall_time(code: str, repeat: int) -> float:
+    """
+    在新的解释器中运行code, 取最短耗时
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], check=True)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def slowest_imports(module: str, top: int) -> list:
+    """
+    -X importtime 统计的累计耗时最长的顶层依赖
+    :return: [(模块, 秒)]
+    """
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            capture_output=True, text=True, check=True).stderr
+    entries = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # 只统计被测模块直接导入的模块(输出中每层缩进两个空格)
+        if name.startswith('   ') and not name.startswith('     '):
+            entries.append((name.strip(), int(cumulative) / 1e6))
+    return sorted(entries, key=lambda item: -item[1])[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=5)
+    parser.add_argument('--budget', nargs='+', default=[], help='模块=秒, 覆盖默认预算')
+    args = parser.parse_args()
+
+    budgets = dict(BUDGETS)
+    for item in args.budget:
+        module, seconds = item.split('=')
+        budgets[module] = float(seconds)
+
+    startup = wall_time('pass', args.repeat)
+    print(f'{"interpreter":<22} {startup:>7.3f}s')
+    exceeded = False
+    for module, budget in budgets.items():
+        elapsed = wall_time(f'import {module}', args.repeat) - startup
+        over = elapsed > budget
+        exceeded |= over
+        print(f'{module:<22} {elapsed:>7.3f}s  budget {budget:.3f}s {"OVER" if over else "ok"}')
+        for name, seconds in slowest_imports(module, args.top):
+            print(f'    {name:<30} {seconds:>7.3f}s')
+    if exceeded:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
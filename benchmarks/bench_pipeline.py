@@ -0,0 +1,169 @@
+"""
+分割流程性能测试: 在不同尺寸的合成图像上分别计时各阶段与整体流程, 结果保存为JSON, 可与之前的结果比较
+阶段: decode(读取解码) / blur(GaussianBlur) / cluster(cluster_image) / closing / connect(get_connect_part) /
+      cut(保存标注原图与切割图) / main(api.main 整体流程)
+用法: python -m benchmarks.bench_pipeline [--sizes 1500x2000 3000x4000] [--output result.json]
+      python -m benchmarks.bench_pipeline --compare baseline.json [--threshold 0.1]
+比较时任一阶段耗时超过基准的(1 + threshold)倍即记为性能退化, 退出码为1
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from benchmarks.synthetic import write_images
+from image_utils.api import cut, main as process_image
+from image_utils.core import cluster_image, closing_roi, get_connect_part
+from image_utils.pipeline import Pipeline, load_image
+
+STAGES = ('decode', 'blur', 'cluster', 'closing', 'connect', 'cut', 'main')
+
+
+def measure(func, repeat: int) -> dict:
+    """
+    重复运行func并计时
+    :param func: 无参数的函数
+    :param repeat: 重复次数
+    :return: best/median/mean耗时(秒)
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return dict(best=min(times), median=statistics.median(times), mean=statistics.fmean(times))
+
+
+def bench_image(path: str, workdir: Path, repeat: int, piex_threshold: int) -> dict:
+    """
+    对一张图像分别计时各阶段, 每个阶段的输入为上一阶段的结果
+    :return: {阶段: 计时}
+    """
+    results = {}
+    results['decode'] = measure(lambda: load_image(path), repeat)
+    image = load_image(path)
+    results['blur'] = measure(lambda: cv2.GaussianBlur(image, (5, 5), 0), repeat)
+    blurred = cv2.GaussianBlur(image, (5, 5), 0)
+    results['cluster'] = measure(lambda: cluster_image(blurred, n_clusters=2), repeat)
+    mask = (255 - cluster_image(blurred, n_clusters=2) * 255).astype(np.uint8)
+    results['closing'] = measure(lambda: closing_roi(mask, kernel_size=5, iterations=5), repeat)
+    closed = closing_roi(mask, kernel_size=5, iterations=5)
+    results['connect'] = measure(lambda: get_connect_part(closed, piex_threshold=piex_threshold), repeat)
+
+    pipeline = Pipeline(piex_threshold=piex_threshold, reuse_buffers=False)
+    rendered = pipeline.render(image, get_connect_part(closed, piex_threshold=piex_threshold), Path(path).name)
+    # 合成图像为jpg, 不保存RGBA的前景整图
+    outputs = dict(origin_path=workdir / 'source', origin_cut_path=workdir / 'source_cut',
+                   foreground_cut_path=workdir / 'foreground_cut')
+    results['cut'] = measure(lambda: cut(rendered, **outputs), repeat)
+
+    save_path = workdir / 'main'
+    save_path.mkdir(exist_ok=True)
+    results['main'] = measure(lambda: process_image(path, str(save_path), str(Path(path).parent), cut_image=True,
+                                                    piex_threshold=piex_threshold), repeat)
+    return results
+
+
+def environment() -> dict:
+    return dict(python=sys.version.split()[0], platform=platform.platform(), processor=platform.processor(),
+                cpu_count=os.cpu_count(), numpy=np.__version__, opencv=cv2.__version__)
+
+
+def run(args) -> dict:
+    records = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            height, width = map(int, size.lower().split('x'))
+            # 斑块数量与面积成正比, 各尺寸下斑块密度相同
+            count = max(1, round(args.density * height * width / 1e6))
+            paths = write_images(Path(tmp) / size, n=args.images, seed=args.seed, height=height, width=width,
+                                 count=count, noise=args.noise, texture=args.texture)
+            for path in paths:
+                workdir = Path(tmp) / size / Path(path).stem
+                for stage, timing in bench_image(path, workdir, args.repeat, args.threshold_piex).items():
+                    records.append(dict(size=size, image=Path(path).name, stage=stage, **timing))
+                    print(f'{size:>11} {Path(path).name:<18} {stage:<8} {timing["best"]:>8.3f}s '
+                          f'{timing["median"]:>8.3f}s')
+    return dict(environment=environment(),
+                config=dict(sizes=args.sizes, images=args.images, density=args.density, noise=args.noise,
+                            texture=args.texture, seed=args.seed, repeat=args.repeat,
+                            piex_threshold=args.threshold_piex),
+                results=records)
+
+
+def summarize(report: dict) -> dict:
+    """
+    按(尺寸, 阶段)汇总, 取各图像best耗时之和
+    :return: {(尺寸, 阶段): 秒}
+    """
+    summary = {}
+    for record in report['results']:
+        key = (record['size'], record['stage'])
+        summary[key] = summary.get(key, 0) + record['best']
+    return summary
+
+
+def compare(report: dict, baseline: dict, threshold: float) -> bool:
+    """
+    比较两次结果
+    :param report: 本次结果
+    :param baseline: 基准结果
+    :param threshold: 允许的相对变慢比例
+    :return: 是否存在性能退化
+    """
+    current, previous = summarize(report), summarize(baseline)
+    regressed = False
+    print(f'{"size":>11} {"stage":<8} {"baseline":>9} {"current":>9} {"ratio":>7}')
+    for key in sorted(current.keys() & previous.keys()):
+        ratio = current[key] / previous[key] if previous[key] else float('inf')
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = 'REGRESSION'
+            regressed = True
+        elif ratio < 1 - threshold:
+            flag = 'faster'
+        print(f'{key[0]:>11} {key[1]:<8} {previous[key]:>8.3f}s {current[key]:>8.3f}s {ratio:>6.2f}x {flag}')
+    for key in sorted(previous.keys() - current.keys()):
+        print(f'{key[0]:>11} {key[1]:<8} missing in current run')
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', nargs='+', default=['750x1000', '1500x2000', '3000x4000'],
+                        help='图像尺寸, 高x宽')
+    parser.add_argument('--images', type=int, default=2, help='每种尺寸的图像数量')
+    parser.add_argument('--density', type=float, default=5, help='每百万像素的斑块数量')
+    parser.add_argument('--noise', type=float, default=10)
+    parser.add_argument('--texture', type=float, default=0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--threshold-piex', type=int, default=3000, help='连通区域像素阈值')
+    parser.add_argument('--output', help='结果JSON路径')
+    parser.add_argument('--compare', help='基准结果JSON路径')
+    parser.add_argument('--threshold', type=float, default=0.1, help='性能退化阈值(相对比例)')
+    parser.add_argument('--current', help='与--compare一起使用: 比较已有的结果而不重新运行')
+    args = parser.parse_args()
+
+    if args.current:
+        report = json.loads(Path(args.current).read_text())
+    else:
+        report = run(args)
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())
+        if compare(report, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
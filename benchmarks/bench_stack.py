@@ -0,0 +1,47 @@
+"""
+同尺寸图像组处理测试: 对比逐张处理与 get_connect_part_of_images 分组处理的耗时与结果
+用法: python -m benchmarks.bench_stack [--height 1500] [--width 2000] [--images 16] [--batch-size 8]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from benchmarks.synthetic import make_image
+from image_utils.api import get_connect_part_of_image, get_connect_part_of_images
+from image_utils.model import SegmentationModel
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--height', type=int, default=1500)
+    parser.add_argument('--width', type=int, default=2000)
+    parser.add_argument('--images', type=int, default=16)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--threshold', type=int, default=3000)
+    args = parser.parse_args()
+
+    images = [make_image(args.height, args.width, 40, seed=seed) for seed in range(args.images)]
+    configs = {
+        'kmeans': dict(),
+        'model': dict(model=SegmentationModel().fit(images[:2])),
+        'lut_full': dict(backend='lut_full'),
+    }
+    print(f'{"config":<10} {"single(s)":>10} {"stack(s)":>10} {"diff pixels":>12}')
+    for name, options in configs.items():
+        start = time.perf_counter()
+        single = [get_connect_part_of_image(image, piex_threshold=args.threshold, **options) for image in images]
+        single_time = time.perf_counter() - start
+        start = time.perf_counter()
+        stacked = sorted(get_connect_part_of_images(images, batch_size=args.batch_size,
+                                                    piex_threshold=args.threshold, **options),
+                         key=lambda item: item.index)
+        stack_time = time.perf_counter() - start
+        # 未指定模型时整组共用一次拟合, 与逐张拟合的结果可能有少量差异
+        diff = sum(int(np.count_nonzero(a.labeled_img != b.connect_info.labeled_img))
+                   for a, b in zip(single, stacked))
+        print(f'{name:<10} {single_time:>10.3f} {stack_time:>10.3f} {diff:>12}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+批量处理方式对比: 逐张顺序处理 / 多进程 BatchProcessor / 单进程分阶段多线程 StagedProcessor 的吞吐量,
+并输出 StagedProcessor 各阶段的利用率与队列占用
+用法: python -m benchmarks.bench_staged [--images 16] [--size 3000x4000] [--workers 4] [--threads segment=4]
+"""
+import argparse
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.synthetic import write_images
+from image_utils.api import main as process_image
+from image_utils.batch import BatchProcessor
+from image_utils.pipeline import Pipeline
+from image_utils.staged import StagedProcessor
+
+
+def run_sequential(paths: list, save_path: Path, source_dir: Path, options: dict) -> float:
+    pipeline = Pipeline(piex_threshold=options['piex_threshold'], backend=options['backend'])
+    start = time.perf_counter()
+    for path in paths:
+        process_image(path, str(save_path), str(source_dir), cut_image=options['cut_image'], pipeline=pipeline)
+    return time.perf_counter() - start
+
+
+def run_processor(processor, paths: list, save_path: Path) -> float:
+    start = time.perf_counter()
+    written = 0
+    for result in processor.run(paths):
+        assert result.error is None, result.error
+        written += result.result.counters.get('bytes_written', 0)
+    elapsed = time.perf_counter() - start
+    # 后台写入的字节数在写入完成时计入每张图像的结果, 与保存目录中的文件总大小一致
+    size = sum(path.stat().st_size for path in save_path.rglob('*') if path.is_file())
+    assert written == size, f'bytes_written {written} != {size} bytes on disk'
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', type=int, default=16)
+    parser.add_argument('--size', default='3000x4000', help='图像尺寸, 高x宽')
+    parser.add_argument('--count', type=int, default=60, help='每张图像的斑块数量')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='多进程的进程数')
+    parser.add_argument('--threads', nargs='+', default=[], metavar='STAGE=N', help='各阶段的线程数')
+    parser.add_argument('--queue-size', type=int, default=2)
+    parser.add_argument('--backend', default='lut_full')
+    args = parser.parse_args()
+
+    height, width = map(int, args.size.lower().split('x'))
+    threads = {stage: int(count) for stage, count in (item.split('=') for item in args.threads)}
+    options = dict(cut_image=True, piex_threshold=3000, backend=args.backend)
+    with tempfile.TemporaryDirectory() as tmp:
+        source_dir = Path(tmp) / 'source'
+        paths = write_images(source_dir, n=args.images, height=height, width=width, count=args.count)
+        timings = {}
+        for name in ('sequential', 'process', 'staged'):
+            save_path = Path(tmp) / name
+            save_path.mkdir()
+            if name == 'sequential':
+                timings[name] = run_sequential(paths, save_path, source_dir, options)
+            elif name == 'process':
+                timings[name] = run_processor(BatchProcessor(str(save_path), str(source_dir), workers=args.workers,
+                                                             **options), paths, save_path)
+            else:
+                staged = StagedProcessor(str(save_path), str(source_dir), threads=threads,
+                                         queue_size=args.queue_size, **options)
+                timings[name] = run_processor(staged, paths, save_path)
+            print(f'{name:<11} {timings[name]:>7.2f}s {len(paths) / timings[name]:>6.2f} images/s')
+
+    occupancy = staged.occupancy()
+    print(f'\n{"stage":<8} {"threads":>7} {"busy":>8} {"util":>6} {"queue":>6} {"full":>8} {"empty":>8}')
+    for stage, item in occupancy.stages.items():
+        queue = occupancy.queues[stage]
+        print(f'{stage:<8} {item["threads"]:>7} {item["busy"]:>7.2f}s {item["utilization"]:>6.2f} '
+              f'{queue["mean"]:>6.2f} {queue["full"]:>7.2f}s {queue["empty"]:>7.2f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""
+分块分割测试: 检查 get_connect_part_tiled 与整图处理结果(包括各区域的掩码)一致, 并对比耗时;
+最后把图像保存为未压缩的TIFF, 检查按文件分块读取的结果
+用法: python -m benchmarks.bench_tiled [--height 6000] [--width 8000] [--tiles 1024 2048 4096]
+"""
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from benchmarks.synthetic import make_image
+from image_utils.api import get_connect_part_of_image
+from image_utils.model import SegmentationModel
+from image_utils.tiled import get_connect_part_tiled
+
+
+def regions(connect_info) -> list:
+    """与顺序无关的区域集合: (外接框, 像素数)"""
+    return sorted(zip(map(tuple, connect_info.boxes), connect_info.piex))
+
+
+def check(tiled, whole, name):
+    assert regions(tiled) == regions(whole), f'{name} does not match the whole-image result'
+    assert np.allclose(sorted(tiled.centroids), sorted(whole.centroids))
+    # 切割与前景图像使用的掩码: 每个外接框内与整图的掩码一致
+    for box in tiled.boxes:
+        window = (slice(box[0], box[2] + 1), slice(box[1], box[3] + 1))
+        assert np.array_equal(tiled.labeled_img[window], whole.labeled_img[window]), f'{name} mask mismatch'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--height', type=int, default=6000)
+    parser.add_argument('--width', type=int, default=8000)
+    parser.add_argument('--count', type=int, default=400)
+    parser.add_argument('--threshold', type=int, default=3000)
+    parser.add_argument('--tiles', type=int, nargs='+', default=[1024, 2048, 4096])
+    args = parser.parse_args()
+
+    image = make_image(args.height, args.width, args.count)
+    model = SegmentationModel().fit([image])
+
+    start = time.perf_counter()
+    whole = get_connect_part_of_image(image, piex_threshold=args.threshold, model=model)
+    print(f'{"whole":>8} {time.perf_counter() - start:>8.3f}s {whole.number_cls:>6} regions')
+    for tile_size in args.tiles:
+        start = time.perf_counter()
+        tiled = get_connect_part_tiled(image, piex_threshold=args.threshold, tile_size=tile_size, model=model)
+        elapsed = time.perf_counter() - start
+        check(tiled, whole, f'tile_size={tile_size}')
+        print(f'{tile_size:>8} {elapsed:>8.3f}s {tiled.number_cls:>6} regions  match=True')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / 'mosaic.tif'
+        Image.fromarray(image).save(path)
+        start = time.perf_counter()
+        tiled = get_connect_part_tiled(str(path), piex_threshold=args.threshold, tile_size=args.tiles[0], model=model)
+        check(tiled, whole, 'tiff')
+        print(f'{"tiff":>8} {time.perf_counter() - start:>8.3f}s {tiled.number_cls:>6} regions  match=True')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""
+合成底栖生物图像, 用于性能测试
+背景为底质颜色, 其上随机分布生物颜色的斑块, 分辨率、斑块数量、大小与噪声可配置, 结果由随机种子确定
+"""
+from pathlib import Path
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from image_utils.model import DEFAULT_CENTERS
+
+# 默认颜色取分割模型的默认聚类中心: 背景与生物
+BACKGROUND = tuple(int(value) for value in DEFAULT_CENTERS[1])
+ORGANISM = tuple(int(value) for value in DEFAULT_CENTERS[0])
+
+
+def make_image(height: int = 3000, width: int = 4000, count: int = 60, noise: float = 10, seed: int = 0,
+               min_axis: int = 20, max_axis: int = 120, texture: float = 0,
+               background: tuple = BACKGROUND, organism: tuple = ORGANISM) -> np.ndarray:
+    """
+    生成合成图像: 背景上随机分布的椭圆斑块
+    :param height: 图像高度
+    :param width: 图像宽度
+    :param count: 斑块数量
+    :param noise: 高斯噪声标准差
+    :param seed: 随机种子
+    :param min_axis: 椭圆半轴最小值
+    :param max_axis: 椭圆半轴最大值
+    :param texture: 背景低频起伏的幅度, 模拟底质颜色不均, 为0时背景为纯色
+    :param background: 背景颜色(RGB)
+    :param organism: 斑块颜色(RGB)
+    :return: RGB图像
+    """
+    rng = np.random.default_rng(seed)
+    image = np.empty((height, width, 3), dtype=np.uint8)
+    image[:] = background
+    for _ in range(count):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        axes = (int(rng.integers(min_axis, max_axis)), int(rng.integers(min_axis, max_axis)))
+        cv2.ellipse(image, center, axes, float(rng.integers(0, 180)), 0, 360, organism, -1)
+    noise = rng.normal(0, noise, image.shape)
+    if texture:
+        small = rng.normal(0, texture, (max(height // 256, 2), max(width // 256, 2), 1))
+        noise += cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)[..., None]
+    return np.clip(image + noise, 0, 255).astype(np.uint8)
+
+
+def write_images(directory: str, n: int = 4, suffix: str = '.jpg', seed: int = 0, **kwargs) -> list:
+    """
+    生成n张合成图像并保存
+    :param directory: 保存目录
+    :param n: 图像数量, 第i张的随机种子为seed + i
+    :param suffix: 文件格式
+    :param seed: 随机种子
+    :param kwargs: make_image 的其余参数
+    :return: 图像路径
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for index in range(n):
+        path = directory / f'synthetic_{seed + index}{suffix}'
+        Image.fromarray(make_image(seed=seed + index, **kwargs)).save(path, quality=95)
+        paths.append(str(path))
+    return paths
@@ -1,18 +1,33 @@
+import os
 import sys
+import threading
+from itertools import islice, chain
+from typing import Iterable
 
 from PySide6.QtGui import QPixmap
 from PySide6.QtWidgets import QMainWindow, QFileDialog, QMessageBox, QApplication, QVBoxLayout, QHBoxLayout, QLabel, \
-    QLineEdit, QPushButton, QWidget, QSpacerItem, QSizePolicy, QCheckBox, QFrame, QProgressBar
+    QLineEdit, QPushButton, QWidget, QSpacerItem, QSizePolicy, QCheckBox, QFrame, QProgressBar, QSpinBox
 from PySide6.QtCore import Slot, Signal, QThread, QRunnable, QThreadPool
 from pathlib import Path
 
-from gui.tool import get_all_image
 from resources import resources
-from image_utils.api import main as process_image
+from preview import PreviewPane, to_qimage
+from image_utils.api import main as process_image, fit_segmentation_model
+from image_utils.archive import new_archive
+from image_utils.model import SegmentationModel
+from image_utils.cache import DecodeCache
+from image_utils.manifest import ResultManifest
+from image_utils.pipeline import Pipeline
+from image_utils.scan import ImageScanner
+from image_utils.sink import CSVSink, to_xlsx
+from image_utils.thumbnail import save_thumbnail
+from image_utils.writer import ImageWriter
 from types import SimpleNamespace
-import pandas as pd
 import time
 
+# 连通区域像素阈值, 处理与结果清单的参数都取自 WorkerThread
+PIEX_THRESHOLD = 3000
+
 
 class MainWindow(QMainWindow):
     # 按钮样式
@@ -43,6 +58,8 @@ class MainWindow(QMainWindow):
             """
     processing = False
     status_signal = Signal(bool)
+    # 图片扫描进度: 已找到的数量, 是否扫描完成
+    scan_signal = Signal(int, bool)
 
     def __init__(self):
         super().__init__()
@@ -50,8 +67,9 @@ class MainWindow(QMainWindow):
         self.setWindowIcon(QPixmap(":/resources/icon/icon.svg"))
 
         self.worker = QThread()
-        self.data = {'filename': [], 'area': [], 'index': [], 'path': [], 'x_min': [], 'y_min': [], 'x_max': [],
-                     'y_max': []}
+        self.sink = None
+        self.scanner = None
+        self.failed = []
         self.destination_path = None
         self.start_time = None
 
@@ -62,6 +80,7 @@ class MainWindow(QMainWindow):
         source_fold_layout = QHBoxLayout()
         destination_fold_layout = QHBoxLayout()
         save_options_layout = QHBoxLayout()
+        process_options_layout = QHBoxLayout()
         process_layout = QHBoxLayout()
         status_layout = QHBoxLayout()
         speed_layout = QHBoxLayout()
@@ -100,13 +119,41 @@ class MainWindow(QMainWindow):
         self.option_cut.setChecked(True)
         self.option_foreground = QCheckBox("前景")
         self.option_foreground.setChecked(False)
+        self.option_archive = QCheckBox("打包")
+        self.option_archive.setToolTip("切割图像写入保存目录下的crops_编号.tar, 每次运行新建一个, 不逐个保存小文件")
+        self.option_archive.setChecked(False)
         save_options_layout.addWidget(save_options_label, 1)
         save_options_layout.addWidget(self.get_space_line(0, 20, ), 0)
         save_options_layout.addItem(QSpacerItem(20, 40, QSizePolicy.Minimum, QSizePolicy.Expanding))
         save_options_layout.addWidget(self.option_cut, 1)
         save_options_layout.addWidget(self.option_foreground, 1)
+        save_options_layout.addWidget(self.option_archive, 1)
         save_options_layout.addItem(QSpacerItem(20, 40, QSizePolicy.Minimum, QSizePolicy.Expanding))
 
+        # 设置处理选项
+        process_options_label = QLabel("处理选项")
+        process_options_label.setFixedSize(50, 20)
+        self.option_fast = QCheckBox("快速(多分辨率)")
+        self.option_fast.setChecked(False)
+        process_options_layout.addWidget(process_options_label, 1)
+        process_options_layout.addWidget(self.get_space_line(0, 20, ), 0)
+        process_options_layout.addItem(QSpacerItem(20, 40, QSizePolicy.Minimum, QSizePolicy.Expanding))
+        process_options_layout.addWidget(self.option_fast, 1)
+        self.option_cache = QCheckBox("解码缓存")
+        self.option_cache.setToolTip("将解码后的图像缓存到保存目录下, 重复处理同一目录时不再解码")
+        self.option_cache.setChecked(False)
+        process_options_layout.addWidget(self.option_cache, 1)
+        self.option_thumbnail_cache = QCheckBox("预览缓存")
+        self.option_thumbnail_cache.setToolTip("将预览缩略图保存到保存目录下, 浏览较早的结果或重复处理时直接读取")
+        self.option_thumbnail_cache.setChecked(False)
+        process_options_layout.addWidget(self.option_thumbnail_cache, 1)
+        process_options_layout.addWidget(QLabel("线程数"), 0)
+        self.option_workers = QSpinBox()
+        self.option_workers.setRange(1, os.cpu_count() or 1)
+        self.option_workers.setValue(os.cpu_count() or 1)
+        process_options_layout.addWidget(self.option_workers, 1)
+        process_options_layout.addItem(QSpacerItem(20, 40, QSizePolicy.Minimum, QSizePolicy.Expanding))
+
         # 日志
         stat_label = QLabel("详细信息")
         stat_label.setFixedSize(50, 20)
@@ -152,6 +199,7 @@ class MainWindow(QMainWindow):
         main_layout.addLayout(source_fold_layout)
         main_layout.addLayout(destination_fold_layout)
         main_layout.addLayout(save_options_layout)
+        main_layout.addLayout(process_options_layout)
         # 添加分割线
         main_layout.addWidget(self.get_space_line(1, h=5))
         main_layout.addLayout(status_layout)
@@ -161,11 +209,18 @@ class MainWindow(QMainWindow):
         main_layout.addWidget(self.get_space_line(1, h=5))
         main_layout.addLayout(begin_layout)
 
-        main_layout.setContentsMargins(20, 20, 20, 20)
-        central_widget.setLayout(main_layout)
+        # 结果预览位于右侧
+        self.preview = PreviewPane(size=WorkerThread.thumbnail_size)
+        root_layout = QHBoxLayout()
+        root_layout.addLayout(main_layout, 1)
+        root_layout.addWidget(self.get_space_line(0))
+        root_layout.addWidget(self.preview, 1)
+
+        root_layout.setContentsMargins(20, 20, 20, 20)
+        central_widget.setLayout(root_layout)
         self.setCentralWidget(central_widget)
 
-        self.resize(400, 300)
+        self.resize(900, 420)
 
         self.bind_event()
 
@@ -197,15 +252,19 @@ class MainWindow(QMainWindow):
         self.destination_button.clicked.connect(
             lambda: self.destination_line_edit.setText(QFileDialog.getExistingDirectory(self, "选择文件夹")))
         self.status_signal.connect(self.set_status)
+        self.scan_signal.connect(self.scan_progress)
         self.begin_button.clicked.connect(self.begin)
 
     @Slot()
     def begin(self):
-        # 样式修改
-        if not self.processing:
-            self.status_signal.emit(False)
-        else:
-            self.status_signal.emit(True)
+        # 处理中点击停止: 不再开始新的图像, 等待正在处理的图像完成
+        if self.processing:
+            self.scanner.cancel()
+            self.worker.cancel()
+            self.begin_button.setEnabled(False)
+            self.stat_text.setText("正在停止, 等待处理中的图片完成...")
+            return
+        self.status_signal.emit(False)
 
         # 检验参数
         source_path = self.source_line_edit.text()
@@ -217,29 +276,40 @@ class MainWindow(QMainWindow):
         # 获取保存选项
         cut_image = self.option_cut.isChecked()
         foreground = self.option_foreground.isChecked()
-
-        # 获取图片目录下的所有图片
-        images = get_all_image(source_path)
-        if not images:
-            QMessageBox.warning(self, "警告", "图片目录下没有图片")
-            self.status_signal.emit(True)
-            return
-
-        # 设置进度条
-        self.process_bar.setMaximum(len(images))
+        archive = self.option_archive.isChecked()
+        # 多分辨率模式在1/4尺寸上分割, 只在边界附近按原分辨率细化
+        scale = 0.25 if self.option_fast.isChecked() else 1.0
+        cache = DecodeCache(Path(self.destination_path) / '.decode_cache') if self.option_cache.isChecked() else None
+        thumbnails = str(Path(self.destination_path) / '.thumbnails') if self.option_thumbnail_cache.isChecked() \
+            else None
+        self.preview.reset(thumbnails)
+
+        # 在后台扫描图片目录, 找到的图片立即开始处理, 进度条的总数随扫描增长
+        self.scanner = ImageScanner(source_path, on_progress=self.scan_signal.emit)
+        self.process_bar.setMaximum(0)
         self.process_bar.setValue(0)
 
         # 初始化变量
-        self.data = {'filename': [], 'area': [], 'index': [], 'path': [], 'x_min': [], 'y_min': [], 'x_max': [],
-                     'y_max': []}
+        self.failed = []
+        # 已扫描到与已处理完的图片数, 进度条由这两个计数决定
+        self.scanned = 0
+        self.scan_done = False
+        self.processed = 0
 
         # 开始处理
         try:
             self.start_time = time.time()
-            self.worker = WorkerThread(images, self.destination_path, source_path, cut_image=cut_image,
+            # 结果逐张追加写入result.csv, 结束时再转换为result.xlsx
+            self.sink = CSVSink(Path(self.destination_path) / 'result.csv')
+            # 结果清单: 以相同参数重新运行时跳过已完成的图像
+            self.worker = WorkerThread(self.scanner, self.destination_path, source_path, cut_image=cut_image,
                                        foreground=foreground,
-                                       piex_threshold=3000)
+                                       piex_threshold=PIEX_THRESHOLD, model=SegmentationModel(), scale=scale,
+                                       workers=self.option_workers.value(), cache=cache,
+                                       manifest=str(Path(self.destination_path) / 'manifest.sqlite'),
+                                       archive=archive, thumbnails=thumbnails)
             self.worker.result_signal.connect(self.process_result)
+            self.worker.error_signal.connect(self.process_error)
             self.worker.finished.connect(self.finnish_work)
             self.worker.start()
 
@@ -248,44 +318,62 @@ class MainWindow(QMainWindow):
             self.status_signal.emit(True)
             return
 
+    @Slot(int, bool)
+    def scan_progress(self, count: int, done: bool):
+        self.scanned = count
+        self.scan_done = done
+        self.update_progress()
+        if not done:
+            self.stat_text.setText(f"正在扫描图片目录, 已找到{count}张图片")
+
+    def update_progress(self):
+        # 进度取处理线程给出的计数而不是在进度条当前值上累加: setValue超过最大值时会被忽略,
+        # 扫描进度信号可能晚于处理结果到达, 累加会丢失这些计数; 最大值为0时进度条显示为忙碌状态
+        maximum = max(self.scanned, self.processed)
+        self.process_bar.setMaximum(max(maximum, 1) if self.scan_done else maximum)
+        self.process_bar.setValue(self.processed)
+
     @Slot(SimpleNamespace)
     def process_result(self, result: SimpleNamespace):
         current = time.time()
-        speed = (current - self.start_time) / result.count
-        self.process_bar.setValue(self.process_bar.value() + 1)
+        # 结果信号可能不按计数顺序到达
+        self.processed = max(self.processed, result.count)
+        self.update_progress()
+        speed = (current - self.start_time) / self.processed
         self.stat_text.setText(f"处理完成: {result.filename}")
         self.speed_text.setText(f"处理速度: {speed:.2f} s/item")
-        self.left_time_text.setText(
-            f"剩余时间: {speed * (self.process_bar.maximum() - self.process_bar.value()):.2f} s")
-        number_cls = result.cls
-        if number_cls == 0:
-            self.data['filename'].append(result.filename)
-            self.data['area'].append(0)
-            self.data['index'].append(1)
-            self.data['path'].append(result.image_path)
-            self.data['x_min'].append('')
-            self.data['y_min'].append('')
-            self.data['x_max'].append('')
-            self.data['y_max'].append('')
-        else:
-            for item in range(number_cls):
-                self.data['filename'].append(result.filename)
-                self.data['area'].append(result.area[item])
-                self.data['index'].append(item + 1)
-                self.data['path'].append(result.image_path)
-                self.data['x_min'].append(result.boxes[item][0])
-                self.data['y_min'].append(result.boxes[item][1])
-                self.data['x_max'].append(result.boxes[item][2])
-                self.data['y_max'].append(result.boxes[item][3])
+        self.left_time_text.setText(f"剩余时间: {speed * (max(self.scanned, self.processed) - self.processed):.2f} s")
+        self.sink.write(result)
+        self.preview.add(result.image_path, result.filename, result.preview)
+
+    @Slot(SimpleNamespace)
+    def process_error(self, error: SimpleNamespace):
+        # index小于0表示不影响进度的错误(如分割模型拟合失败、结果写入失败)
+        if error.index >= 0:
+            self.processed = max(self.processed, error.count)
+            self.update_progress()
+        self.failed.append(error)
+        self.stat_text.setText(f"处理失败: {error.filename} {error.error}")
 
     @Slot()
     def finnish_work(self):
         self.status_signal.emit(True)
-        df = pd.DataFrame(self.data)
-        self.stat_text.setText(f"处理完成, 共处理{self.process_bar.maximum()}张图片")
+        self.begin_button.setEnabled(True)
+        state = "已停止" if self.worker.cancelled else "处理完成"
+        self.stat_text.setText(f"{state}, 共处理{self.processed}张图片, 失败{len(self.failed)}张")
         self.left_time_text.setText(f"---")
-        df.to_excel(str(Path(self.destination_path) / 'result.xlsx'), index=False)
-        QMessageBox.information(self, "提示", "处理完成")
+        self.sink.close()
+        if self.scanner.count == 0 and not self.worker.cancelled:
+            QMessageBox.warning(self, "警告", "图片目录下没有图片")
+            return
+        try:
+            to_xlsx(self.sink, Path(self.destination_path) / 'result.xlsx', failed=self.failed)
+        except Exception as e:
+            QMessageBox.warning(self, "警告", f"result.xlsx保存失败, 结果已保存在result.csv: {e}")
+        if self.failed:
+            QMessageBox.warning(self, "提示", f"{state}, {len(self.failed)}张图片处理失败, 详见result.xlsx")
+        else:
+            QMessageBox.information(self, "提示", state)
 
     def set_status(self, status: bool):
         """
@@ -295,6 +383,11 @@ class MainWindow(QMainWindow):
         self.destination_button.setEnabled(status)
         self.option_cut.setEnabled(status)
         self.option_foreground.setEnabled(status)
+        self.option_archive.setEnabled(status)
+        self.option_fast.setEnabled(status)
+        self.option_cache.setEnabled(status)
+        self.option_thumbnail_cache.setEnabled(status)
+        self.option_workers.setEnabled(status)
         self.source_line_edit.setEnabled(status)
         self.destination_line_edit.setEnabled(status)
         if status:
@@ -336,12 +429,36 @@ class MainWindow(QMainWindow):
         return True
 
 
+class ImageTask(QRunnable):
+    """
+    线程池中处理单张图像的任务
+    """
+
+    def __init__(self, worker: "WorkerThread", index: int, image: str):
+        super().__init__()
+        self.worker = worker
+        self.index = index
+        self.image = image
+
+    def run(self) -> None:
+        self.worker.process(self.index, self.image)
+
+
 class WorkerThread(QThread):
     result_signal = Signal(SimpleNamespace)
+    error_signal = Signal(SimpleNamespace)
+    # 预览缩略图的最大边长
+    thumbnail_size = 384
 
-    def __init__(self, images: list | tuple, save_path: str, source_dir: str, cut_image: bool = False,
+    def __init__(self, images: Iterable[str], save_path: str, source_dir: str, cut_image: bool = False,
                  foreground: bool = False,
-                 piex_threshold: int = 3000):
+                 piex_threshold: int = PIEX_THRESHOLD, model: SegmentationModel = None, scale: float = 1.0,
+                 workers: int = 1, cache: DecodeCache = None, manifest: str = None,
+                 archive: bool = False, thumbnails: str = None):
+        """
+        :param manifest: 结果清单路径, 参数由本线程的处理参数生成(见 params), 与实际处理使用的参数一致
+        :param thumbnails: 缩略图磁盘缓存目录, 为None时缩略图只保存在界面的内存缓存中
+        """
         super().__init__()
         self.images = images
         self.save_path = save_path
@@ -349,24 +466,147 @@ class WorkerThread(QThread):
         self.cut_image = cut_image
         self.foreground = foreground
         self.piex_threshold = piex_threshold
+        self.model = model
+        self.scale = scale
+        self.workers = workers
+        self.cache = cache
+        # 整批共用的切割图像包, 每次运行新建一个; tar包的文件写入后即可读取, 写入完成后记录到结果清单时已可用
+        self.archive = new_archive(save_path, root=save_path) if archive else None
+        self.manifest = ResultManifest(manifest, self.params()) if manifest is not None else None
+        self.thumbnails = thumbnails
+        self.count = 0
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self._cancel = threading.Event()
+        # 限制已提交但未完成的任务数, 取消时不会有大量排队的任务
+        self.slots = threading.Semaphore(workers * 2)
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(workers)
+        # 图像编码与写盘在后台线程中进行, 不占用处理线程
+        self.writer = ImageWriter(workers=2)
+
+    def params(self) -> dict:
+        """
+        影响处理结果的参数, 用作结果清单的键
+        :return: 参数
+        """
+        return dict(cut_image=self.cut_image, foreground=self.foreground, piex_threshold=self.piex_threshold,
+                    scale=self.scale, archive=self.archive.format if self.archive is not None else None)
 
-    def run(self) -> None:
+    def cancel(self):
+        """
+        取消处理: 不再开始新的图像, 正在处理的图像完成后结束
+        """
+        self._cancel.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def pipeline(self) -> Pipeline:
+        # 流水线的缓冲区不能在线程间共享, 每个线程一个
+        if not hasattr(self.local, 'pipeline'):
+            self.local.pipeline = Pipeline(piex_threshold=self.piex_threshold, model=self.model, scale=self.scale,
+                                           cache=self.cache)
+        return self.local.pipeline
+
+    def process(self, index: int, image: str):
+        """
+        处理单张图像, 在线程池中执行
+        :param index: 图像序号
+        :param image: 图像路径
+        """
         try:
-            # start = time.time()
-            count = 0
-            for item in self.images:
-                result = process_image(item, save_path=self.save_path, source_dir=self.source_dir,
+            if self.cancelled:
+                return
+            # 清单中已有结果的图像不再处理
+            result = self.manifest.get(image) if self.manifest is not None else None
+            if result is None:
+                result = process_image(image, save_path=self.save_path, source_dir=self.source_dir,
                                        cut_image=self.cut_image, foreground=self.foreground,
-                                       piex_threshold=self.piex_threshold)
-                count += 1
-                # end = time.time()
-                # result.speed = (end - start) / count
-                result.count = count
-                self.result_signal.emit(result)
+                                       pipeline=self.pipeline(), writer=self.writer, archive=self.archive,
+                                       thumbnail=self.thumbnail_size)
+                if self.manifest is not None:
+                    # 输出图像在后台写入, 全部写入成功后才记录, 中途崩溃时重新运行会再次处理
+                    self.writer.when_done(image, lambda errors, result=result: self.record(result, errors))
+            # 缩略图在处理线程中转换为QImage并写入磁盘缓存, 界面线程只创建QPixmap
+            result.preview = None
+            if result.thumbnail is not None:
+                result.preview = to_qimage(result.thumbnail)
+                if self.thumbnails is not None:
+                    save_thumbnail(result.thumbnail, self.thumbnails, image)
+                result.thumbnail = None
+            with self.lock:
+                self.count += 1
+                result.count = self.count
+            self.result_signal.emit(result)
         except Exception as e:
-            print(e)
+            with self.lock:
+                self.count += 1
+                count = self.count
+            self.error_signal.emit(SimpleNamespace(index=index, image_path=image, filename=Path(image).name,
+                                                   error=f'{type(e).__name__}: {e}', count=count))
+        finally:
+            self.slots.release()
+
+    def record(self, result: SimpleNamespace, errors: list):
+        """
+        一张图像的输出全部写入后记录到结果清单, 在写入线程中调用; 有写入错误时不记录, 错误在结束时报告
+        :param result: 处理结果
+        :param errors: 该图像的写入错误
+        """
+        if errors:
+            return
+        try:
+            self.manifest.record(result)
+        except Exception as e:
+            self.error_signal.emit(SimpleNamespace(index=-1, image_path=result.image_path, filename=result.filename,
+                                                   error=f'结果清单写入失败 {type(e).__name__}: {e}',
+                                                   count=self.count))
+
+    def run(self) -> None:
+        self.images = iter(self.images)
+        try:
+            # 整批图像共用一个分割模型, 只在开始时拟合一次
+            if self.model is not None and not self.model.fitted:
+                # 图片可能是扫描中的迭代器, 取出用于拟合的图片后再放回
+                head = list(islice(self.images, 8))
+                self.images = chain(head, self.images)
+                if head:
+                    fit_segmentation_model(head, model=self.model)
+        except Exception as e:
+            self.error_signal.emit(SimpleNamespace(index=-1, image_path='', filename='分割模型',
+                                                   error=f'{type(e).__name__}: {e}', count=0))
+            self.close()
+            if self.manifest is not None:
+                self.manifest.close()
             return
 
+        for index, item in enumerate(self.images):
+            self.slots.acquire()
+            if self.cancelled:
+                self.slots.release()
+                break
+            self.pool.start(ImageTask(self, index, item))
+        self.pool.waitForDone()
+
+        # 有写入错误的图像没有记录到结果清单, 重新运行时会再次处理
+        for error in self.close():
+            self.error_signal.emit(SimpleNamespace(index=-1, image_path=error.tag, filename=Path(error.tag).name,
+                                                   error=f'{error.path}: {error.error}', count=self.count))
+        if self.manifest is not None:
+            self.manifest.close()
+
+    def close(self) -> list:
+        """
+        等待写入完成后关闭切割图像包
+        :return: 写入错误, 见 ImageWriter.close
+        """
+        errors = self.writer.close()
+        if self.archive is not None:
+            self.archive.close()
+        return errors
+
 
 if __name__ == '__main__':
     app = QApplication(sys.argv)
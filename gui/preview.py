@@ -0,0 +1,189 @@
+from collections import OrderedDict
+
+import numpy as np
+from PySide6.QtCore import Qt, Slot
+from PySide6.QtGui import QImage, QPixmap
+from PySide6.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QLabel, QPushButton, QSlider, QCheckBox
+
+from image_utils.thumbnail import thumbnail_path
+
+
+def to_qimage(thumbnail: np.ndarray) -> QImage:
+    """
+    RGB数组转换为QImage, 复制数据, 可在处理线程中调用(QPixmap只能在界面线程中创建)
+    :param thumbnail: 缩略图数组, 格式为RGB
+    :return: QImage
+    """
+    thumbnail = np.ascontiguousarray(thumbnail)
+    height, width = thumbnail.shape[:2]
+    return QImage(thumbnail.data, width, height, thumbnail.strides[0], QImage.Format.Format_RGB888).copy()
+
+
+class PixmapCache:
+    """
+    缩略图的LRU缓存, 按QPixmap占用的字节数限制大小, 超出时淘汰最久未显示的缩略图
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        """
+        :param max_bytes: 最大占用字节数
+        """
+        assert max_bytes > 0, "max_bytes must be positive"
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.items = OrderedDict()
+
+    @staticmethod
+    def size(pixmap: QPixmap) -> int:
+        return pixmap.width() * pixmap.height() * pixmap.depth() // 8
+
+    def get(self, key) -> QPixmap:
+        """
+        :return: 缓存的缩略图, 不存在时为None
+        """
+        pixmap = self.items.get(key)
+        if pixmap is not None:
+            self.items.move_to_end(key)
+        return pixmap
+
+    def put(self, key, pixmap: QPixmap):
+        if key in self.items:
+            self.nbytes -= self.size(self.items.pop(key))
+        self.items[key] = pixmap
+        self.nbytes += self.size(pixmap)
+        # 至少保留刚放入的缩略图
+        while self.nbytes > self.max_bytes and len(self.items) > 1:
+            _, evicted = self.items.popitem(last=False)
+            self.nbytes -= self.size(evicted)
+
+    def clear(self):
+        self.items.clear()
+        self.nbytes = 0
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+
+class PreviewPane(QWidget):
+    """
+    处理结果预览
+    显示最新完成图像的带标注缩略图, 可拖动滑块或点击按钮浏览之前的结果;
+    缩略图在处理线程中生成, 界面线程只把QImage转换为QPixmap, 放入按字节数限制的LRU缓存;
+    已被淘汰的缩略图从磁盘缓存读取(启用时), 每条结果只保存路径与文件名, 数万张图像后浏览仍然流畅
+    """
+
+    def __init__(self, size: int = 384, max_bytes: int = 64 * 1024 * 1024, parent: QWidget = None):
+        """
+        :param size: 显示区域的边长, 与缩略图的最大边长一致
+        :param max_bytes: 内存中缩略图缓存的最大字节数
+        """
+        super().__init__(parent)
+        self.cache = PixmapCache(max_bytes)
+        self.directory = None
+        # 各结果的 (图像路径, 文件名)
+        self.entries = []
+        self.current = -1
+
+        self.image_label = QLabel("无预览")
+        self.image_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.image_label.setMinimumSize(size, size)
+        self.info_label = QLabel("---")
+        self.slider = QSlider(Qt.Orientation.Horizontal)
+        self.slider.setRange(0, 0)
+        self.previous_button = QPushButton("上一张")
+        self.next_button = QPushButton("下一张")
+        self.follow = QCheckBox("显示最新")
+        self.follow.setChecked(True)
+
+        buttons_layout = QHBoxLayout()
+        buttons_layout.addWidget(self.previous_button, 1)
+        buttons_layout.addWidget(self.next_button, 1)
+        buttons_layout.addWidget(self.follow, 1)
+        layout = QVBoxLayout()
+        layout.addWidget(self.image_label, 1)
+        layout.addWidget(self.info_label)
+        layout.addWidget(self.slider)
+        layout.addLayout(buttons_layout)
+        layout.setContentsMargins(0, 0, 0, 0)
+        self.setLayout(layout)
+
+        self.slider.valueChanged.connect(self.show_entry)
+        self.previous_button.clicked.connect(lambda: self.browse(-1))
+        self.next_button.clicked.connect(lambda: self.browse(1))
+
+    def reset(self, directory: str = None):
+        """
+        开始新的一批处理时清空预览
+        :param directory: 缩略图磁盘缓存目录, 为None时不从磁盘读取
+        """
+        self.directory = directory
+        self.entries = []
+        self.current = -1
+        self.cache.clear()
+        self.follow.setChecked(True)
+        self.slider.blockSignals(True)
+        self.slider.setRange(0, 0)
+        self.slider.blockSignals(False)
+        self.image_label.clear()
+        self.image_label.setText("无预览")
+        self.info_label.setText("---")
+
+    def add(self, image_path: str, filename: str, image: QImage = None):
+        """
+        添加一条结果
+        :param image_path: 原始图像路径
+        :param filename: 图像文件名
+        :param image: 处理线程生成的缩略图, 为None时(如清单中已有的结果)从磁盘缓存读取
+        """
+        index = len(self.entries)
+        self.entries.append((image_path, filename))
+        if image is not None and not image.isNull():
+            self.cache.put(index, QPixmap.fromImage(image))
+        following = self.follow.isChecked()
+        self.slider.blockSignals(True)
+        self.slider.setMaximum(index)
+        if following:
+            self.slider.setValue(index)
+        self.slider.blockSignals(False)
+        if following:
+            self.show_entry(index)
+        else:
+            self.info_label.setText(self.describe(self.current))
+
+    def browse(self, step: int):
+        # 手动浏览时不再跟随最新结果
+        self.follow.setChecked(False)
+        self.slider.setValue(self.slider.value() + step)
+
+    def describe(self, index: int) -> str:
+        if index < 0:
+            return "---"
+        return f"{index + 1} / {len(self.entries)}  {self.entries[index][1]}"
+
+    def pixmap(self, index: int) -> QPixmap:
+        """
+        :return: 第index条结果的缩略图, 内存缓存中没有时读取磁盘缓存, 都没有时为None
+        """
+        pixmap = self.cache.get(index)
+        if pixmap is None and self.directory is not None:
+            path = thumbnail_path(self.directory, self.entries[index][0])
+            if path.exists():
+                pixmap = QPixmap(str(path))
+                if not pixmap.isNull():
+                    self.cache.put(index, pixmap)
+                else:
+                    pixmap = None
+        return pixmap
+
+    @Slot(int)
+    def show_entry(self, index: int):
+        if not 0 <= index < len(self.entries):
+            return
+        self.current = index
+        pixmap = self.pixmap(index)
+        if pixmap is None:
+            self.image_label.clear()
+            self.image_label.setText("无预览")
+        else:
+            self.image_label.setPixmap(pixmap)
+        self.info_label.setText(self.describe(index))
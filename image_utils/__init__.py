@@ -0,0 +1,45 @@
+"""
+底栖动物图像分割
+
+常用接口可直接从包中导入, 如 ``from image_utils import main``;
+对应模块在第一次访问时才导入, 导入包本身不会加载OpenCV、Pillow、scikit-learn等依赖
+"""
+import importlib
+
+# 名称 -> 所在模块
+_EXPORTS = {
+    'main': 'image_utils.api',
+    'cut': 'image_utils.api',
+    'get_result': 'image_utils.api',
+    'get_connect_part_of_image': 'image_utils.api',
+    'fit_segmentation_model': 'image_utils.api',
+    'open_archive': 'image_utils.archive',
+    'BatchProcessor': 'image_utils.batch',
+    'process_images': 'image_utils.batch',
+    'DecodeCache': 'image_utils.cache',
+    'Codec': 'image_utils.codec',
+    'ResultManifest': 'image_utils.manifest',
+    'SegmentationModel': 'image_utils.model',
+    'Pipeline': 'image_utils.pipeline',
+    'Profiler': 'image_utils.profiling',
+    'RegionTable': 'image_utils.regions',
+    'open_sink': 'image_utils.sink',
+    'StagedProcessor': 'image_utils.staged',
+    'get_connect_part_tiled': 'image_utils.tiled',
+    'get_result_tiled': 'image_utils.tiled',
+    'ImageWriter': 'image_utils.writer',
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name: str):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_EXPORTS[name]), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS))
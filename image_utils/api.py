@@ -1,59 +1,148 @@
 import time
+from functools import lru_cache
 from pathlib import Path
 from types import SimpleNamespace
 
 import numpy as np
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image
 from cv2 import GaussianBlur
 
-from image_utils.core import cluster_image, closing, get_connect_part, get_area
+from image_utils.archive import ARCHIVES, CropArchive, write_archive
+from image_utils.codec import Codec
+from image_utils.model import SegmentationModel
+from image_utils.pipeline import Pipeline, load_image
+from image_utils.profiling import Profiler, Trace, NULL_TRACE
+from image_utils.render import AnnotationRenderer, BUNDLED_FONT
+from image_utils.thumbnail import make_thumbnail
+from image_utils.tiled import get_result_tiled
+from image_utils.writer import ImageWriter, write_image, image_nbytes
 import importlib.resources as pkg_resources
 
+# 各输出的默认编码设置: 标注原图为None, 即按原图像的文件格式由PIL保存; 前景图像带透明通道, 保存为png
+DEFAULT_CODECS = dict(origin=None, foreground=Codec('png'), origin_cut=Codec('png'), foreground_cut=Codec('png'))
 
-def get_connect_part_of_image(image: str, piex_threshold: int = 5000) -> SimpleNamespace:
+
+def fit_segmentation_model(images, n_images: int = 8, model: SegmentationModel = None) -> SegmentationModel:
+    """
+    使用前n_images张图像拟合分割模型, 之后整批图像共用该模型
+    :param images: 图像路径的可迭代对象
+    :param n_images: 用于拟合的图像数量
+    :param model: 待拟合的分割模型, 默认新建SegmentationModel
+    :return: 已拟合的分割模型
+    """
+    model = model or SegmentationModel()
+    images = [image for image, _ in zip(images, range(n_images))]
+    assert images, "images must not be empty"
+    return model.fit(GaussianBlur(np.array(Image.open(image)), (5, 5), 0) for image in images)
+
+
+@lru_cache(maxsize=1)
+def get_renderer() -> AnnotationRenderer:
+    """
+    获取默认标注渲染器, 字体每个进程只加载一次
+    :return: 标注渲染器
+    """
+    return AnnotationRenderer()
+
+
+def get_connect_part_of_image(image, piex_threshold: int = 5000,
+                              model: SegmentationModel = None, backend: str = 'kmeans',
+                              scale: float = 1.0, band_width: int = 8) -> SimpleNamespace:
     """
     获取连通区域
-    :param image: 图像路径
+    :param image: 图像路径或图像数组(格式RGB)
     :param piex_threshold: 像素阈值,连通区域像素值小于piex_threshold的进行过滤。 piex_threshold默认为0
+    :param model: 分割模型, 为None时对每张图像单独进行聚类
+    :param backend: 聚类方式, 见 core.cluster_image; 传入model时查找表使用模型的聚类中心
+    :param scale: 缩放比例, 小于1时先在缩小的图像上聚类, 再只对边界带内的像素在原分辨率下重新分类
+    :param band_width: 边界带宽度(原分辨率像素), 仅在scale小于1时生效
     :return: 连通区域
     """
-    assert Path(image).exists(), "image must be exists"
-    image = np.array(Image.open(image))
-    image = GaussianBlur(image, (5, 5), 0)
-    image = cluster_image(image, n_clusters=2)
-    image = (255 - image * 255).astype(np.uint8)
-    image = closing(image, kernel_size=5, iterations=5)
-    connected_part = get_connect_part(image, piex_threshold=piex_threshold)
-    return connected_part
+    pipeline = Pipeline(piex_threshold=piex_threshold, model=model, backend=backend, scale=scale,
+                        band_width=band_width, reuse_buffers=False)
+    return pipeline.segment(pipeline.decode(image), source=None if isinstance(image, np.ndarray) else image)
 
 
-def get_result(origin_image: str, connect_info: SimpleNamespace = None,
-               piex_threshold: int = 5000) -> SimpleNamespace:
+def group_by_shape(images, batch_size: int = 8, decode=None):
     """
-    将图片进行处理后的最终结果
+    把图像按尺寸分组, 同尺寸的图像每batch_size张组成一组, 输入结束时输出不足batch_size的组
+    :param images: 图像路径或图像数组的可迭代对象
+    :param batch_size: 每组的图像数量
+    :param decode: 解码函数, 默认为 pipeline.load_image
+    :return: 迭代器, 每项包含 indices(输入中的序号), images(输入), stack((N, H, W, C)图像组)
+    """
+    assert batch_size > 0, "batch_size must be positive"
+    decode = decode or load_image
+    groups = {}
+    for index, image in enumerate(images):
+        array = decode(image)
+        group = groups.setdefault(array.shape, [])
+        group.append((index, image, array))
+        if len(group) == batch_size:
+            yield _stack_group(groups.pop(array.shape))
+    for group in groups.values():
+        yield _stack_group(group)
+
+
+def _stack_group(group: list) -> SimpleNamespace:
+    indices, images, arrays = zip(*group)
+    return SimpleNamespace(indices=list(indices), images=list(images), stack=np.stack(arrays))
+
+
+def get_connect_part_of_images(images, batch_size: int = 8, piex_threshold: int = 5000,
+                               model: SegmentationModel = None, backend: str = 'kmeans', scale: float = 1.0,
+                               band_width: int = 8):
+    """
+    批量获取连通区域: 按尺寸分组后整组处理, 见 Pipeline.segment_stack
+    :param images: 图像路径或图像数组(格式RGB)的可迭代对象
+    :param batch_size: 每组的图像数量
+    :param piex_threshold: 像素阈值, 见 get_connect_part_of_image
+    :param model: 分割模型, 为None且backend为'kmeans'/'minibatch'时每组共用一次聚类拟合
+    :param backend: 聚类方式, 见 core.cluster_image
+    :param scale: 缩放比例, 见 get_connect_part_of_image
+    :param band_width: 边界带宽度, 见 get_connect_part_of_image
+    :return: 迭代器, 按每组完成的顺序返回 index(输入中的序号), image(输入), connect_info(连通区域)
+    """
+    pipeline = Pipeline(piex_threshold=piex_threshold, model=model, backend=backend, scale=scale,
+                        band_width=band_width)
+    for group in group_by_shape(images, batch_size=batch_size):
+        for index, image, connect_info in zip(group.indices, group.images, pipeline.segment_stack(group.stack)):
+            yield SimpleNamespace(index=index, image=image, connect_info=connect_info)
+
+
+def get_result(origin_image, connect_info: SimpleNamespace = None,
+               piex_threshold: int = 5000, model: SegmentationModel = None,
+               backend: str = 'kmeans', scale: float = 1.0, band_width: int = 8,
+               filename: str = None, pipeline: Pipeline = None) -> SimpleNamespace:
+    """
+    将图片进行处理后的最终结果, 图像只解码一次
     :param origin_image: 原始图像数组（格式RGB）或者原始图像路径
     :param connect_info: 连通区域信息
     :param piex_threshold: 连通部分像素阈值，小于阈值的连通区域将被认为是噪声
+    :param model: 分割模型, 为None时对每张图像单独进行聚类
+    :param backend: 聚类方式, 见 core.cluster_image
+    :param scale: 缩放比例, 见 get_connect_part_of_image
+    :param band_width: 边界带宽度, 见 get_connect_part_of_image
+    :param filename: 图像文件名, origin_image为图像数组时必须指定
+    :param pipeline: 处理流水线, 指定时忽略上述处理参数, 可在多张图像之间复用缓冲区
     :return:
     """
-    assert Path(origin_image).exists(), "image must be exists"
+    if pipeline is None:
+        pipeline = Pipeline(piex_threshold=piex_threshold, model=model, backend=backend, scale=scale,
+                            band_width=band_width, reuse_buffers=False)
+    if filename is None:
+        assert not isinstance(origin_image, np.ndarray), "filename is required for image array"
+        filename = Path(origin_image).name
+    image = pipeline.decode(origin_image)
     if not connect_info:
-        connect_info = get_connect_part_of_image(origin_image, piex_threshold=piex_threshold)
-    image = np.array(Image.open(origin_image))
-    foreground = connect_info.labeled_img.astype(np.uint8)
-    foreground = np.dstack((image, foreground))
-    return SimpleNamespace(
-        image=image,
-        foreground=foreground,
-        cls=connect_info.number_cls,
-        area=[get_area(item).mm for item in connect_info.piex],
-        boxes=connect_info.boxes,
-        filename=Path(origin_image).name
-    )
+        connect_info = pipeline.segment(image, source=None if isinstance(origin_image, np.ndarray) else origin_image)
+    return pipeline.render(image, connect_info, filename)
 
 
 def cut(connect_info: SimpleNamespace, origin_path: str = None, foreground_path=None,
-        origin_cut_path: str = None, foreground_cut_path: str = None):
+        origin_cut_path: str = None, foreground_cut_path: str = None, writer: ImageWriter = None,
+        tag: str = None, renderer: AnnotationRenderer = None, trace: Trace = None, codecs: dict = None,
+        archive=None):
     """
     将图片进行处理后的最终结果
     :param connect_info: 连通区域信息
@@ -61,61 +150,84 @@ def cut(connect_info: SimpleNamespace, origin_path: str = None, foreground_path=
     :param foreground_path: 前景图像保存路径
     :param origin_cut_path: 原始图像保存路径
     :param foreground_cut_path: 前景图像保存路径
+    :param writer: 后台写入器, 为None时同步写入; 写入错误由 writer.flush 返回
+    :param tag: 写入任务标记, 随写入错误返回, 默认为图像文件名
+    :param renderer: 标注渲染器, 默认使用 get_renderer()
+    :param trace: 记录写入字节数'bytes_written'; 后台写入时另记排队的'bytes_queued', 'bytes_written'在写入完成时计入
+    :param codecs: 各输出的编码设置, 键为'origin'、'foreground'、'origin_cut'、'foreground_cut',
+                   未指定的使用DEFAULT_CODECS; 前景图像的编码必须支持透明通道
+    :param archive: 切割图像的保存方式: None为逐个保存; 'zip'或'tar'为每张图像的每种切割图一个包,
+                    保存为 切割目录/图像名.zip; CropArchive为写入整批共用的包, 由调用方在写入完成后关闭
     :return:
     """
-    # 路径校验
-    if origin_path and not Path(origin_path).exists():
-        Path(origin_path).mkdir(parents=True)
-    if foreground_path and not Path(foreground_path).exists():
-        Path(foreground_path).mkdir(parents=True)
-    if origin_cut_path and not Path(origin_cut_path).exists():
-        Path(origin_cut_path).mkdir(parents=True)
-    if foreground_cut_path and not Path(foreground_cut_path).exists():
-        Path(foreground_cut_path).mkdir(parents=True)
+    tag = tag or connect_info.filename
+    # 后台写入完成时计入字节数的Trace, 未指定时由写入器自己的性能分析器记录
+    write_trace = trace
+    trace = trace or NULL_TRACE
+    codecs = dict(DEFAULT_CODECS, **(codecs or {}))
+    assert archive is None or isinstance(archive, CropArchive) or archive in ARCHIVES, \
+        f"archive must be None, CropArchive or one of {tuple(ARCHIVES)}"
+    assert not foreground_path or codecs['foreground'] is None or codecs['foreground'].alpha, \
+        "foreground codec must support alpha channel"
+    assert not foreground_cut_path or codecs['foreground_cut'].alpha, \
+        "foreground_cut codec must support alpha channel"
 
-    if origin_path:
-        img_o = Image.fromarray(connect_info.image, 'RGB')
-        draw_o = ImageDraw.Draw(img_o)
-    if foreground_path:
-        img_f = Image.fromarray(connect_info.foreground, 'RGBA')
-        draw_f = ImageDraw.Draw(img_f)
-    font = ImageFont.truetype(
-        'msyh.ttc',
-        30)
-
-    index_font = ImageFont.truetype(
-        'msyhbd.ttc',
-        60)
-    color = (255, 0, 0)
-    boundary_width = 4
-
-    for index in range(connect_info.cls):
-        box = connect_info.boxes[index]
-        filename = f'{index + 1}_{connect_info.area[index]}mm2_{Path(connect_info.filename).stem}.png'
-        if origin_cut_path:
-            Image.fromarray(connect_info.image[box[0]:box[2], box[1]:box[3], :], 'RGB').save(
-                Path(origin_cut_path) / filename)
-        if foreground_cut_path:
-            Image.fromarray(connect_info.foreground[box[0]:box[2], box[1]:box[3], :], 'RGBA').save(
-                Path(foreground_cut_path) / filename)
-
-        # 画框并添加文字
-        if origin_path:
-            # 使用PIL画框
-            draw_o.rectangle((box[1], box[0], box[3], box[2]), outline=color, width=boundary_width)
-            draw_o.text((box[1] + (box[3] - box[1] - 30) // 2, box[0]), f'{index + 1}', font=index_font, fill=color)
-            draw_o.text((box[1] + 10, box[2] - 40), f'{connect_info.area[index]}', font=font, fill=color)
-
-        if foreground_path:
-            # 使用PIL画框
-            draw_f.rectangle((box[1], box[0], box[3], box[2]), outline=color, width=boundary_width)
-            draw_f.text((box[1] + (box[3] - box[1] - 30) // 2, box[0]), f'{index + 1}', font=index_font, fill=color)
-            draw_f.text((box[1] + 10, box[2] - 40), f'{connect_info.area[index]}', font=font, fill=color)
+    def save(image, path, **params):
+        written = write_image(image, path, writer=writer, tag=tag, trace=write_trace, **params)
+        if written is None:
+            trace.count('bytes_queued', image_nbytes(image))
+        else:
+            trace.count('bytes_written', written)
+
+    def save_archive(items, path, codec):
+        if writer is None:
+            trace.count('bytes_written', write_archive(path, items, codec, format=archive))
+        else:
+            writer.submit_archive(items, path, codec, format=archive, tag=tag, trace=write_trace)
+            trace.count('bytes_queued', sum(image_nbytes(image) for _, image in items))
+
+    # 路径校验, 写入共用的包时不需要切割目录
+    shared = isinstance(archive, CropArchive)
+    for path in (origin_path, foreground_path, None if shared else origin_cut_path,
+                 None if shared else foreground_cut_path):
+        if path:
+            Path(path).mkdir(parents=True, exist_ok=True)
+
+    stem = Path(connect_info.filename).stem
+    outputs = []
+    if origin_cut_path:
+        outputs.append((Path(origin_cut_path), connect_info.image, codecs['origin_cut']))
+    if foreground_cut_path:
+        outputs.append((Path(foreground_cut_path), connect_info.foreground, codecs['foreground_cut']))
+    for cut_path, source, codec in outputs:
+        items = []
+        for index in range(connect_info.cls):
+            box = connect_info.boxes[index]
+            filename = f'{index + 1}_{connect_info.area[index]}mm2_{stem}{codec.suffix}'
+            items.append((cut_path / filename, source[box[0]:box[2], box[1]:box[3], :]))
+        if archive is None or shared:
+            for path, crop in items:
+                save(crop, path, codec=codec, archive=archive)
+        elif items:
+            save_archive([(path.name, crop) for path, crop in items], cut_path / f'{stem}{ARCHIVES[archive]}',
+                         codec)
+
+    if not origin_path and not foreground_path:
+        return
+    # 画框并添加文字: 标注只绘制一次, 再合成到需要保存的图像上
+    renderer = renderer or get_renderer()
+    height, width = connect_info.image.shape[:2]
+    overlay = renderer.overlay((width, height), connect_info.boxes[:connect_info.cls], connect_info.area)
+
+    def filename(codec: Codec) -> str:
+        return connect_info.filename if codec is None else stem + codec.suffix
 
     if origin_path:
-        img_o.save(Path(origin_path) / connect_info.filename)
+        img_o = renderer.composite(Image.fromarray(connect_info.image, 'RGB'), overlay)
+        save(img_o, Path(origin_path) / filename(codecs['origin']), codec=codecs['origin'])
     if foreground_path:
-        img_f.save(Path(foreground_path) / connect_info.filename)
+        img_f = renderer.composite(Image.fromarray(np.asarray(connect_info.foreground), 'RGBA'), overlay)
+        save(img_f, Path(foreground_path) / filename(codecs['foreground']), codec=codecs['foreground'])
 
 
 def get_image_save_path(image_path: str, save_path: str, source_dir: str):
@@ -146,48 +258,109 @@ def get_image_save_path(image_path: str, save_path: str, source_dir: str):
     )
 
 
-def main(image: str, save_path: str, source_dir: str, cut_image: bool = False, foreground: bool = False,
-         piex_threshold: int = 5000):
+def get_output_paths(image: str, save_path: str, source_dir: str, cut_image: bool = False,
+                     foreground: bool = False) -> SimpleNamespace:
     """
-    :param image: 原始图像路径
-    :param save_path: 保存路径
-    :param source_dir: 原始图像所在目录
+    获取需要保存的输出路径
+    :param image: 图像绝对路径
+    :param save_path: 图像保存目录
+    :param source_dir: 图片所在源目录
     :param cut_image: 是否进行切割
     :param foreground: 是否保存前景图像
-    :param piex_threshold: 连通部分像素阈值，小于阈值的连通区域将被认为是噪声
-    :return:
+    :return: origin_path, foreground_path, origin_cut_path, foreground_cut_path, 不需要保存的为None
     """
-
-    start = time.time()
-    assert Path(image).exists(), "image must be exists"
-    assert Path(save_path).exists(), "save_path must be exists"
-    assert Path(source_dir).exists(), "source_dir must be exists"
-
     path = get_image_save_path(image, save_path, source_dir)
-    origin_path = path.origin_path
-    foreground_path = path.foreground_path
-    origin_cut_path = path.origin_cut_path
-    foreground_cut_path = path.foreground_cut_path
     if not cut_image:
-        foreground_cut_path = None
-        origin_cut_path = None
+        path.foreground_cut_path = None
+        path.origin_cut_path = None
     if not foreground:
-        foreground_path = None
-        foreground_cut_path = None
+        path.foreground_path = None
+        path.foreground_cut_path = None
+    return path
+
 
-    connect_info = get_result(image, piex_threshold=piex_threshold)
-    cut(connect_info, origin_path=origin_path, foreground_path=foreground_path, origin_cut_path=origin_cut_path,
-        foreground_cut_path=foreground_cut_path)
-    end = time.time()
+def make_result(image: str, connect_info: SimpleNamespace, elapsed: float, trace: Trace,
+                thumbnail: np.ndarray = None) -> SimpleNamespace:
+    """
+    单张图像的处理结果, 见 main
+    :param image: 原始图像路径
+    :param connect_info: get_result 的结果
+    :param elapsed: 处理耗时(秒)
+    :param trace: 当前图像的 Trace
+    :param thumbnail: 带标注的缩略图, 见 thumbnail.make_thumbnail
+    :return: 处理结果
+    """
     return SimpleNamespace(
         image_path=image,
         cls=connect_info.cls,
         area=connect_info.area,
         boxes=connect_info.boxes,
+        regions=connect_info.regions,
+        thumbnail=thumbnail,
         filename=connect_info.filename,
-        time=end - start,
+        time=elapsed,
+        stages=trace.stages,
+        counters=trace.counters,
     )
 
 
+def main(image: str, save_path: str, source_dir: str, cut_image: bool = False, foreground: bool = False,
+         piex_threshold: int = 5000, model: SegmentationModel = None, backend: str = 'kmeans',
+         scale: float = 1.0, band_width: int = 8, pipeline: Pipeline = None, writer: ImageWriter = None,
+         profiler: Profiler = None, codecs: dict = None, archive=None, thumbnail: int = None,
+         tile_size: int = None):
+    """
+    :param image: 原始图像路径
+    :param save_path: 保存路径
+    :param source_dir: 原始图像所在目录
+    :param cut_image: 是否进行切割
+    :param foreground: 是否保存前景图像
+    :param piex_threshold: 连通部分像素阈值，小于阈值的连通区域将被认为是噪声
+    :param model: 分割模型, 同一批图像传入同一模型时只需拟合一次
+    :param backend: 聚类方式, 'kmeans'、'minibatch'、'lut_full' 或 'lut_quantized'
+    :param scale: 缩放比例, 小于1时使用由粗到细的分割
+    :param band_width: 由粗到细分割时边界带宽度(原分辨率像素)
+    :param pipeline: 处理流水线, 指定时忽略上述处理参数, 同一批图像复用可减少内存分配
+    :param writer: 后台写入器, 为None时同步写入; 由调用方在整批结束时调用 writer.close
+    :param profiler: 性能分析器, 默认使用pipeline.profiler
+    :param codecs: 各输出的编码设置, 见 cut
+    :param archive: 切割图像的保存方式, 见 cut
+    :param thumbnail: 缩略图的最大边长, 指定时在处理线程中由已解码的图像生成带标注的缩略图
+    :param tile_size: 分块边长, 指定时按块处理超大拼接图(见 tiled.get_result_tiled), 整幅图像不在内存中;
+                      只保存切割图像, 不保存整幅的标注图与前景图, 不能与scale、thumbnail同时使用
+    :return: 其中regions为连通区域表(regions.RegionTable), thumbnail为缩略图(RGB数组, 未指定时为None),
+             stages为各阶段耗时(秒), counters为像素数、区域数与写入字节数
+    """
+
+    start = time.time()
+    assert Path(image).exists(), "image must be exists"
+    assert Path(save_path).exists(), "save_path must be exists"
+    assert Path(source_dir).exists(), "source_dir must be exists"
+
+    paths = get_output_paths(image, save_path, source_dir, cut_image=cut_image, foreground=foreground)
+    if pipeline is None:
+        pipeline = Pipeline(piex_threshold=piex_threshold, model=model, backend=backend, scale=scale,
+                            band_width=band_width, reuse_buffers=False)
+    if tile_size is not None:
+        assert pipeline.scale == 1 and thumbnail is None, "scale and thumbnail are not supported with tile_size"
+        # 整幅的标注图与前景图需要整幅图像在内存中
+        paths.origin_path = paths.foreground_path = None
+    trace = pipeline.begin(image, profiler)
+    try:
+        if tile_size is None:
+            connect_info = get_result(image, pipeline=pipeline)
+        else:
+            connect_info = get_result_tiled(image, tile_size=tile_size, pipeline=pipeline)
+        with trace.stage('cut'):
+            cut(connect_info, **vars(paths), writer=writer, tag=image, trace=trace, codecs=codecs, archive=archive)
+        preview = None
+        if thumbnail is not None:
+            with trace.stage('thumbnail'):
+                preview = make_thumbnail(connect_info.image, connect_info.boxes, max_size=thumbnail)
+    finally:
+        pipeline.end()
+    return make_result(image, connect_info, time.time() - start, trace, thumbnail=preview)
+
+
 if __name__ == '__main__':
-    print(pkg_resources.files('image_utils').joinpath('font/yahei.ttf').__str__())
+    print(pkg_resources.files('image_utils').joinpath(BUNDLED_FONT).__str__())
@@ -0,0 +1,170 @@
+import os
+from abc import ABC, abstractmethod
+import tarfile
+import threading
+import time
+import zipfile
+from io import BytesIO
+from pathlib import Path
+
+from image_utils.codec import Codec
+
+# 打包格式 -> 扩展名
+ARCHIVES = {'zip': '.zip', 'tar': '.tar'}
+
+
+class CropArchive(ABC):
+    """
+    切割图像包
+    把大量小图像写入一个不压缩的包文件, 代替逐个保存的小文件; 可在多个写入线程间共用;
+    不追加到已有的包: 中断后留下的包可能不完整, 继续处理时写入新的包, 见 new_archive
+    """
+    format = None
+
+    def __init__(self, path: str, root: str = None, mode: str = 'w'):
+        """
+        :param path: 包文件路径
+        :param root: 包内路径相对于root, 默认只保留文件名
+        :param mode: 'w'为新建(覆盖已有的文件), 'x'为新建且文件已存在时抛出FileExistsError
+        """
+        assert mode in ('w', 'x'), "mode must be 'w' or 'x'"
+        self.path = Path(path)
+        self.root = Path(root) if root is not None else None
+        self.lock = threading.Lock()
+        self.count = 0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+    def name(self, path) -> str:
+        """
+        包内路径, 以/分隔
+        :param path: 逐个保存时的文件路径
+        """
+        path = Path(path)
+        if self.root is None:
+            return path.name
+        return path.relative_to(self.root).as_posix()
+
+    def add(self, path, data: bytes) -> int:
+        """
+        写入一个文件
+        :param path: 逐个保存时的文件路径, 见 name
+        :param data: 文件内容
+        :return: 写入的字节数
+        """
+        with self.lock:
+            self._add(self.name(path), data)
+            self.count += 1
+        return len(data)
+
+    @abstractmethod
+    def _add(self, name: str, data: bytes):
+        """
+        写入一个文件, 调用时已持有self.lock
+        :param name: 包内路径
+        :param data: 文件内容
+        """
+
+    @abstractmethod
+    def close(self):
+        """
+        写入包的目录并关闭文件
+        """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class ZipArchive(CropArchive):
+    """
+    不压缩的zip包, 图像已经过编码, 再压缩只会更慢;
+    目录在close时才写入, 未正常关闭的包无法读取, 不适合在处理过程中记录结果的整批共用包
+    """
+    format = 'zip'
+
+    def __init__(self, path: str, root: str = None, mode: str = 'w'):
+        super().__init__(path, root, mode)
+        self.file = zipfile.ZipFile(self.path, mode, compression=zipfile.ZIP_STORED, allowZip64=True)
+
+    def _add(self, name: str, data: bytes):
+        self.file.writestr(zipfile.ZipInfo(name, time.localtime()[:6]), data)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+class TarArchive(CropArchive):
+    """
+    不压缩的tar包, 每个文件写入后立即刷新到文件, add返回后即使进程中断也可读取
+    """
+    format = 'tar'
+
+    def __init__(self, path: str, root: str = None, mode: str = 'w'):
+        super().__init__(path, root, mode)
+        self.file = tarfile.open(self.path, mode)
+
+    def _add(self, name: str, data: bytes):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = time.time()
+        self.file.addfile(info, BytesIO(data))
+        self.file.fileobj.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+_ARCHIVE_TYPES = {'zip': ZipArchive, 'tar': TarArchive}
+
+
+def open_archive(path: str, format: str = None, root: str = None, mode: str = 'w') -> CropArchive:
+    """
+    打开切割图像包
+    :param path: 包文件路径
+    :param format: 打包格式, 见ARCHIVES, 默认由扩展名决定
+    :param root: 见 CropArchive
+    :param mode: 见 CropArchive
+    :return: 切割图像包
+    """
+    format = format or Path(path).suffix.lower().lstrip('.')
+    assert format in ARCHIVES, f"format must be one of {tuple(ARCHIVES)}"
+    return _ARCHIVE_TYPES[format](path, root=root, mode=mode)
+
+
+def new_archive(directory: str, name: str = 'crops', format: str = 'tar', root: str = None) -> CropArchive:
+    """
+    在目录中新建一个编号的包 名称_编号.扩展名, 编号取第一个不存在的, 多个进程同时新建时也不会重复;
+    每次运行写入自己的包, 中断后继续处理不会追加到不完整的包, 也不会在同一个包中写入重名文件
+    :param directory: 所在目录
+    :param name: 包文件名前缀
+    :param format: 打包格式, 见ARCHIVES; 处理过程中就记录结果时应为'tar', 见 ZipArchive
+    :param root: 见 CropArchive
+    :return: 切割图像包
+    """
+    assert format in ARCHIVES, f"format must be one of {tuple(ARCHIVES)}"
+    index = 0
+    while True:
+        try:
+            return open_archive(Path(directory) / f'{name}_{index}{ARCHIVES[format]}', format=format, root=root,
+                                mode='x')
+        except FileExistsError:
+            index += 1
+
+
+def write_archive(path: str, items: list, codec: Codec, format: str = None) -> int:
+    """
+    把一组图像编码后写入一个新的包文件
+    :param path: 包文件路径
+    :param items: [(包内文件名, 图像数组或PIL图像)]
+    :param codec: 图像编码设置
+    :param format: 打包格式, 默认由扩展名决定
+    :return: 包文件的字节数
+    """
+    with open_archive(path, format=format) as archive:
+        for name, image in items:
+            archive.add(name, codec.encode(image))
+    return os.path.getsize(path)
@@ -0,0 +1,257 @@
+import os
+import threading
+import traceback
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from itertools import islice, chain
+from multiprocessing.util import Finalize
+from types import SimpleNamespace
+from typing import Iterable, Iterator
+
+from image_utils.api import main, fit_segmentation_model
+from image_utils.archive import ARCHIVES, new_archive
+from image_utils.cache import DecodeCache
+from image_utils.manifest import ResultManifest
+from image_utils.pipeline import Pipeline
+from image_utils.sink import ResultSink, open_sink
+from image_utils.tiled import fit_tiled_model
+from image_utils.writer import ImageWriter
+
+# 工作进程内的全局状态, 由 _init_worker 初始化, 每个进程只创建一次流水线和写入器
+_worker = SimpleNamespace(pipeline=None, writer=None, options=None, archive=None)
+
+
+def _init_worker(options: dict, pipeline_options: dict, writer_threads: int, writer_bytes: int,
+                 run_archive: str = None):
+    _worker.options = options
+    _worker.pipeline = Pipeline(**pipeline_options)
+    _worker.writer = ImageWriter(writer_threads, max_bytes=writer_bytes) if writer_threads else None
+    if run_archive is not None:
+        # 每个进程新建自己的包(crops_编号.tar), 进程正常退出时关闭; 写入器在每块结束时已清空,
+        # tar包的文件在写入后即可读取, 块的结果返回给主进程记录到结果清单时切割图像已在包中
+        save_path = options['save_path']
+        _worker.archive = new_archive(save_path, format=run_archive, root=save_path)
+        Finalize(_worker.archive, _worker.archive.close, exitpriority=10)
+        _worker.options = dict(options, archive=_worker.archive)
+
+
+def _process_chunk(chunk: list) -> list:
+    results = [process_one(index, image, pipeline=_worker.pipeline, writer=_worker.writer, **_worker.options)
+               for index, image in chunk]
+    if _worker.writer is not None:
+        # 整块写入完成后再返回, 写入错误记到对应图像上
+        for error in _worker.writer.flush():
+            for result in results:
+                if result.image_path == error.tag and result.error is None:
+                    result.error = f'{error.path}: {error.error}'
+    return results
+
+
+def process_one(index: int, image: str, **options) -> SimpleNamespace:
+    """
+    处理单张图像并捕获异常
+    :param index: 图像在输入中的序号
+    :param image: 图像路径
+    :param options: api.main 的参数
+    :return: index, image_path, result(失败时为None), error(成功时为None), skipped(是否取自结果清单)
+    """
+    try:
+        result = main(image, **options)
+        return SimpleNamespace(index=index, image_path=image, result=result, error=None, traceback=None,
+                               skipped=False)
+    except Exception as e:
+        return SimpleNamespace(index=index, image_path=image, result=None,
+                               error=f'{type(e).__name__}: {e}', traceback=traceback.format_exc(), skipped=False)
+
+
+class BatchProcessor:
+    """
+    多进程批量处理
+    按块把图像分发到进程池, 每张图像完成后立即返回结果(带原始序号),
+    单张图像的异常被记录在结果中而不会中断整批处理, 可随时取消
+    """
+
+    def __init__(self, save_path: str, source_dir: str, workers: int = None, chunksize: int = 1,
+                 max_pending: int = None, cut_image: bool = False, foreground: bool = False,
+                 piex_threshold: int = 5000, model=None, backend: str = 'kmeans',
+                 scale: float = 1.0, band_width: int = 8, fit_images: int = 8, writer_threads: int = 2,
+                 writer_bytes: int = 256 << 20, cache: DecodeCache = None, manifest: str = None,
+                 sink=None, codecs: dict = None, archive: str = None, archive_scope: str = 'image',
+                 tile_size: int = None):
+        """
+        :param save_path: 保存路径
+        :param source_dir: 原始图像所在目录
+        :param workers: 进程数, 默认为CPU核数
+        :param chunksize: 每个任务包含的图像数
+        :param max_pending: 同时提交的最大任务数, 默认为进程数的2倍, 用于限制对输入迭代器的预读
+        :param cut_image: 是否进行切割
+        :param foreground: 是否保存前景图像
+        :param piex_threshold: 连通部分像素阈值，小于阈值的连通区域将被认为是噪声
+        :param model: 分割模型, 未拟合时在主进程中用前fit_images张图像拟合一次后分发给各进程
+        :param backend: 聚类方式, 见 core.cluster_image
+        :param scale: 缩放比例, 见 api.get_connect_part_of_image
+        :param band_width: 边界带宽度, 见 api.get_connect_part_of_image
+        :param fit_images: 用于拟合分割模型的图像数量
+        :param writer_threads: 每个进程的后台编码线程数, 为0时同步写入
+        :param writer_bytes: 每个进程写入队列的内存上限
+        :param cache: 解码缓存, 各进程共用同一缓存目录
+        :param manifest: 结果清单路径, 指定时跳过以相同参数处理过的图像, 并在每张图像完成后立即记录结果
+        :param sink: 结果表格路径(.csv/.sqlite/.parquet)或 sink.ResultSink, 成功的结果到达后立即追加写入
+        :param codecs: 各输出的编码设置, 见 api.cut
+        :param archive: 切割图像的打包格式, 'zip'或'tar', 为None时逐个保存
+        :param archive_scope: 'image'为每张图像一个包; 'run'为每个进程一个包, 保存为 保存路径/crops_编号.tar,
+                              每次运行的每个进程新建一个包, 不追加到已有的包; 'run'只支持tar, 见 archive.ZipArchive
+        :param tile_size: 分块边长, 指定时按块处理超大拼接图, 见 api.main; 分割模型由前fit_images张图像的采样像素拟合
+        """
+        assert chunksize > 0, "chunksize must be positive"
+        assert archive is None or archive in ARCHIVES, f"archive must be one of {tuple(ARCHIVES)}"
+        assert archive_scope in ('image', 'run'), "archive_scope must be 'image' or 'run'"
+        assert archive_scope == 'image' or archive in (None, 'tar'), "archive_scope 'run' requires archive 'tar'"
+        self.workers = workers or os.cpu_count() or 1
+        self.chunksize = chunksize
+        self.max_pending = max_pending or self.workers * 2
+        self.model = model
+        # 结果清单中的模型参数: 运行时拟合的模型每次中心不同, 只记录'fit'; 传入已拟合的模型时记录其中心
+        self.model_param = None if model is None else model.centers.tolist() if model.fitted else 'fit'
+        self.fit_images = fit_images
+        self.options = dict(save_path=save_path, source_dir=source_dir, cut_image=cut_image,
+                            foreground=foreground, codecs=codecs,
+                            archive=archive if archive_scope == 'image' else None, tile_size=tile_size)
+        self.run_archive = archive if archive_scope == 'run' else None
+        self.pipeline_options = dict(piex_threshold=piex_threshold, backend=backend, scale=scale,
+                                     band_width=band_width, cache=cache)
+        self.writer_options = (writer_threads, writer_bytes)
+        self.manifest = manifest
+        self.sink = sink
+        self._cancel = threading.Event()
+
+    def cancel(self):
+        """
+        取消处理: 不再提交新任务, 已开始的任务完成后结束
+        """
+        self._cancel.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def run(self, images: Iterable[str]) -> Iterator[SimpleNamespace]:
+        """
+        批量处理图像
+        :param images: 图像路径的列表或迭代器
+        :return: 按完成顺序返回每张图像的结果, 见 process_one
+        """
+        self._cancel.clear()
+        images = iter(images)
+        if self.model is not None and not self.model.fitted:
+            head = list(islice(images, self.fit_images))
+            if head and self.options['tile_size'] is not None:
+                # 拼接图不整幅解码
+                fit_tiled_model(head, n_images=self.fit_images, model=self.model)
+            elif head:
+                fit_segmentation_model(head, n_images=self.fit_images, model=self.model)
+            images = chain(head, images)
+
+        manifest = ResultManifest(self.manifest, self.params()) if self.manifest else None
+        # 传入路径时由本次运行创建并关闭, 传入写入器时由调用方关闭
+        sink = self.sink
+        if sink is not None and not isinstance(sink, ResultSink):
+            sink = open_sink(sink)
+        skipped = []
+        process = self._process(self._unfinished(enumerate(images), manifest, skipped), skipped)
+        try:
+            for result in process:
+                if result.error is None:
+                    if manifest is not None and not result.skipped:
+                        manifest.record(result.result)
+                    if sink is not None:
+                        sink.write(result.result)
+                yield result
+        finally:
+            process.close()
+            if manifest is not None:
+                manifest.close()
+            if sink is self.sink and sink is not None:
+                sink.flush()
+            elif sink is not None:
+                sink.close()
+
+    def _process(self, enumerated: Iterator, skipped: list) -> Iterator[SimpleNamespace]:
+        """
+        在进程池中处理图像
+        :param enumerated: (序号, 图像路径)的迭代器, 取出时把取自结果清单的图像放入skipped
+        :param skipped: 取自结果清单的结果, 随处理进度依次返回
+        :return: 按完成顺序返回每张图像的结果
+        """
+        chunks = iter(lambda: list(islice(enumerated, self.chunksize)), [])
+        executor = ProcessPoolExecutor(self.workers, initializer=_init_worker,
+                                       initargs=(self.options, dict(self.pipeline_options, model=self.model),
+                                                 *self.writer_options, self.run_archive))
+        pending = {}
+        try:
+            while True:
+                if not self.cancelled:
+                    for chunk in islice(chunks, self.max_pending - len(pending)):
+                        pending[executor.submit(_process_chunk, chunk)] = chunk
+                if self.cancelled:
+                    # 取消尚未开始的任务, 等待已开始的任务完成
+                    for future in [future for future in pending if future.cancel()]:
+                        del pending[future]
+                while skipped:
+                    yield skipped.pop(0)
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    chunk = pending.pop(future)
+                    try:
+                        results = future.result()
+                    except Exception as e:
+                        # 工作进程异常退出等情况, 整块图像记为失败
+                        results = [SimpleNamespace(index=index, image_path=image, result=None,
+                                                   error=f'{type(e).__name__}: {e}', traceback=None, skipped=False)
+                                   for index, image in chunk]
+                    yield from results
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def params(self) -> dict:
+        """
+        影响处理结果的参数, 用作结果清单的键
+        :return: 参数
+        """
+        return dict(cut_image=self.options['cut_image'], foreground=self.options['foreground'],
+                    save_path=str(self.options['save_path']), codecs=self.options['codecs'],
+                    archive=self.options['archive'] or self.run_archive,
+                    # 不分块时不写入, 已有的结果清单仍然有效
+                    **({'tile_size': self.options['tile_size']} if self.options['tile_size'] is not None else {}),
+                    **({'model': self.model_param} if self.model_param is not None else {}),
+                    **{key: value for key, value in self.pipeline_options.items() if key != 'cache'})
+
+    @staticmethod
+    def _unfinished(enumerated, manifest: ResultManifest, skipped: list):
+        # 清单中已有结果的图像直接放入skipped, 其余交给进程池
+        for index, image in enumerated:
+            try:
+                result = manifest.get(image) if manifest is not None else None
+            except OSError:
+                result = None
+            if result is None:
+                yield index, image
+            else:
+                skipped.append(SimpleNamespace(index=index, image_path=image, result=result, error=None,
+                                               traceback=None, skipped=True))
+
+
+def process_images(images: Iterable[str], save_path: str, source_dir: str, workers: int = None,
+                   chunksize: int = 1, **options) -> Iterator[SimpleNamespace]:
+    """
+    多进程批量处理图像, 见 BatchProcessor
+    :param images: 图像路径的列表或迭代器
+    :param save_path: 保存路径
+    :param source_dir: 原始图像所在目录
+    :param workers: 进程数, 默认为CPU核数
+    :param chunksize: 每个任务包含的图像数
+    :param options: BatchProcessor 的其余参数
+    :return: 按完成顺序返回每张图像的结果
+    """
+    yield from BatchProcessor(save_path, source_dir, workers=workers, chunksize=chunksize, **options).run(images)
@@ -0,0 +1,170 @@
+import hashlib
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+
+# 缓存的数据类型: 解码后的图像、模糊后的图像
+CACHE_KINDS = ('decoded', 'blurred')
+
+
+class DecodeCache:
+    """
+    解码图像的磁盘缓存
+    解码(以及模糊)后的像素数组保存为.npy文件, 以内存映射方式只读打开, 不需要复制;
+    缓存键由图像路径、修改时间和文件大小决定, 总大小超过上限时按最近访问时间淘汰
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = 20 << 30, blurred: bool = False):
+        """
+        :param cache_dir: 缓存目录
+        :param max_bytes: 缓存总大小上限
+        :param blurred: 是否同时缓存模糊后的图像
+        """
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.blurred = blurred
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        # 缓存总大小, 首次写入时统计, 之后增量维护; 可在多个线程间共用, 总大小与淘汰由锁保护
+        self.total = None
+        # 正在写入的字节数, 已计入total但还不在缓存目录中
+        self.writing = 0
+        self.lock = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        # 传给工作进程(如spawn方式启动的进程池)时不复制锁与计数, 每个进程在首次写入时重新统计
+        state = dict(self.__dict__)
+        del state['lock']
+        state.update(total=None, writing=0)
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def key(self, image: str) -> str:
+        """
+        缓存键, 图像被修改后自动失效
+        :param image: 图像路径
+        :return: 缓存键
+        """
+        path = Path(image).resolve()
+        stat = path.stat()
+        return hashlib.sha1(f'{path}|{stat.st_mtime_ns}|{stat.st_size}'.encode()).hexdigest()
+
+    def entry(self, image: str, kind: str = 'decoded') -> Path:
+        assert kind in CACHE_KINDS, f"kind must be one of {CACHE_KINDS}"
+        return self.cache_dir / f'{self.key(image)}.{kind}.npy'
+
+    def get(self, image: str, kind: str = 'decoded') -> np.ndarray:
+        """
+        读取缓存
+        :param image: 图像路径
+        :param kind: 缓存的数据类型
+        :return: 只读的内存映射数组, 未命中时返回None
+        """
+        entry = self.entry(image, kind)
+        try:
+            array = np.load(entry, mmap_mode='r')
+        except (FileNotFoundError, ValueError):
+            return None
+        # 更新修改时间作为最近访问时间, 用于淘汰
+        try:
+            os.utime(entry)
+        except OSError:
+            pass
+        return array
+
+    def put(self, image: str, array: np.ndarray, kind: str = 'decoded') -> np.ndarray:
+        """
+        写入缓存
+        :param image: 图像路径
+        :param array: 像素数组
+        :param kind: 缓存的数据类型
+        :return: 缓存文件的只读内存映射数组, 写入失败时返回原数组
+        """
+        entry = self.entry(image, kind)
+        if array.nbytes > self.max_bytes:
+            return array
+        with self.lock:
+            if self.total is None:
+                self.total = self.size()
+            if self.total + array.nbytes > self.max_bytes:
+                self._evict(self.max_bytes - array.nbytes)
+            # 写入前先计入总大小, 同时写入的其他线程据此淘汰
+            self.total += array.nbytes
+            self.writing += array.nbytes
+        # 先写临时文件再替换, 避免其他进程或线程读到不完整的文件
+        tmp = entry.with_name(f'{entry.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+        try:
+            with open(tmp, 'wb') as f:
+                np.save(f, array)
+            os.replace(tmp, entry)
+        except OSError:
+            tmp.unlink(missing_ok=True)
+            with self.lock:
+                self.total -= array.nbytes
+                self.writing -= array.nbytes
+            return array
+        with self.lock:
+            self.writing -= array.nbytes
+        try:
+            return np.load(entry, mmap_mode='r')
+        except FileNotFoundError:
+            # 缓存很小时刚写入的文件可能已被其他线程淘汰
+            return array
+
+    def load(self, image: str, decode, kind: str = 'decoded') -> np.ndarray:
+        """
+        读取缓存, 未命中时调用decode得到数组并写入缓存
+        :param image: 图像路径
+        :param decode: 无参数的函数, 返回像素数组
+        :param kind: 缓存的数据类型
+        :return: 像素数组
+        """
+        array = self.get(image, kind)
+        if array is None:
+            array = self.put(image, decode(), kind)
+        return array
+
+    def size(self) -> int:
+        """
+        :return: 缓存总大小
+        """
+        return sum(size for _, size, _ in self._entries())
+
+    def _entries(self) -> list:
+        entries = []
+        for entry in self.cache_dir.glob('*.npy'):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry))
+        return entries
+
+    def evict(self, max_bytes: int = None):
+        """
+        按最近访问时间淘汰缓存, 直到总大小不超过max_bytes
+        :param max_bytes: 总大小上限, 默认为self.max_bytes
+        """
+        with self.lock:
+            self._evict(self.max_bytes if max_bytes is None else max_bytes)
+
+    def _evict(self, max_bytes: int):
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total + self.writing <= max_bytes:
+                break
+            try:
+                entry.unlink(missing_ok=True)
+            except OSError:
+                # Windows下仍被内存映射的文件不能删除
+                continue
+            total -= size
+        self.total = total + self.writing
+
+    def clear(self):
+        self.evict(0)
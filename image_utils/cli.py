@@ -0,0 +1,160 @@
+"""
+命令行批量处理, 不需要图形界面
+用法: image-utils 图片目录 保存目录 [--cut] [--foreground] [--workers 8]
+      python -m image_utils 图片目录 保存目录 ...
+结果逐张写入 保存目录/result.csv; 以相同参数重新运行时跳过已完成的图像(保存目录/manifest.sqlite)
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+from image_utils.scan import ImageScanner
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog='image-utils', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('source', help='图片目录')
+    parser.add_argument('destination', help='保存目录')
+    parser.add_argument('--include', nargs='+', help='只处理匹配的图片, 如 "*.jpg" "2023/*"')
+    parser.add_argument('--exclude', nargs='+', help='跳过匹配的图片和目录, 如 thumbs')
+    parser.add_argument('--cut', action='store_true', help='保存切割后的图像')
+    parser.add_argument('--foreground', action='store_true', help='保存前景图像')
+    parser.add_argument('--codec', default='png', choices=('png', 'webp', 'jpeg'),
+                        help='切割图像的格式; jpeg不支持透明通道, 前景切割图仍保存为png')
+    parser.add_argument('--level', type=int, default=1, help='png压缩等级(0-9)或webp压缩力度(0-6), 越大越慢')
+    parser.add_argument('--quality', type=int, default=90, help='jpeg与有损webp的质量(1-100)')
+    parser.add_argument('--lossy', action='store_true', help='webp使用有损压缩')
+    parser.add_argument('--engine', default='auto', choices=('auto', 'cv2', 'pil'),
+                        help='编码库, auto为按格式选择较快的一个')
+    parser.add_argument('--archive', choices=('zip', 'tar'), help='把切割图像打包保存, 不逐个保存小文件')
+    parser.add_argument('--archive-scope', default='image', choices=('image', 'run'),
+                        help='image为每张图像一个包, run为每个进程每次运行新建一个包(保存目录/crops_编号.tar), run只支持tar')
+    parser.add_argument('--threshold', type=int, default=3000, help='连通区域像素阈值')
+    parser.add_argument('--workers', type=int, default=None, help='进程数, 默认为CPU核数')
+    parser.add_argument('--mode', default='process', choices=('process', 'thread'),
+                        help='process为多进程; thread为单进程内按阶段(解码/分割/连通区域/保存)分别使用线程')
+    parser.add_argument('--stage-threads', nargs='+', default=[], metavar='STAGE=N',
+                        help='thread模式下各阶段的线程数, 如 segment=4 render=2')
+    parser.add_argument('--chunksize', type=int, default=1, help='每个任务包含的图像数')
+    parser.add_argument('--backend', default='kmeans',
+                        choices=('kmeans', 'minibatch', 'lut_full', 'lut_quantized'),
+                        help='聚类方式; 不使用共用模型时kmeans/minibatch对每张图像单独聚类')
+    parser.add_argument('--fit-once', action='store_true',
+                        help='用前几张图像拟合一次聚类中心, 所有图像共用(适合光照一致的一批图像)')
+    parser.add_argument('--model', help='从文件(.npy)加载聚类中心, 所有图像共用, 见 SegmentationModel.save')
+    parser.add_argument('--tile-size', type=int,
+                        help='按块处理超大拼接图的分块边长, 如4096; 只保存切割图像, 只支持process模式')
+    parser.add_argument('--scale', type=float, default=1.0, help='由粗到细分割的缩放比例, 如0.25')
+    parser.add_argument('--cache', help='解码缓存目录')
+    parser.add_argument('--sink', help='结果表格路径(.csv/.sqlite/.parquet), 默认为 保存目录/result.csv')
+    parser.add_argument('--xlsx', action='store_true', help='结束后另存为 保存目录/result.xlsx')
+    parser.add_argument('--no-resume', action='store_true', help='不使用结果清单, 重新处理全部图像')
+    parser.add_argument('--profile', action='store_true', help='结束后输出各阶段耗时')
+    parser.add_argument('-q', '--quiet', action='store_true', help='不输出每张图像的结果')
+    return parser.parse_args(argv)
+
+
+def progress(done: int, scanner: ImageScanner) -> str:
+    # 扫描未结束时总数后加+
+    return f'{done}/{scanner.count}' + ('' if scanner.done.is_set() else '+')
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    source, destination = Path(args.source), Path(args.destination)
+    if not source.is_dir():
+        print(f'图片目录不存在: {source}', file=sys.stderr)
+        return 2
+    if args.tile_size and args.mode == 'thread':
+        print('--tile-size 只支持process模式', file=sys.stderr)
+        return 2
+    if args.fit_once and args.model:
+        print('--fit-once 与 --model 不能同时使用', file=sys.stderr)
+        return 2
+    if args.model and not Path(args.model).is_file():
+        print(f'模型文件不存在: {args.model}', file=sys.stderr)
+        return 2
+    if args.archive_scope == 'run' and args.archive == 'zip':
+        print('--archive-scope run 只支持tar: zip包的目录在关闭时才写入, 中断后无法读取', file=sys.stderr)
+        return 2
+    destination.mkdir(parents=True, exist_ok=True)
+
+    # 参数解析之后再导入处理模块, --help 等不需要加载OpenCV与scikit-learn
+    from image_utils.batch import BatchProcessor
+    from image_utils.cache import DecodeCache
+    from image_utils.codec import Codec
+    from image_utils.model import SegmentationModel
+    from image_utils.sink import open_sink, to_xlsx
+    from image_utils.staged import StagedProcessor
+
+    # 扫描与处理同时进行, 总数随扫描增长
+    scanner = ImageScanner(source, include=args.include, exclude=args.exclude).start()
+    sink = open_sink(args.sink or destination / 'result.csv')
+    codec = Codec(args.codec, level=args.level, quality=args.quality, lossless=not args.lossy, engine=args.engine)
+    codecs = dict(origin_cut=codec, foreground_cut=codec) if codec.alpha else dict(origin_cut=codec)
+    # 未指定共用模型时与 api.main 一致, 按backend对每张图像单独聚类
+    if args.model:
+        model = SegmentationModel.load(args.model)
+    else:
+        model = SegmentationModel() if args.fit_once else None
+    options = dict(
+        cut_image=args.cut, foreground=args.foreground, piex_threshold=args.threshold, model=model,
+        backend=args.backend, scale=args.scale, cache=DecodeCache(args.cache) if args.cache else None,
+        manifest=None if args.no_resume else str(destination / 'manifest.sqlite'), sink=sink, codecs=codecs,
+        archive=args.archive, archive_scope=args.archive_scope, tile_size=args.tile_size)
+    if args.mode == 'thread':
+        threads = {stage: int(count) for stage, count in (item.split('=') for item in args.stage_threads)}
+        processor = StagedProcessor(str(destination), str(source), threads=threads, **options)
+    else:
+        processor = BatchProcessor(str(destination), str(source), workers=args.workers, chunksize=args.chunksize,
+                                   **options)
+
+    start = time.time()
+    failed, skipped, done = [], 0, 0
+    stages = {}
+    try:
+        for result in processor.run(scanner):
+            done += 1
+            if result.error is not None:
+                failed.append(result)
+                print(f'[{progress(done, scanner)}] {result.image_path}: {result.error}', file=sys.stderr)
+                continue
+            skipped += result.skipped
+            for stage, elapsed in (result.result.stages or {}).items():
+                stages[stage] = stages.get(stage, 0.0) + elapsed
+            if not args.quiet:
+                state = '已完成, 跳过' if result.skipped else f'{result.result.time:.2f}s'
+                print(f'[{progress(done, scanner)}] {result.result.filename}: {result.result.cls}个区域 ({state})')
+    except KeyboardInterrupt:
+        scanner.cancel()
+        processor.cancel()
+        print('已取消', file=sys.stderr)
+    finally:
+        sink.close()
+
+    if scanner.count == 0:
+        print(f'图片目录下没有图片: {source}', file=sys.stderr)
+        return 2
+    elapsed = time.time() - start
+    print(f'共处理{done}张图片, 跳过{skipped}张, 失败{len(failed)}张, 用时{elapsed:.1f}s, 结果: {sink.path}')
+    if args.profile and stages:
+        total = sum(stages.values())
+        for stage, seconds in sorted(stages.items(), key=lambda item: -item[1]):
+            print(f'{stage:<12} {seconds:>9.2f}s {seconds / total * 100:>6.1f}%')
+    if args.profile and args.mode == 'thread':
+        # 输入队列经常为满且利用率高的阶段为瓶颈
+        occupancy = processor.occupancy()
+        print(f'{"stage":<8} {"threads":>7} {"busy":>8} {"util":>6} {"queue":>6} {"max":>4} {"full":>8} {"empty":>8}')
+        for stage, item in occupancy.stages.items():
+            queue = occupancy.queues[stage]
+            print(f'{stage:<8} {item["threads"]:>7} {item["busy"]:>7.2f}s {item["utilization"]:>6.2f} '
+                  f'{queue["mean"]:>6.2f} {queue["max"]:>4} {queue["full"]:>7.2f}s {queue["empty"]:>7.2f}s')
+    if args.xlsx:
+        to_xlsx(sink, destination / 'result.xlsx', failed=failed)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,95 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+# 格式 -> 扩展名
+FORMATS = {'png': '.png', 'webp': '.webp', 'jpeg': '.jpg'}
+ENGINES = ('auto', 'cv2', 'pil')
+# engine为'auto'时各格式使用较快的编码库(见 benchmarks/bench_codec)
+FASTEST = {'png': 'cv2', 'webp': 'pil', 'jpeg': 'pil'}
+
+
+class Codec:
+    """
+    图像编码设置
+    把图像数组或PIL图像编码为字节, 可选择OpenCV(cv2.imencode)或PIL编码
+    """
+
+    def __init__(self, format: str = 'png', level: int = 1, quality: int = 90, lossless: bool = True,
+                 engine: str = 'auto'):
+        """
+        :param format: 格式, 见FORMATS
+        :param level: png为压缩等级(0-9), webp为压缩力度(0-6, 仅PIL), 越大越慢
+        :param quality: jpeg与有损webp的质量(1-100)
+        :param lossless: webp是否无损
+        :param engine: 编码库, 'cv2'、'pil' 或 'auto'(按格式选择较快的编码库)
+        """
+        assert format in FORMATS, f"format must be one of {tuple(FORMATS)}"
+        assert engine in ENGINES, f"engine must be one of {ENGINES}"
+        self.format = format
+        self.level = level
+        self.quality = quality
+        self.lossless = lossless
+        self.engine = FASTEST[format] if engine == 'auto' else engine
+
+    @property
+    def suffix(self) -> str:
+        return FORMATS[self.format]
+
+    @property
+    def alpha(self) -> bool:
+        """
+        是否支持透明通道, jpeg不支持
+        """
+        return self.format != 'jpeg'
+
+    def options(self) -> dict:
+        """
+        影响输出的设置, 用作结果清单的参数
+        """
+        return dict(format=self.format, level=self.level, quality=self.quality, lossless=self.lossless,
+                    engine=self.engine)
+
+    def __repr__(self):
+        return f'Codec({", ".join(f"{key}={value!r}" for key, value in self.options().items())})'
+
+    def encode(self, image) -> bytes:
+        """
+        编码图像
+        :param image: 图像数组(格式RGB/RGBA或灰度)或PIL图像
+        :return: 编码后的字节
+        """
+        if self.engine == 'cv2':
+            return self._encode_cv2(np.asarray(image))
+        if isinstance(image, np.ndarray):
+            image = Image.fromarray(image)
+        assert self.alpha or image.mode != 'RGBA', "jpeg does not support alpha channel"
+        buffer = io.BytesIO()
+        if self.format == 'png':
+            image.save(buffer, format='PNG', compress_level=self.level)
+        elif self.format == 'webp':
+            image.save(buffer, format='WEBP', lossless=self.lossless, quality=self.quality, method=self.level)
+        else:
+            image.save(buffer, format='JPEG', quality=self.quality)
+        return buffer.getvalue()
+
+    def _encode_cv2(self, image: np.ndarray) -> bytes:
+        import cv2
+
+        assert self.alpha or image.ndim == 2 or image.shape[2] == 3, "jpeg does not support alpha channel"
+        # OpenCV按BGR(A)顺序编码
+        if image.ndim == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR if image.shape[2] == 3 else cv2.COLOR_RGBA2BGRA)
+        if self.format == 'png':
+            # 游程编码策略在同等压缩等级下更快, 且对分割结果这类大片相同像素的图像更小
+            params = [cv2.IMWRITE_PNG_COMPRESSION, self.level, cv2.IMWRITE_PNG_STRATEGY,
+                      cv2.IMWRITE_PNG_STRATEGY_RLE]
+        elif self.format == 'webp':
+            # 质量大于100时为无损
+            params = [cv2.IMWRITE_WEBP_QUALITY, 101 if self.lossless else self.quality]
+        else:
+            params = [cv2.IMWRITE_JPEG_QUALITY, self.quality]
+        ok, data = cv2.imencode(self.suffix, image, params)
+        assert ok, f"failed to encode image as {self.format}"
+        return data.tobytes()
@@ -1,29 +1,160 @@
 import cv2
-from sklearn import cluster
 import numpy as np
 from types import SimpleNamespace
 
+from image_utils.lut import get_lookup_table
 
-def cluster_image(image: np.ndarray, n_clusters: int = 2, init: np.ndarray = None):
+CLUSTER_BACKENDS = ('kmeans', 'minibatch', 'lut_full', 'lut_quantized')
+SAMPLE_METHODS = ('random', 'strided')
+
+
+def cluster_image(image: np.ndarray, n_clusters: int = 2, init: np.ndarray = None, backend: str = 'kmeans',
+                  sample_size: int = None, sample_method: str = 'random', seed: int = 0,
+                  chunk_size: int = 1 << 20):
     """
     图像聚类
     :param image: 图像数组, 格式为RGB
     :param n_clusters: 聚类数量, 默认为2
     :param init: 聚类中心，默认为[[140, 128, 104], [78, 123, 175]]
+    :param backend: 聚类方式, 'kmeans' 对图像进行KMeans聚类; 'minibatch' 使用MiniBatchKMeans;
+                    'lut_full'/'lut_quantized' 不再拟合, 直接按init查表分配到最近的中心
+    :param sample_size: 拟合所用的采样像素数, 为None时在全部像素上拟合
+    :param sample_method: 采样方式, 'random' 随机采样, 'strided' 等间隔采样
+    :param seed: 随机种子, 用于采样与MiniBatchKMeans
+    :param chunk_size: 采样拟合后分块分配全部像素时每块的像素数
     :return: 聚类结果
     """
     assert isinstance(image, np.ndarray), "image must be numpy.ndarray"
     assert image.ndim in [2, 3], "image must be 2 or 3 dimension"
-    shape = image.shape
-    image = image.reshape((-1, image.ndim))
+    assert backend in CLUSTER_BACKENDS, f"backend must be one of {CLUSTER_BACKENDS}"
 
     if init is None:
         init = np.array([[140, 128, 104], [78, 123, 175]], dtype=np.uint8)
 
-    cluster_labels = cluster.KMeans(
-        n_clusters=n_clusters, init=init, n_init="auto"
-    ).fit_predict(image)
-    return cluster_labels.reshape(shape[:-1])
+    if backend.startswith('lut_'):
+        return get_lookup_table(init[:n_clusters], mode=backend[len('lut_'):]).predict(image)
+
+    # scikit-learn导入较慢, 只在需要拟合时导入
+    from sklearn import cluster
+
+    shape = image.shape
+    image = image.reshape((-1, image.ndim))
+
+    if backend == 'kmeans' and sample_size is None:
+        cluster_labels = cluster.KMeans(
+            n_clusters=n_clusters, init=init, n_init="auto"
+        ).fit_predict(image)
+        return cluster_labels.reshape(shape[:-1])
+
+    pixels = image if sample_size is None else sample_pixels(image, sample_size, sample_method, seed)
+    if backend == 'minibatch':
+        estimator = cluster.MiniBatchKMeans(n_clusters=n_clusters, init=init, n_init=1, random_state=seed)
+    else:
+        estimator = cluster.KMeans(n_clusters=n_clusters, init=init, n_init="auto")
+    centers = estimator.fit(pixels).cluster_centers_
+    return assign_clusters(image, centers, chunk_size=chunk_size).reshape(shape[:-1])
+
+
+def cluster_stack(stack: np.ndarray, n_clusters: int = 2, init: np.ndarray = None, backend: str = 'kmeans',
+                  sample_size: int = 200000, seed: int = 0, chunk_size: int = 1 << 20) -> np.ndarray:
+    """
+    同尺寸图像组的聚类
+    整组共用一次拟合: 在所有图像的随机采样像素上拟合聚类中心, 再一次性把全部像素分配到最近的中心,
+    结果与 SegmentationModel 相同(整批共用聚类中心), 而不是逐张单独聚类
+    :param stack: 图像组, (N, H, W, C)
+    :param n_clusters: 聚类数量, 默认为2
+    :param init: 聚类中心初值, 见 cluster_image
+    :param backend: 聚类方式, 见 cluster_image
+    :param sample_size: 拟合所用的采样像素数(整组合计)
+    :param seed: 随机种子
+    :param chunk_size: 分配像素时每块的像素数
+    :return: 聚类结果, (N, H, W)
+    """
+    assert isinstance(stack, np.ndarray), "stack must be numpy.ndarray"
+    assert stack.ndim == 4, "stack must be 4 dimension (N, H, W, C)"
+    n, height, width, channels = stack.shape
+    # 合并为一张 (N*H, W, C) 的图像, 不复制数据
+    labels = cluster_image(stack.reshape((n * height, width, channels)), n_clusters=n_clusters, init=init,
+                           backend=backend, sample_size=sample_size, seed=seed, chunk_size=chunk_size)
+    return labels.reshape((n, height, width))
+
+
+def sample_pixels(pixels: np.ndarray, sample_size: int, method: str = 'random', seed: int = 0) -> np.ndarray:
+    """
+    像素采样
+    :param pixels: 像素数组, (n, channels)
+    :param sample_size: 采样像素数
+    :param method: 采样方式, 'random' 随机采样, 'strided' 等间隔采样
+    :param seed: 随机种子
+    :return: 采样后的像素数组
+    """
+    assert method in SAMPLE_METHODS, f"method must be one of {SAMPLE_METHODS}"
+    assert sample_size > 0, "sample_size must be positive"
+    if len(pixels) <= sample_size:
+        return pixels
+    if method == 'strided':
+        return pixels[::len(pixels) // sample_size][:sample_size]
+    return pixels[np.random.default_rng(seed).choice(len(pixels), sample_size, replace=False)]
+
+
+def assign_clusters(pixels: np.ndarray, centers: np.ndarray, chunk_size: int = 1 << 20) -> np.ndarray:
+    """
+    将像素分配到最近的聚类中心, 分块计算以限制内存
+    :param pixels: 像素数组, (n, channels)
+    :param centers: 聚类中心, (n_clusters, channels)
+    :param chunk_size: 每块的像素数
+    :return: 每个像素的类别, (n,)
+    """
+    centers = np.asarray(centers, dtype=np.float32)
+    # argmin ||x - c||^2 = argmin (c·c - 2 x·c)
+    bias = (centers ** 2).sum(axis=1)
+    labels = np.empty(len(pixels), dtype=np.int32)
+    for start in range(0, len(pixels), chunk_size):
+        chunk = pixels[start:start + chunk_size].astype(np.float32)
+        labels[start:start + chunk_size] = np.argmin(bias - 2 * chunk @ centers.T, axis=1)
+    return labels
+
+
+def class_centers(image: np.ndarray, labels: np.ndarray, n_clusters: int = 2) -> np.ndarray:
+    """
+    计算每个类别的平均颜色, 即聚类收敛后的聚类中心
+    :param image: 图像数组, 格式为RGB
+    :param labels: 聚类结果
+    :param n_clusters: 聚类数量, 默认为2
+    :return: 聚类中心, (n_clusters, channels)
+    """
+    pixels = image.reshape((-1, image.shape[-1]))
+    labels = labels.reshape(-1)
+    counts = np.maximum(np.bincount(labels, minlength=n_clusters), 1)
+    sums = np.stack([np.bincount(labels, weights=pixels[:, c], minlength=n_clusters)
+                     for c in range(pixels.shape[1])], axis=1)
+    return sums / counts[:, None]
+
+
+def refine_labels(image: np.ndarray, labels: np.ndarray, centers: np.ndarray, band_width: int = 8,
+                  chunk_size: int = 1 << 20) -> np.ndarray:
+    """
+    由粗到细的聚类: 将低分辨率的聚类结果上采样到原图尺寸,
+    只对类别边界两侧band_width像素内的像素在原分辨率下重新分配到最近的聚类中心
+    :param image: 原分辨率图像数组, 格式为RGB
+    :param labels: 低分辨率聚类结果
+    :param centers: 聚类中心, (n_clusters, channels)
+    :param band_width: 边界带宽度(原分辨率像素), 应大于缩放倍数
+    :param chunk_size: 重新分配时每块的像素数
+    :return: 原分辨率聚类结果
+    """
+    assert isinstance(image, np.ndarray), "image must be numpy.ndarray"
+    assert labels.ndim == 2, "labels must be 2 dimension"
+    assert band_width > 0, "band_width must be positive"
+    height, width = image.shape[:2]
+    labels = cv2.resize(labels.astype(np.uint8), (width, height), interpolation=cv2.INTER_NEAREST)
+
+    # 邻域内最大值与最小值不同的像素即位于类别边界附近
+    kernel = np.ones((2 * band_width + 1, 2 * band_width + 1), dtype=np.uint8)
+    band = np.flatnonzero(cv2.dilate(labels, kernel) != cv2.erode(labels, kernel))
+    pixels = image.reshape((-1, image.shape[-1]))
+    labels.reshape(-1)[band] = assign_clusters(pixels[band], centers, chunk_size=chunk_size)
+    return labels
 
 
 def closing(
@@ -49,41 +180,144 @@ def closing(
     )
 
 
+def blur_stack(stack: np.ndarray, ksize: tuple = (5, 5), dst: np.ndarray = None) -> np.ndarray:
+    """
+    同尺寸图像组的高斯模糊, 每张图像单独模糊(边界不跨越图像), 结果写入同一个输出数组
+    :param stack: 图像组, (N, H, W, C)
+    :param ksize: 卷积核大小
+    :param dst: 输出数组, 默认新建
+    :return: 模糊结果, (N, H, W, C)
+    """
+    assert isinstance(stack, np.ndarray), "stack must be numpy.ndarray"
+    assert stack.ndim == 4, "stack must be 4 dimension (N, H, W, C)"
+    dst = np.empty_like(stack) if dst is None else dst
+    for image, out in zip(stack, dst):
+        cv2.GaussianBlur(image, ksize, 0, dst=out)
+    return dst
+
+
+def closing_stack(stack: np.ndarray, kernel_size: int = 3, iterations: int = 1, dst: np.ndarray = None):
+    """
+    同尺寸二值图像组的闭运算
+    :param stack: 二值图像组, (N, H, W)
+    :param kernel_size: 卷积核大小, 默认为3
+    :param iterations: 迭代次数, 默认为1
+    :param dst: 输出数组, 默认新建
+    :return: 闭运算结果, (N, H, W)
+    """
+    assert isinstance(stack, np.ndarray), "stack must be numpy.ndarray"
+    assert stack.ndim == 3, "stack must be 3 dimension (N, H, W)"
+    dst = np.empty_like(stack) if dst is None else dst
+    for image, out in zip(stack, dst):
+        closing_roi(image, kernel_size=kernel_size, iterations=iterations, dst=out)
+    return dst
+
+
+def foreground_tiles(image: np.ndarray, tile_size: int = 64) -> np.ndarray:
+    """
+    统计每个tile_size×tile_size块内是否有非零像素
+    宽度为8的倍数时按8字节一组读取, 只需遍历一次图像
+    :param image: 二值图像
+    :param tile_size: 块边长, 应为8的倍数
+    :return: 布尔数组, (ceil(H / tile_size), ceil(W / tile_size))
+    """
+    height, width = image.shape
+    if width % 8 == 0 and tile_size % 8 == 0 and image.flags.c_contiguous:
+        words, step = image.view(np.uint64), tile_size // 8
+    else:
+        words, step = image, tile_size
+    rows = np.maximum.reduceat(words, np.arange(0, height, tile_size), axis=0)
+    return np.maximum.reduceat(rows, np.arange(0, words.shape[1], step), axis=1) > 0
+
+
+def closing_roi(image: np.ndarray, kernel_size: int = 3, iterations: int = 1, dst: np.ndarray = None,
+                tile_size: int = 64, max_fraction: float = 0.3) -> np.ndarray:
+    """
+    闭运算, 只在前景附近的区域内计算, 结果与 closing 逐像素一致
+    闭运算结果只可能在距前景radius以内非零(radius为膨胀的总半径), 因此先按块统计前景,
+    把有前景的块向外扩展radius后按连通块分成若干矩形区域, 每个区域连同2*radius宽的边缘单独做闭运算,
+    其余像素为0; 需要计算的面积超过max_fraction时直接对整图做闭运算
+    :param image: 图像数组, 为一个二值图像
+    :param kernel_size: 卷积核大小, 为奇数
+    :param iterations: 迭代次数
+    :param dst: 输出图像, 默认为None
+    :param tile_size: 统计前景的块边长
+    :param max_fraction: 按区域计算的最大面积比例
+    :return: 闭运算结果
+    """
+    assert isinstance(image, np.ndarray), "image must be numpy.ndarray"
+    assert image.ndim == 2, "image must be 2 dimension"
+    # 偶数大小的卷积核锚点不对称, 原地运算时输入会被覆盖, 这两种情况直接对整图计算
+    if kernel_size % 2 == 0 or (dst is not None and np.shares_memory(dst, image)):
+        return closing(image, kernel_size=kernel_size, iterations=iterations, dst=dst)
+    height, width = image.shape
+    radius = kernel_size // 2 * iterations
+    tiles = foreground_tiles(image, tile_size).astype(np.uint8)
+    reach = -(-radius // tile_size)
+    tiles = cv2.dilate(tiles, np.ones((2 * reach + 1, 2 * reach + 1), dtype=np.uint8))
+    if np.count_nonzero(tiles) > max_fraction * tiles.size:
+        return closing(image, kernel_size=kernel_size, iterations=iterations, dst=dst)
+
+    dst = np.empty_like(image) if dst is None else dst
+    dst.fill(0)
+    count, _, stats, _ = cv2.connectedComponentsWithStats(tiles, connectivity=8)
+    kernel = np.ones((kernel_size, kernel_size), dtype=np.uint8)
+    margin = 2 * radius
+    for index in range(1, count):
+        x, y, w, h = stats[index, :4]
+        top, left = y * tile_size, x * tile_size
+        bottom, right = min((y + h) * tile_size, height), min((x + w) * tile_size, width)
+        t, l = max(top - margin, 0), max(left - margin, 0)
+        b, r = min(bottom + margin, height), min(right + margin, width)
+        closed = cv2.morphologyEx(image[t:b, l:r], cv2.MORPH_CLOSE, kernel, iterations=iterations)
+        dst[top:bottom, left:right] = closed[top - t:bottom - t, left - l:right - l]
+    return dst
+
+
 def get_connect_part(image: np.ndarray, piex_threshold: int = 0) -> SimpleNamespace:
     """
     获取连通区域
+    一次 connectedComponentsWithStats 得到所有连通区域的面积、外接框和质心，
+    过滤后通过查找表一次性重映射得到掩码，耗时与连通区域数量无关
     :param image: 图像数组, 为一个二值图像
     :param piex_threshold: 像素阈值,连通区域像素值小于piex_threshold的进行过滤。 piex_threshold默认为0
-    :return: 连通区域
+    :return: 连通区域, labeled_img 为保留区域取255、其余取0的uint8掩码
     """
     assert isinstance(image, np.ndarray), "image must be numpy.ndarray"
     assert image.ndim == 2, "image must be 2 dimension"
-    number_cls, labeled_img = cv2.connectedComponents(image, connectivity=8)
-    piex = []
-    boxes = []
-    for i in range(1, number_cls):
-        connect = np.where(labeled_img == i)
-        if len(connect[0]) < piex_threshold:
-            labeled_img[connect] = 0
-            continue
-        else:
-            labeled_img[connect] = 255
-            piex.append(len(connect[0]))  # 记录连通区域的像素值
-            x_min, x_max = np.min(connect[0]), np.max(connect[0])
-            y_min, y_max = np.min(connect[1]), np.max(connect[1])
-            boxes.append([x_min, y_min, x_max, y_max])  # 记录连通区域的坐标
+    number_cls, labeled_img, stats, centroids = cv2.connectedComponentsWithStats(image, connectivity=8)
+
+    # 第0类为背景, 只对前景连通区域进行过滤
+    areas = stats[1:, cv2.CC_STAT_AREA]
+    keep = np.flatnonzero(areas >= piex_threshold) + 1
+
+    # 查找表: 保留的标签映射为255, 其余映射为0
+    lut = np.zeros(number_cls, dtype=np.uint8)
+    lut[keep] = 255
+    labeled_img = np.take(lut, labeled_img)
+
+    top = stats[keep, cv2.CC_STAT_TOP]
+    left = stats[keep, cv2.CC_STAT_LEFT]
+    boxes = np.stack((top, left,
+                      top + stats[keep, cv2.CC_STAT_HEIGHT] - 1,
+                      left + stats[keep, cv2.CC_STAT_WIDTH] - 1), axis=1)
     return SimpleNamespace(
-        number_cls=len(piex),
+        number_cls=len(keep),
         labeled_img=labeled_img,
-        piex=piex,
-        boxes=boxes,
+        piex=stats[keep, cv2.CC_STAT_AREA].tolist(),  # 记录连通区域的像素值
+        boxes=boxes.tolist(),  # 记录连通区域的坐标 [x_min, y_min, x_max, y_max]
+        centroids=centroids[keep][:, ::-1].tolist(),  # 记录连通区域的质心 [x, y], 与boxes坐标顺序一致
     )
 
 
+# 像素边长(mm)
+PIXEL_SIZE = 0.0106044538
+
+
 def get_area(piex: int) -> SimpleNamespace:
     """ "像素与面积的转换"""
     assert isinstance(piex, int), "piex must be int"
-    area = 0.0106044538 ** 2 * piex
+    area = PIXEL_SIZE ** 2 * piex
     return SimpleNamespace(
         um=round(area * 10000, 2),
         mm=round(area, 2),
@@ -0,0 +1,192 @@
+import hashlib
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from types import SimpleNamespace
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    hash TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS images (
+    hash TEXT NOT NULL,
+    params TEXT NOT NULL,
+    path TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    cls INTEGER NOT NULL,
+    time REAL,
+    PRIMARY KEY (hash, params)
+);
+CREATE TABLE IF NOT EXISTS regions (
+    hash TEXT NOT NULL,
+    params TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    area REAL NOT NULL,
+    x_min INTEGER NOT NULL,
+    y_min INTEGER NOT NULL,
+    x_max INTEGER NOT NULL,
+    y_max INTEGER NOT NULL,
+    PRIMARY KEY (hash, params, idx)
+);
+"""
+
+
+def file_hash(path: str, chunk_size: int = 1 << 20) -> str:
+    """
+    计算文件内容的哈希
+    :param path: 文件路径
+    :param chunk_size: 每次读取的字节数
+    :return: 十六进制哈希值
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def params_key(params: dict) -> str:
+    """
+    处理参数的键, 参数不同的结果互不复用
+    :param params: 处理参数
+    :return: 参数键
+    """
+    return json.dumps(params, sort_keys=True, default=str)
+
+
+class ResultManifest:
+    """
+    处理结果清单
+    每张图像处理完成后立即把内容哈希、处理参数和连通区域结果写入SQLite,
+    以相同参数重新运行时跳过已完成的图像, 并可从清单重建结果表格
+    """
+
+    def __init__(self, path: str, params: dict):
+        """
+        :param path: 清单文件路径, 如 保存目录/manifest.sqlite
+        :param params: 处理参数, 如 {'piex_threshold': 3000, 'scale': 1.0}
+        """
+        self.path = str(path)
+        self.params = params_key(params)
+        self.lock = threading.Lock()
+        # 连接在多个线程间共用, 由self.lock保证串行访问
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.executescript(SCHEMA)
+
+    def image_hash(self, image: str) -> str:
+        """
+        图像内容哈希, 按路径、修改时间和大小缓存, 文件未变化时不重新读取
+        :param image: 图像路径
+        :return: 哈希值
+        """
+        path = str(Path(image).resolve())
+        stat = Path(path).stat()
+        with self.lock:
+            row = self.connection.execute('SELECT mtime_ns, size, hash FROM files WHERE path = ?',
+                                          (path,)).fetchone()
+        if row and row[0] == stat.st_mtime_ns and row[1] == stat.st_size:
+            return row[2]
+        digest = file_hash(path)
+        with self.lock, self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)',
+                                    (path, stat.st_mtime_ns, stat.st_size, digest))
+        return digest
+
+    def get(self, image: str) -> SimpleNamespace:
+        """
+        读取已完成的结果
+        :param image: 图像路径
+        :return: 与 api.main 返回值格式一致的结果(清单中不保存regions, 为None), 未完成时返回None
+        """
+        digest = self.image_hash(image)
+        with self.lock:
+            row = self.connection.execute('SELECT cls, time FROM images WHERE hash = ? AND params = ?',
+                                          (digest, self.params)).fetchone()
+            if row is None:
+                return None
+            regions = self.connection.execute(
+                'SELECT area, x_min, y_min, x_max, y_max FROM regions WHERE hash = ? AND params = ? ORDER BY idx',
+                (digest, self.params)).fetchall()
+        return SimpleNamespace(
+            image_path=image,
+            cls=row[0],
+            area=[region[0] for region in regions],
+            boxes=[list(region[1:]) for region in regions],
+            regions=None,
+            thumbnail=None,
+            filename=Path(image).name,
+            time=row[1],
+            stages=None,
+            counters=None,
+        )
+
+    def record(self, result: SimpleNamespace):
+        """
+        记录一张图像的结果
+        :param result: api.main 的返回值
+        """
+        digest = self.image_hash(result.image_path)
+        with self.lock, self.connection:
+            self.connection.execute('DELETE FROM regions WHERE hash = ? AND params = ?', (digest, self.params))
+            self.connection.execute('INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?)',
+                                    (digest, self.params, str(result.image_path), result.filename, result.cls,
+                                     result.time))
+            self.connection.executemany(
+                'INSERT INTO regions VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                [(digest, self.params, index, float(result.area[index]), *map(int, result.boxes[index]))
+                 for index in range(result.cls)])
+
+    def discard(self, image: str):
+        """
+        删除一张图像的结果, 如结果图像写入失败时, 下次运行将重新处理
+        :param image: 图像路径
+        """
+        digest = self.image_hash(image)
+        with self.lock, self.connection:
+            self.connection.execute('DELETE FROM regions WHERE hash = ? AND params = ?', (digest, self.params))
+            self.connection.execute('DELETE FROM images WHERE hash = ? AND params = ?', (digest, self.params))
+
+    def results(self):
+        """
+        按记录顺序返回当前参数下的全部结果
+        :return: 与 api.main 返回值格式一致的结果
+        """
+        with self.lock:
+            images = self.connection.execute(
+                'SELECT hash, path, filename, cls, time FROM images WHERE params = ? ORDER BY rowid',
+                (self.params,)).fetchall()
+            regions = self.connection.execute(
+                'SELECT hash, area, x_min, y_min, x_max, y_max FROM regions WHERE params = ? ORDER BY hash, idx',
+                (self.params,)).fetchall()
+        grouped = {}
+        for region in regions:
+            grouped.setdefault(region[0], []).append(region[1:])
+        for digest, path, filename, cls, elapsed in images:
+            items = grouped.get(digest, [])
+            yield SimpleNamespace(
+                image_path=path,
+                cls=cls,
+                area=[item[0] for item in items],
+                boxes=[list(item[1:]) for item in items],
+                regions=None,
+                thumbnail=None,
+                filename=filename,
+                time=elapsed,
+                stages=None,
+                counters=None,
+            )
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
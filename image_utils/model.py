@@ -0,0 +1,140 @@
+from pathlib import Path
+
+import numpy as np
+
+from image_utils.core import assign_clusters
+
+# 默认聚类中心, 与 core.cluster_image 保持一致
+DEFAULT_CENTERS = np.array([[140, 128, 104], [78, 123, 175]], dtype=np.float64)
+
+
+class SegmentationModel:
+    """
+    可复用的颜色分割模型
+    对一批光照一致的图像只拟合一次聚类中心, 之后每张图像只做最近中心分配;
+    当图像颜色相对中心的漂移超过阈值时, 以当前中心为初值对该图像重新拟合
+    """
+
+    def __init__(self, n_clusters: int = 2, centers: np.ndarray = None, sample_size: int = 200000,
+                 drift_threshold: float = None, chunk_size: int = 1 << 20, seed: int = 0):
+        """
+        :param n_clusters: 聚类数量, 默认为2
+        :param centers: 初始聚类中心, 默认为DEFAULT_CENTERS
+        :param sample_size: 每张图像用于拟合的采样像素数
+        :param drift_threshold: 颜色漂移阈值(RGB欧氏距离), 为None时不进行重新拟合
+        :param chunk_size: 分配像素时每块的像素数, 用于限制内存
+        :param seed: 随机种子
+        """
+        if centers is None:
+            centers = DEFAULT_CENTERS[:n_clusters]
+        centers = np.asarray(centers, dtype=np.float64)
+        assert centers.ndim == 2 and len(centers) == n_clusters, "centers must be (n_clusters, channels)"
+        self.n_clusters = n_clusters
+        self.centers = centers
+        self.sample_size = sample_size
+        self.drift_threshold = drift_threshold
+        self.chunk_size = chunk_size
+        self.rng = np.random.default_rng(seed)
+        self.fitted = False
+        self.last_drift = 0.0
+        self.refits = 0
+
+    def sample(self, image: np.ndarray, sample_size: int = None) -> np.ndarray:
+        """
+        随机采样图像像素
+        :param image: 图像数组, 格式为RGB
+        :param sample_size: 采样像素数, 默认为self.sample_size
+        :return: (sample_size, channels)的像素数组
+        """
+        pixels = self._pixels(image)
+        sample_size = sample_size or self.sample_size
+        if len(pixels) <= sample_size:
+            return pixels
+        return pixels[self.rng.choice(len(pixels), sample_size, replace=False)]
+
+    def fit(self, images) -> "SegmentationModel":
+        """
+        在若干图像的采样像素上拟合聚类中心
+        :param images: 图像数组(格式RGB)的可迭代对象
+        :return: self
+        """
+        pixels = np.concatenate([self.sample(image) for image in images])
+        self._fit_pixels(pixels)
+        self.fitted = True
+        return self
+
+    def predict(self, image: np.ndarray) -> np.ndarray:
+        """
+        将每个像素分配到最近的聚类中心, 必要时先进行增量重新拟合
+        :param image: 图像数组, 格式为RGB
+        :return: 聚类结果, 与 core.cluster_image 格式一致
+        """
+        labels = self.assign(image)
+        if self.drift_threshold is not None:
+            self.last_drift = self.drift(image, labels)
+            if self.last_drift > self.drift_threshold:
+                self._fit_pixels(self.sample(image))
+                self.refits += 1
+                labels = self.assign(image)
+        return labels
+
+    def assign(self, image: np.ndarray) -> np.ndarray:
+        """
+        最近中心分配, 分块计算以限制内存
+        :param image: 图像数组, 格式为RGB
+        :return: 聚类结果
+        """
+        labels = assign_clusters(self._pixels(image), self.centers, chunk_size=self.chunk_size)
+        return labels.reshape(image.shape[:-1])
+
+    def drift(self, image: np.ndarray, labels: np.ndarray) -> float:
+        """
+        计算图像各类别均值颜色相对聚类中心的最大偏移
+        :param image: 图像数组, 格式为RGB
+        :param labels: 聚类结果
+        :return: 最大偏移(RGB欧氏距离)
+        """
+        pixels = self._pixels(image)
+        labels = labels.reshape(-1)
+        step = max(1, len(pixels) // self.sample_size)
+        pixels, labels = pixels[::step], labels[::step]
+        counts = np.bincount(labels, minlength=self.n_clusters)
+        drift = 0.0
+        for index in np.flatnonzero(counts):
+            mean = pixels[labels == index].mean(axis=0)
+            drift = max(drift, float(np.linalg.norm(mean - self.centers[index])))
+        return drift
+
+    def save(self, path: str):
+        """
+        保存聚类中心
+        :param path: 保存路径(.npy)
+        """
+        np.save(path, self.centers)
+
+    @classmethod
+    def load(cls, path: str, **kwargs) -> "SegmentationModel":
+        """
+        从文件加载聚类中心
+        :param path: 聚类中心文件路径(.npy)
+        :param kwargs: 其余构造参数
+        :return: 已拟合的分割模型
+        """
+        assert Path(path).exists(), "path must be exists"
+        centers = np.load(path)
+        model = cls(n_clusters=len(centers), centers=centers, **kwargs)
+        model.fitted = True
+        return model
+
+    def _pixels(self, image: np.ndarray) -> np.ndarray:
+        assert isinstance(image, np.ndarray), "image must be numpy.ndarray"
+        assert image.ndim == 3 and image.shape[-1] == self.centers.shape[1], \
+            "image channels must match centers"
+        return image.reshape((-1, image.shape[-1]))
+
+    def _fit_pixels(self, pixels: np.ndarray):
+        from sklearn import cluster
+
+        # 以当前中心为初值, 保证类别顺序不变
+        kmeans = cluster.KMeans(n_clusters=self.n_clusters, init=self.centers, n_init=1).fit(pixels)
+        self.centers = kmeans.cluster_centers_
@@ -0,0 +1,286 @@
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+from PIL import Image
+from cv2 import GaussianBlur, resize, INTER_AREA
+
+from image_utils.cache import DecodeCache
+from image_utils.core import cluster_image, closing_roi, get_connect_part, class_centers, refine_labels, \
+    cluster_stack, blur_stack, closing_stack
+from image_utils.lut import get_lookup_table
+from image_utils.model import SegmentationModel, DEFAULT_CENTERS
+from image_utils.profiling import Profiler, Trace, NULL_TRACE
+from image_utils.regions import RegionTable
+
+
+def load_image(image) -> np.ndarray:
+    """
+    读取图像
+    :param image: 图像路径或图像数组(格式RGB)
+    :return: 图像数组
+    """
+    if isinstance(image, np.ndarray):
+        return image
+    assert Path(image).exists(), "image must be exists"
+    return np.array(Image.open(image))
+
+
+def classify_image(image: np.ndarray, model: SegmentationModel = None, backend: str = 'kmeans') -> np.ndarray:
+    """
+    对模糊后的图像进行前景/背景分类
+    :param image: 图像数组, 格式为RGB
+    :param model: 分割模型, 为None时对每张图像单独进行聚类
+    :param backend: 聚类方式, 见 core.cluster_image; 传入model时查找表使用模型的聚类中心
+    :return: 聚类结果
+    """
+    if model is None:
+        return cluster_image(image, n_clusters=2, backend=backend)
+    if not backend.startswith('lut_'):
+        return model.predict(image)
+    return get_lookup_table(model.centers, mode=backend[len('lut_'):]).predict(image)
+
+
+class Foreground:
+    """
+    前景图像(RGBA, 透明通道为掩码), 按需生成
+    不保存整幅RGBA副本: 切片时只合成所取区域, 需要整幅图像时再用 np.asarray 生成
+    """
+
+    def __init__(self, image: np.ndarray, mask: np.ndarray):
+        """
+        :param image: 图像数组, 格式为RGB
+        :param mask: 前景为255、背景为0的掩码
+        """
+        self.image = image
+        self.mask = mask
+
+    @property
+    def shape(self) -> tuple:
+        return self.image.shape[:2] + (4,)
+
+    def __getitem__(self, key) -> np.ndarray:
+        """
+        取出区域, 如 foreground[top:bottom, left:right, :]
+        :param key: 前两维为行列索引, 其余为通道索引
+        :return: 所取区域的RGBA数组(新数组)
+        """
+        key = key if isinstance(key, tuple) else (key,)
+        region = key[:2]
+        rgba = np.concatenate((self.image[region], self.mask[region][..., None]), axis=-1)
+        return rgba[(Ellipsis,) + key[2:]] if key[2:] else rgba
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        rgba = np.dstack((self.image, self.mask))
+        return rgba if dtype is None else rgba.astype(dtype, copy=False)
+
+
+class Pipeline:
+    """
+    分阶段的图像处理流水线: decode → blur → classify → morphology → regions → render
+    一张图像只解码一次, 解码后的数组贯穿所有阶段;
+    模糊与闭运算的中间结果写入预分配的缓冲区, 同尺寸图像之间复用;
+    begin 与 end 之间各阶段的耗时与计数记录到当前图像的 Trace 中
+    """
+
+    def __init__(self, piex_threshold: int = 5000, model: SegmentationModel = None, backend: str = 'kmeans',
+                 scale: float = 1.0, band_width: int = 8, reuse_buffers: bool = True,
+                 cache: DecodeCache = None, profiler: Profiler = None):
+        """
+        :param piex_threshold: 连通部分像素阈值，小于阈值的连通区域将被认为是噪声
+        :param model: 分割模型, 为None时对每张图像单独进行聚类
+        :param backend: 聚类方式, 见 core.cluster_image
+        :param scale: 缩放比例, 小于1时先在缩小的图像上聚类, 再只对边界带内的像素在原分辨率下重新分类
+        :param band_width: 边界带宽度(原分辨率像素), 仅在scale小于1时生效
+        :param reuse_buffers: 是否复用中间结果缓冲区
+        :param cache: 解码缓存, 命中时直接内存映射读取, 不再解码
+        :param profiler: 性能分析器, 接收每张图像各阶段的耗时与计数事件
+        """
+        assert 0 < scale <= 1, "scale must be in (0, 1]"
+        self.piex_threshold = piex_threshold
+        self.model = model
+        self.backend = backend
+        self.scale = scale
+        self.band_width = band_width
+        self.reuse_buffers = reuse_buffers
+        self.cache = cache
+        self.profiler = profiler
+        self.buffers = {}
+        self.trace = NULL_TRACE
+
+    def buffer(self, name: str, shape: tuple, dtype) -> np.ndarray:
+        """
+        获取预分配的缓冲区, 尺寸或类型变化时重新分配
+        :param name: 缓冲区名称
+        :param shape: 形状
+        :param dtype: 数据类型
+        :return: 缓冲区, 不复用时返回None
+        """
+        if not self.reuse_buffers:
+            return None
+        buffer = self.buffers.get(name)
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            buffer = self.buffers[name] = np.empty(shape, dtype=dtype)
+        return buffer
+
+    def begin(self, tag: str = None, profiler: Profiler = None) -> Trace:
+        """
+        开始记录一张图像
+        :param tag: 图像标记, 如图像路径
+        :param profiler: 性能分析器, 默认为self.profiler
+        :return: 当前图像的 Trace, 包含 stages(阶段耗时, 秒) 与 counters(像素数、区域数等)
+        """
+        self.trace = Trace(tag, profiler or self.profiler)
+        return self.trace
+
+    def end(self):
+        """
+        结束记录, 之后单独调用的阶段不再计时
+        """
+        self.trace = NULL_TRACE
+
+    def decode(self, image) -> np.ndarray:
+        """
+        解码阶段
+        :param image: 图像路径或图像数组(格式RGB)
+        :return: 图像数组, 缓存命中时为只读的内存映射数组
+        """
+        with self.trace.stage('decode'):
+            if self.cache is None or isinstance(image, np.ndarray):
+                image = load_image(image)
+            else:
+                image = self.cache.load(image, lambda: load_image(image))
+        self.trace.count('pixels', image.shape[0] * image.shape[1])
+        return image
+
+    def blur(self, image: np.ndarray, source: str = None) -> np.ndarray:
+        """
+        模糊阶段
+        :param image: 图像数组
+        :param source: 图像路径, 指定且缓存开启了模糊结果时从缓存读取
+        :return: 模糊后的图像, 位于缓冲区或缓存中
+        """
+        with self.trace.stage('blur'):
+            if self.cache is not None and self.cache.blurred and source is not None:
+                return self.cache.load(source, lambda: GaussianBlur(image, (5, 5), 0), kind='blurred')
+            return GaussianBlur(image, (5, 5), 0, dst=self.buffer('blur', image.shape, image.dtype))
+
+    def classify(self, image: np.ndarray) -> np.ndarray:
+        """
+        分类阶段
+        :param image: 模糊后的图像
+        :return: 前景为255、背景为0的掩码
+        """
+        with self.trace.stage('classify'):
+            return self._classify(image)
+
+    def _classify(self, image: np.ndarray) -> np.ndarray:
+        # 分类阶段的计算, 不记录阶段耗时, 供已在'classify'阶段内的调用方(如 segment_stack)使用
+        if self.scale < 1:
+            small = resize(image, None, fx=self.scale, fy=self.scale, interpolation=INTER_AREA)
+            labels = classify_image(small, model=self.model, backend=self.backend)
+            if self.model is not None:
+                centers = self.model.centers
+            elif self.backend.startswith('lut_'):
+                centers = DEFAULT_CENTERS
+            else:
+                centers = class_centers(small, labels, n_clusters=2)
+            labels = refine_labels(image, labels, centers, band_width=self.band_width)
+        else:
+            labels = classify_image(image, model=self.model, backend=self.backend)
+        return (255 - labels * 255).astype(np.uint8)
+
+    def morphology(self, mask: np.ndarray) -> np.ndarray:
+        """
+        形态学阶段
+        :param mask: 掩码
+        :return: 闭运算后的掩码, 位于缓冲区中
+        """
+        with self.trace.stage('morphology'):
+            # 只在前景附近计算, 结果与整图闭运算一致
+            return closing_roi(mask, kernel_size=5, iterations=5,
+                               dst=self.buffer('closing', mask.shape, mask.dtype))
+
+    def regions(self, mask: np.ndarray) -> SimpleNamespace:
+        """
+        连通区域阶段
+        :param mask: 闭运算后的掩码
+        :return: 连通区域
+        """
+        with self.trace.stage('regions'):
+            connect_info = get_connect_part(mask, piex_threshold=self.piex_threshold)
+        self.trace.count('regions', connect_info.number_cls)
+        return connect_info
+
+    def segment(self, image: np.ndarray, source: str = None) -> SimpleNamespace:
+        """
+        从解码后的图像得到连通区域: blur → classify → morphology → regions
+        :param image: 图像数组, 格式为RGB
+        :param source: 图像路径, 用于读取缓存的模糊结果
+        :return: 连通区域
+        """
+        return self.regions(self.morphology(self.classify(self.blur(image, source=source))))
+
+    def segment_stack(self, stack: np.ndarray) -> list:
+        """
+        同尺寸图像组的分割: 模糊与闭运算写入整组的缓冲区;
+        未指定model且backend为'kmeans'/'minibatch'时整组共用一次聚类拟合(见 core.cluster_stack), 而不是逐张拟合
+        :param stack: 图像组, (N, H, W, C), 格式为RGB
+        :return: 每张图像的连通区域
+        """
+        with self.trace.stage('blur'):
+            blurred = blur_stack(stack, dst=self.buffer('blur_stack', stack.shape, stack.dtype))
+        with self.trace.stage('classify'):
+            n, height, width = stack.shape[:3]
+            if self.scale < 1 or self.model is not None or self.backend.startswith('lut_'):
+                # 聚类中心已确定时逐张分类, 合并成一次调用反而因临时数组超出缓存而变慢;
+                # 已在'classify'阶段内, 直接调用 _classify, 避免同一段耗时被记录两次
+                masks = np.empty((n, height, width), dtype=np.uint8)
+                for image, mask in zip(blurred, masks):
+                    mask[...] = self._classify(image)
+            else:
+                # 整组共用一次聚类拟合, 代替逐张拟合
+                labels = cluster_stack(blurred, n_clusters=2, backend=self.backend)
+                masks = (255 - labels * 255).astype(np.uint8)
+        with self.trace.stage('morphology'):
+            closed = closing_stack(masks, kernel_size=5, iterations=5,
+                                   dst=self.buffer('closing_stack', masks.shape, masks.dtype))
+        return [self.regions(mask) for mask in closed]
+
+    def render(self, image: np.ndarray, connect_info: SimpleNamespace, filename: str) -> SimpleNamespace:
+        """
+        结果阶段
+        :param image: 图像数组, 格式为RGB
+        :param connect_info: 连通区域
+        :param filename: 图像文件名
+        :return: 与 api.get_result 格式一致的结果
+        """
+        with self.trace.stage('render'):
+            # 前景图像只在保存前景时按区域生成
+            foreground = Foreground(image, connect_info.labeled_img.astype(np.uint8, copy=False))
+            # 所有区域的面积一次换算
+            regions = RegionTable.from_regions(connect_info.piex, connect_info.boxes, connect_info.centroids)
+            area = regions.area('mm').tolist()
+        return SimpleNamespace(
+            image=image,
+            foreground=foreground,
+            cls=connect_info.number_cls,
+            area=area,
+            boxes=connect_info.boxes,
+            regions=regions,
+            filename=filename
+        )
+
+    def run(self, image, filename: str = None) -> SimpleNamespace:
+        """
+        运行全部阶段
+        :param image: 图像路径或图像数组(格式RGB)
+        :param filename: 图像文件名, 默认取图像路径的文件名
+        :return: 与 api.get_result 格式一致的结果
+        """
+        if filename is None:
+            assert not isinstance(image, np.ndarray), "filename is required for image array"
+            filename = Path(image).name
+        source = None if isinstance(image, np.ndarray) else image
+        image = self.decode(image)
+        return self.render(image, self.segment(image, source=source), filename)
@@ -0,0 +1,164 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Callable
+
+# 导出格式: 每行一个事件的JSON-lines, 或可在 chrome://tracing / Perfetto 中打开的Chrome trace
+TRACE_FORMATS = ('jsonl', 'chrome')
+
+
+class Profiler:
+    """
+    性能分析器
+    收集各图像各阶段的耗时事件与计数事件, 依次调用回调函数, 并可导出为JSON-lines或Chrome trace;
+    可在多个线程间共用
+    """
+
+    def __init__(self, hooks: list = None, trace: str = None, trace_format: str = None):
+        """
+        :param hooks: 回调函数列表, 每个事件调用一次 hook(event), 见 emit
+        :param trace: 导出文件路径
+        :param trace_format: 导出格式, 见TRACE_FORMATS, 默认由扩展名决定(.jsonl为JSON-lines, 其余为Chrome trace)
+        """
+        if trace_format is None and trace is not None:
+            trace_format = 'jsonl' if Path(trace).suffix.lower() == '.jsonl' else 'chrome'
+        assert trace_format is None or trace_format in TRACE_FORMATS, f"trace_format must be one of {TRACE_FORMATS}"
+        self.hooks = list(hooks or [])
+        self.trace = trace
+        self.trace_format = trace_format
+        self.origin = time.perf_counter()
+        self.lock = threading.Lock()
+        # 汇总: 阶段 -> [次数, 总耗时], 计数 -> 总数
+        self.stages = {}
+        self.counters = {}
+        self.events = []
+        self.file = open(trace, 'w') if trace_format == 'jsonl' else None
+
+    def add_hook(self, hook: Callable):
+        self.hooks.append(hook)
+
+    def emit(self, event: SimpleNamespace):
+        """
+        记录一个事件
+        :param event: kind('stage'或'counter'), name, tag(图像路径), start(秒, 相对于分析器创建时间),
+                      duration(秒, 仅stage), value(仅counter), thread
+        """
+        with self.lock:
+            if event.kind == 'stage':
+                total = self.stages.setdefault(event.name, [0, 0.0])
+                total[0] += 1
+                total[1] += event.duration
+            else:
+                self.counters[event.name] = self.counters.get(event.name, 0) + event.value
+                event.total = self.counters[event.name]
+            if self.file is not None:
+                self.file.write(json.dumps(vars(event), default=str) + '\n')
+            elif self.trace_format == 'chrome':
+                self.events.append(event)
+        for hook in self.hooks:
+            hook(event)
+
+    def stage_event(self, name: str, tag: str, start: float, end: float):
+        self.emit(SimpleNamespace(kind='stage', name=name, tag=tag, start=start - self.origin,
+                                  duration=end - start, thread=threading.get_ident()))
+
+    def counter_event(self, name: str, tag: str, value):
+        self.emit(SimpleNamespace(kind='counter', name=name, tag=tag, start=time.perf_counter() - self.origin,
+                                  value=value, thread=threading.get_ident()))
+
+    def summary(self) -> SimpleNamespace:
+        """
+        :return: stages: {阶段: {count, total, mean}}, counters: {计数: 总数}
+        """
+        with self.lock:
+            stages = {name: dict(count=count, total=total, mean=total / count)
+                      for name, (count, total) in self.stages.items()}
+            return SimpleNamespace(stages=stages, counters=dict(self.counters))
+
+    def close(self):
+        """
+        结束分析, 写出Chrome trace
+        """
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+            elif self.trace_format == 'chrome':
+                Path(self.trace).write_text(json.dumps({'traceEvents': [self._chrome(event)
+                                                                        for event in self.events]}))
+                self.events = []
+
+    @staticmethod
+    def _chrome(event: SimpleNamespace) -> dict:
+        item = dict(name=event.name, pid=os.getpid(), tid=event.thread, ts=event.start * 1e6)
+        if event.kind == 'stage':
+            item.update(ph='X', cat='stage', dur=event.duration * 1e6, args=dict(tag=str(event.tag)))
+        else:
+            item.update(ph='C', cat='counter', args={event.name: event.total})
+        return item
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class Trace:
+    """
+    单张图像的阶段耗时与计数, 同时转发给性能分析器(如有)
+    """
+
+    def __init__(self, tag: str = None, profiler: Profiler = None):
+        """
+        :param tag: 图像标记, 如图像路径
+        :param profiler: 性能分析器
+        """
+        self.tag = tag
+        self.profiler = profiler
+        self.stages = {}
+        self.counters = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        计时一个阶段, 同名阶段的耗时累加
+        :param name: 阶段名称
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self.stages[name] = self.stages.get(name, 0.0) + end - start
+            if self.profiler is not None:
+                self.profiler.stage_event(name, self.tag, start, end)
+
+    def count(self, name: str, value=1):
+        """
+        累加计数
+        :param name: 计数名称, 如'pixels'、'regions'、'bytes_written'
+        :param value: 增量
+        """
+        self.counters[name] = self.counters.get(name, 0) + value
+        if self.profiler is not None:
+            self.profiler.counter_event(name, self.tag, value)
+
+
+class _NullTrace(Trace):
+    """
+    不记录任何内容, 单独调用流水线阶段时使用
+    """
+
+    def stage(self, name: str):
+        return nullcontext()
+
+    def count(self, name: str, value=1):
+        pass
+
+
+NULL_TRACE = _NullTrace()
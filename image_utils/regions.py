@@ -0,0 +1,124 @@
+import numpy as np
+
+from image_utils.core import PIXEL_SIZE
+
+# 面积单位, 换算与 core.get_area 一致
+AREA_UNITS = ('um', 'mm', 'cm', 'm')
+# 列名 -> 类型; x为行、y为列, 与 core.get_connect_part 的boxes、centroids坐标顺序一致
+FIELDS = dict(image=np.int32, index=np.int32, pixels=np.int64, x_min=np.int32, y_min=np.int32, x_max=np.int32,
+              y_max=np.int32, centroid_x=np.float64, centroid_y=np.float64)
+
+
+def convert_area(pixels, unit: str = 'mm') -> np.ndarray:
+    """
+    像素数与面积的转换, 对整列一次计算, 结果与 core.get_area 逐项一致(保留两位小数)
+    :param pixels: 像素数数组
+    :param unit: 面积单位, 见AREA_UNITS
+    :return: 面积数组
+    """
+    assert unit in AREA_UNITS, f"unit must be one of {AREA_UNITS}"
+    area = PIXEL_SIZE ** 2 * np.asarray(pixels, dtype=np.float64)
+    if unit == 'um':
+        area = area * 10000
+    elif unit == 'cm':
+        area = area / 100
+    elif unit == 'm':
+        area = area / 1000000
+    return np.round(area, 2)
+
+
+class RegionTable:
+    """
+    连通区域表
+    按列保存, 每列为一个连续的NumPy数组: 多张图像的表拼接时每列只需一次 np.concatenate,
+    面积按列向量化换算, 转换为pandas DataFrame或Arrow表时不复制数据; 需要按行处理时转换为结构化数组
+    """
+
+    def __init__(self, columns: dict = None):
+        """
+        :param columns: 列名 -> 数组, 列名见FIELDS, 缺少的列为空
+        """
+        columns = columns or {}
+        self.columns = {name: np.ascontiguousarray(columns.get(name, ()), dtype=dtype)
+                        for name, dtype in FIELDS.items()}
+        assert len({len(column) for column in self.columns.values()}) == 1, "columns must have the same length"
+
+    @classmethod
+    def from_regions(cls, pixels, boxes, centroids, image: int = 0) -> 'RegionTable':
+        """
+        由一张图像的连通区域创建
+        :param pixels: 各区域的像素数
+        :param boxes: 各区域的外接框 [x_min, y_min, x_max, y_max]
+        :param centroids: 各区域的质心 [x, y]
+        :param image: 图像编号
+        :return: 连通区域表, index从1开始, 与切割图像的文件名一致
+        """
+        boxes = np.asarray(boxes, dtype=np.int32).reshape(-1, 4)
+        centroids = np.asarray(centroids, dtype=np.float64).reshape(-1, 2)
+        count = len(boxes)
+        return cls(dict(image=np.full(count, image), index=np.arange(1, count + 1), pixels=pixels,
+                        x_min=boxes[:, 0], y_min=boxes[:, 1], x_max=boxes[:, 2], y_max=boxes[:, 3],
+                        centroid_x=centroids[:, 0], centroid_y=centroids[:, 1]))
+
+    @classmethod
+    def concat(cls, tables, images=None) -> 'RegionTable':
+        """
+        拼接多个连通区域表
+        :param tables: 连通区域表的可迭代对象
+        :param images: 各表的图像编号, 指定时覆盖image列, 如批量处理结果的index
+        :return: 连通区域表
+        """
+        tables = list(tables)
+        if not tables:
+            return cls()
+        columns = {name: np.concatenate([table.columns[name] for table in tables]) for name in FIELDS}
+        if images is not None:
+            columns['image'] = np.repeat(np.asarray(images), [len(table) for table in tables])
+        return cls(columns)
+
+    def __len__(self) -> int:
+        return len(self.columns['pixels'])
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.columns[name]
+
+    def area(self, unit: str = 'mm') -> np.ndarray:
+        """
+        :param unit: 面积单位, 见AREA_UNITS
+        :return: 各区域的面积
+        """
+        return convert_area(self.columns['pixels'], unit)
+
+    def _export(self, units) -> dict:
+        return dict(self.columns, **{f'area_{unit}': self.area(unit) for unit in units})
+
+    def to_records(self, units=AREA_UNITS) -> np.ndarray:
+        """
+        :param units: 包含的面积单位, 每个单位一列 area_单位
+        :return: 结构化数组, 每行一个区域
+        """
+        columns = self._export(units)
+        records = np.empty(len(self), dtype=[(name, column.dtype) for name, column in columns.items()])
+        for name, column in columns.items():
+            records[name] = column
+        return records
+
+    def to_pandas(self, units=('mm',)):
+        """
+        转换为pandas DataFrame, 各列直接引用表中的数组
+        :param units: 包含的面积单位, 见 to_records
+        :return: DataFrame
+        """
+        import pandas as pd
+
+        return pd.DataFrame(self._export(units), copy=False)
+
+    def to_arrow(self, units=('mm',)):
+        """
+        转换为Arrow表, 数值列不复制数据, 需要安装pyarrow
+        :param units: 包含的面积单位, 见 to_records
+        :return: pyarrow.Table
+        """
+        import pyarrow as pa
+
+        return pa.table(self._export(units))
@@ -0,0 +1,77 @@
+import importlib.resources as pkg_resources
+from functools import lru_cache
+
+from PIL import Image, ImageDraw, ImageFont
+
+# 系统字体不存在时使用包内字体
+BUNDLED_FONT = 'font/yahei.ttf'
+
+
+@lru_cache(maxsize=None)
+def load_font(name: str, size: int) -> ImageFont.FreeTypeFont:
+    """
+    加载字体, 每个进程每种字体只加载一次
+    依次尝试系统字体、包内字体(image_utils/font/yahei.ttf)、Pillow默认字体
+    :param name: 字体文件名, 如'msyh.ttc'
+    :param size: 字号
+    :return: 字体
+    """
+    try:
+        return ImageFont.truetype(name, size)
+    except OSError:
+        pass
+    bundled = pkg_resources.files('image_utils').joinpath(BUNDLED_FONT)
+    if bundled.is_file():
+        with pkg_resources.as_file(bundled) as path:
+            return ImageFont.truetype(str(path), size)
+    return ImageFont.load_default(size)
+
+
+class AnnotationRenderer:
+    """
+    标注渲染
+    每张图像只把框和文字绘制一次到单通道覆盖层上, 再以纯色合成到需要输出的各个图像上
+    """
+
+    def __init__(self, color: tuple = (255, 0, 0), boundary_width: int = 4, font: str = 'msyh.ttc',
+                 font_size: int = 30, index_font: str = 'msyhbd.ttc', index_font_size: int = 60):
+        """
+        :param color: 标注颜色
+        :param boundary_width: 框线宽度
+        :param font: 面积文字字体
+        :param font_size: 面积文字字号
+        :param index_font: 序号文字字体
+        :param index_font_size: 序号文字字号
+        """
+        self.color = color
+        self.boundary_width = boundary_width
+        self.font = load_font(font, font_size)
+        self.index_font = load_font(index_font, index_font_size)
+
+    def overlay(self, size: tuple, boxes: list, area: list) -> Image.Image:
+        """
+        绘制标注覆盖层
+        :param size: 图像尺寸 (width, height)
+        :param boxes: 连通区域坐标 [x_min, y_min, x_max, y_max], x为行、y为列
+        :param area: 连通区域面积
+        :return: 单通道覆盖层, 标注处为255
+        """
+        overlay = Image.new('L', size, 0)
+        draw = ImageDraw.Draw(overlay)
+        for index, box in enumerate(boxes):
+            draw.rectangle((box[1], box[0], box[3], box[2]), outline=255, width=self.boundary_width)
+            draw.text((box[1] + (box[3] - box[1] - 30) // 2, box[0]), f'{index + 1}', font=self.index_font,
+                      fill=255)
+            draw.text((box[1] + 10, box[2] - 40), f'{area[index]}', font=self.font, fill=255)
+        return overlay
+
+    def composite(self, image: Image.Image, overlay: Image.Image) -> Image.Image:
+        """
+        将覆盖层以标注颜色合成到图像上(原地修改)
+        :param image: RGB或RGBA图像
+        :param overlay: 标注覆盖层
+        :return: image
+        """
+        color = self.color if image.mode == 'RGB' else self.color + (255,)
+        image.paste(color, mask=overlay)
+        return image
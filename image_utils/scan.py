@@ -0,0 +1,142 @@
+import fnmatch
+import os
+import queue
+import threading
+from typing import Callable, Iterator
+
+# 图片扩展名(小写), 比较时先把扩展名转为小写
+IMAGE_SUFFIXES = frozenset({'.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff'})
+
+
+def _matches(relative: str, name: str, patterns) -> bool:
+    # 模式与相对路径(以/分隔)或文件名匹配即可, 如 '*.jpg'、'thumbs'、'2023/*/raw/*'
+    return any(fnmatch.fnmatch(relative, pattern) or fnmatch.fnmatch(name, pattern) for pattern in patterns)
+
+
+def scan_images(path: str, include: list = None, exclude: list = None, suffixes=IMAGE_SUFFIXES,
+                onerror: Callable = None, follow_symlinks: bool = True, ordered: bool = False) -> Iterator[str]:
+    """
+    递归查找目录下的图片, 边查找边返回
+    使用os.scandir, 文件类型来自目录项本身, 不需要对每个文件单独stat;
+    图片在读取目录项的同时返回, 不等待整个目录读完(网络盘上的大目录也能立即开始处理), 子目录按名称顺序进入
+    :param path: 目录路径
+    :param include: 只返回匹配任一模式的图片, 模式见 fnmatch
+    :param exclude: 跳过匹配任一模式的图片和目录(不再进入该目录)
+    :param suffixes: 图片扩展名(小写)
+    :param onerror: 目录无法读取时调用 onerror(OSError), 默认忽略
+    :param follow_symlinks: 是否进入指向目录的符号链接; 指向上级目录(形成循环)的符号链接不进入
+    :param ordered: 同一目录内的图片是否按名称排序返回, 排序需要先读完整个目录; 默认按目录项的顺序
+    :return: 图片路径的迭代器
+    """
+    root = os.fspath(path)
+    prefix = len(os.path.join(root, ''))
+    # (目录, 上级目录的 (st_dev, st_ino)), 上级目录只在跟随符号链接时用于检测循环
+    stack = [(root, ())]
+    while stack:
+        directory, ancestors = stack.pop()
+        try:
+            if follow_symlinks:
+                stat = os.stat(directory)
+                if (stat.st_dev, stat.st_ino) in ancestors:
+                    continue
+                ancestors += ((stat.st_dev, stat.st_ino),)
+            iterator = os.scandir(directory)
+        except OSError as e:
+            if onerror is not None:
+                onerror(e)
+            continue
+        directories = []
+        with iterator:
+            try:
+                for entry in sorted(iterator, key=lambda item: item.name) if ordered else iterator:
+                    relative = entry.path[prefix:].replace(os.sep, '/')
+                    if exclude and _matches(relative, entry.name, exclude):
+                        continue
+                    try:
+                        is_dir = entry.is_dir(follow_symlinks=follow_symlinks)
+                    except OSError:
+                        continue
+                    if is_dir:
+                        directories.append(entry)
+                    elif os.path.splitext(entry.name)[1].lower() in suffixes:
+                        if not include or _matches(relative, entry.name, include):
+                            yield entry.path
+            except OSError as e:
+                # 读取目录项的中途出错, 已找到的子目录仍然进入
+                if onerror is not None:
+                    onerror(e)
+        # 先处理当前目录的图片, 再按名称顺序进入子目录
+        directories.sort(key=lambda item: item.name)
+        stack.extend((entry.path, ancestors) for entry in reversed(directories))
+
+
+class ImageScanner:
+    """
+    后台扫描图片
+    在单独的线程中运行 scan_images, 找到的图片立即可以迭代取出处理, 同时维护已找到的数量
+    """
+    _end = object()
+
+    def __init__(self, path: str, include: list = None, exclude: list = None, suffixes=IMAGE_SUFFIXES,
+                 on_progress: Callable = None, progress_interval: int = 100, follow_symlinks: bool = True,
+                 ordered: bool = False):
+        """
+        :param path: 目录路径
+        :param include: 见 scan_images
+        :param exclude: 见 scan_images
+        :param suffixes: 图片扩展名(小写)
+        :param on_progress: 每找到progress_interval张图片以及扫描结束时调用 on_progress(count, done)
+        :param progress_interval: 调用on_progress的间隔
+        :param follow_symlinks: 见 scan_images
+        :param ordered: 见 scan_images
+        """
+        self.path = path
+        self.errors = []
+        self.options = dict(include=include, exclude=exclude, suffixes=suffixes, onerror=self.errors.append,
+                            follow_symlinks=follow_symlinks, ordered=ordered)
+        self.on_progress = on_progress
+        self.progress_interval = progress_interval
+        self.queue = queue.SimpleQueue()
+        self.count = 0
+        self.done = threading.Event()
+        self._cancel = threading.Event()
+        self.thread = threading.Thread(target=self._scan, name='image-scanner', daemon=True)
+
+    def start(self) -> 'ImageScanner':
+        self.thread.start()
+        return self
+
+    def cancel(self):
+        """
+        停止扫描, 已找到的图片仍可取出
+        """
+        self._cancel.set()
+
+    def _scan(self):
+        try:
+            for image in scan_images(self.path, **self.options):
+                if self._cancel.is_set():
+                    break
+                self.count += 1
+                self.queue.put(image)
+                if self.on_progress is not None and self.count % self.progress_interval == 0:
+                    self.on_progress(self.count, False)
+        finally:
+            self.done.set()
+            try:
+                if self.on_progress is not None:
+                    self.on_progress(self.count, True)
+            finally:
+                self.queue.put(self._end)
+
+    def __iter__(self) -> Iterator[str]:
+        """
+        按找到的顺序取出图片, 扫描结束后停止; 只能迭代一次
+        """
+        if self.thread.ident is None:
+            self.start()
+        while True:
+            image = self.queue.get()
+            if image is self._end:
+                return
+            yield image
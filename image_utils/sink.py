@@ -0,0 +1,224 @@
+import csv
+import sqlite3
+from abc import ABC, abstractmethod
+from itertools import repeat
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Iterator
+
+# pandas只在读取结果与转换为xlsx时导入, 写入时不需要
+# 结果表格的列, 与GUI导出的result.xlsx一致
+COLUMNS = ('filename', 'area', 'index', 'path', 'x_min', 'y_min', 'x_max', 'y_max')
+# xlsx每个工作表的最大行数(含表头)
+XLSX_MAX_ROWS = 1048576
+
+
+def result_rows(result: SimpleNamespace) -> list:
+    """
+    把一张图像的结果展开为表格行, 没有连通区域的图像记为一行面积为0的结果
+    :param result: api.main 的返回值
+    :return: 行列表, 列顺序见COLUMNS
+    """
+    if result.cls == 0:
+        return [(result.filename, 0, 1, str(result.image_path), '', '', '', '')]
+    regions = getattr(result, 'regions', None)
+    if regions is not None:
+        # 按列取出, 不逐个索引区域
+        columns = [regions[name].tolist() for name in ('index', 'x_min', 'y_min', 'x_max', 'y_max')]
+        return list(zip(repeat(result.filename), result.area, columns[0], repeat(str(result.image_path)),
+                        *columns[1:]))
+    return [(result.filename, result.area[item], item + 1, str(result.image_path), *result.boxes[item])
+            for item in range(result.cls)]
+
+
+class ResultSink(ABC):
+    """
+    结果表格的流式写入
+    每张图像的结果到达后追加到缓冲区, 缓冲区满buffer_rows行时写入文件, 内存占用与结果总数无关
+    """
+    suffix = None
+
+    def __init__(self, path: str, buffer_rows: int = 1000):
+        """
+        :param path: 结果文件路径, 已存在时覆盖
+        :param buffer_rows: 缓冲的行数
+        """
+        self.path = Path(path)
+        self.buffer_rows = buffer_rows
+        self.rows = []
+        self.count = 0
+
+    def write(self, result: SimpleNamespace):
+        """
+        写入一张图像的结果
+        :param result: api.main 的返回值
+        """
+        self.rows.extend(result_rows(result))
+        if len(self.rows) >= self.buffer_rows:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            self._write_rows(self.rows)
+            self.count += len(self.rows)
+            self.rows = []
+
+    def close(self):
+        self.flush()
+
+    @abstractmethod
+    def chunks(self, chunk_rows: int = 100000) -> Iterator:
+        """
+        分块读取已写入的结果, 需要pandas
+        :param chunk_rows: 每块的行数
+        :return: DataFrame迭代器
+        """
+
+    @abstractmethod
+    def _write_rows(self, rows: list):
+        """
+        把缓冲的行写入文件
+        :param rows: 行列表, 列顺序见COLUMNS
+        """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class CSVSink(ResultSink):
+    suffix = '.csv'
+
+    def __init__(self, path: str, buffer_rows: int = 1000):
+        super().__init__(path, buffer_rows)
+        # utf-8-sig: Excel直接打开时中文文件名不乱码
+        self.file = open(self.path, 'w', newline='', encoding='utf-8-sig')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(COLUMNS)
+
+    def _write_rows(self, rows: list):
+        self.writer.writerows(rows)
+        self.file.flush()
+
+    def close(self):
+        if not self.file.closed:
+            super().close()
+            self.file.close()
+
+    def chunks(self, chunk_rows: int = 100000) -> Iterator:
+        import pandas as pd
+        self.flush()
+        yield from pd.read_csv(self.path, chunksize=chunk_rows, encoding='utf-8-sig')
+
+
+class SQLiteSink(ResultSink):
+    suffix = '.sqlite'
+
+    def __init__(self, path: str, buffer_rows: int = 1000):
+        super().__init__(path, buffer_rows)
+        self.path.unlink(missing_ok=True)
+        self.connection = sqlite3.connect(self.path)
+        columns = ', '.join(f'"{column}"' for column in COLUMNS)
+        self.connection.execute(f'CREATE TABLE results ({columns})')
+
+    def _write_rows(self, rows: list):
+        with self.connection:
+            self.connection.executemany(f'INSERT INTO results VALUES ({", ".join("?" * len(COLUMNS))})', rows)
+
+    def close(self):
+        if self.connection is not None:
+            super().close()
+            self.connection.close()
+            self.connection = None
+
+    def chunks(self, chunk_rows: int = 100000) -> Iterator:
+        import pandas as pd
+        self.flush()
+        with sqlite3.connect(self.path) as connection:
+            yield from pd.read_sql_query('SELECT * FROM results ORDER BY rowid', connection, chunksize=chunk_rows)
+
+
+class ParquetSink(ResultSink):
+    """
+    Parquet格式, 每次写入一个行组; 需要安装pyarrow
+    """
+    suffix = '.parquet'
+
+    def __init__(self, path: str, buffer_rows: int = 10000):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        super().__init__(path, buffer_rows)
+        # 没有连通区域的行坐标为空, 坐标列保存为可空整数
+        self.schema = pa.schema([('filename', pa.string()), ('area', pa.float64()), ('index', pa.int64()),
+                                 ('path', pa.string()), ('x_min', pa.int64()), ('y_min', pa.int64()),
+                                 ('x_max', pa.int64()), ('y_max', pa.int64())])
+        self.writer = pq.ParquetWriter(self.path, self.schema)
+
+    def _write_rows(self, rows: list):
+        import pyarrow as pa
+        columns = [list(column) for column in zip(*rows)]
+        for column in columns[4:]:
+            column[:] = [None if value == '' else value for value in column]
+        self.writer.write_table(pa.Table.from_arrays(columns, schema=self.schema))
+
+    def close(self):
+        if self.writer is not None:
+            super().close()
+            self.writer.close()
+            self.writer = None
+
+    def chunks(self, chunk_rows: int = 100000) -> Iterator:
+        import pyarrow.parquet as pq
+        self.flush()
+        for batch in pq.ParquetFile(self.path).iter_batches(batch_size=chunk_rows):
+            yield batch.to_pandas()
+
+
+SINKS = {sink.suffix: sink for sink in (CSVSink, SQLiteSink, ParquetSink)}
+
+
+def open_sink(path: str, buffer_rows: int = None) -> ResultSink:
+    """
+    按扩展名创建结果写入器
+    :param path: 结果文件路径, 扩展名为 .csv / .sqlite / .parquet
+    :param buffer_rows: 缓冲的行数, 默认使用各格式的默认值
+    :return: 结果写入器
+    """
+    suffix = Path(path).suffix.lower()
+    assert suffix in SINKS, f"suffix must be one of {tuple(SINKS)}"
+    if buffer_rows is None:
+        return SINKS[suffix](path)
+    return SINKS[suffix](path, buffer_rows=buffer_rows)
+
+
+def to_xlsx(sink: ResultSink, path: str, failed: list = None, chunk_rows: int = 100000):
+    """
+    把已写入的结果转换为xlsx, 分块读取, 超过单个工作表行数上限时续写到result_2、result_3...
+    :param sink: 结果写入器
+    :param path: xlsx路径
+    :param failed: 处理失败的图像, 元素包含image_path与error, 非空时写入failed工作表
+    :param chunk_rows: 每次读取的行数
+    """
+    import pandas as pd
+    with pd.ExcelWriter(str(path)) as writer:
+        sheet, row = 1, 0
+        empty = True
+        for chunk in sink.chunks(chunk_rows):
+            while len(chunk):
+                name = 'result' if sheet == 1 else f'result_{sheet}'
+                part = chunk.iloc[:XLSX_MAX_ROWS - 1 - row]
+                part.to_excel(writer, sheet_name=name, index=False, header=row == 0,
+                              startrow=0 if row == 0 else row + 1)
+                row += len(part)
+                chunk = chunk.iloc[len(part):]
+                empty = False
+                if row >= XLSX_MAX_ROWS - 1:
+                    sheet, row = sheet + 1, 0
+        if empty:
+            pd.DataFrame(columns=COLUMNS).to_excel(writer, sheet_name='result', index=False)
+        if failed:
+            pd.DataFrame({'path': [str(item.image_path) for item in failed],
+                          'error': [item.error for item in failed]}).to_excel(writer, sheet_name='failed',
+                                                                              index=False)
@@ -0,0 +1,248 @@
+import queue
+import threading
+import time
+import traceback
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Callable, Iterator
+
+from image_utils.api import cut, get_output_paths, make_result
+from image_utils.archive import new_archive
+from image_utils.batch import BatchProcessor
+from image_utils.pipeline import Pipeline
+from image_utils.profiling import Profiler, Trace, NULL_TRACE
+
+# 阶段顺序: 解码 → 分割(模糊、分类、闭运算) → 连通区域 → 结果(面积与保存图像)
+STAGES = ('decode', 'segment', 'regions', 'render')
+# 各阶段的默认线程数
+DEFAULT_THREADS = dict(decode=2, segment=2, regions=1, render=2)
+
+_END = object()
+
+
+class StageQueue:
+    """
+    阶段之间的有界队列
+    同时统计占用情况: 按时间加权的平均长度、最大长度, 以及因队列满(下游较慢)或队列空(上游较慢)等待的时间
+    """
+
+    def __init__(self, name: str, maxsize: int, profiler: Profiler = None):
+        """
+        :param name: 队列名称, 即从队列中取出图像的阶段
+        :param maxsize: 容量
+        :param profiler: 性能分析器, 队列长度变化时记录'queue.名称'计数事件
+        """
+        assert maxsize > 0, "maxsize must be positive"
+        self.name = name
+        self.maxsize = maxsize
+        self.profiler = profiler
+        self.queue = queue.Queue(maxsize)
+        self.lock = threading.Lock()
+        self.start = self.last = time.perf_counter()
+        self.length = 0
+        self.area = 0.0
+        self.max = 0
+        self.full = 0.0
+        self.empty = 0.0
+
+    def _sample(self):
+        with self.lock:
+            now = time.perf_counter()
+            self.area += self.length * (now - self.last)
+            self.last = now
+            length = self.queue.qsize()
+            delta, self.length = length - self.length, length
+            self.max = max(self.max, length)
+        if delta and self.profiler is not None:
+            self.profiler.counter_event(f'queue.{self.name}', None, delta)
+
+    def put(self, item):
+        start = time.perf_counter()
+        self.queue.put(item)
+        waited = time.perf_counter() - start
+        with self.lock:
+            self.full += waited
+        self._sample()
+
+    def get(self):
+        start = time.perf_counter()
+        item = self.queue.get()
+        waited = time.perf_counter() - start
+        with self.lock:
+            self.empty += waited
+        self._sample()
+        return item
+
+    def stats(self) -> dict:
+        """
+        :return: capacity(容量), mean(平均长度), max(最大长度), full(放入时等待的总秒数), empty(取出时等待的总秒数)
+        """
+        self._sample()
+        with self.lock:
+            elapsed = self.last - self.start
+            return dict(capacity=self.maxsize, mean=self.area / elapsed if elapsed else 0.0, max=self.max,
+                        full=self.full, empty=self.empty)
+
+
+class StagedProcessor(BatchProcessor):
+    """
+    单进程多线程的分阶段批量处理
+    decode → segment → regions → render 每两个阶段之间一个有界队列, 每个阶段可以有多个线程;
+    解码、编码与OpenCV的主要运算都会释放GIL, 不同阶段的图像同时处理;
+    图像数组在线程间直接传递, 不需要序列化, 也没有工作进程的启动开销
+    """
+
+    def __init__(self, save_path: str, source_dir: str, threads: dict = None, queue_size: int = 2,
+                 profiler: Profiler = None, **options):
+        """
+        :param save_path: 保存路径
+        :param source_dir: 原始图像所在目录
+        :param threads: 各阶段的线程数, 如 {'segment': 4}, 未指定的阶段见DEFAULT_THREADS
+        :param queue_size: 每个阶段输入队列的容量
+        :param profiler: 性能分析器, 接收各图像各阶段的耗时事件与各队列长度的计数事件
+        :param options: 见 BatchProcessor; 图像在render阶段的线程中同步编码写入,
+                        workers、chunksize、max_pending、writer_threads、writer_bytes 不使用;
+                        archive_scope为'run'时所有切割图像写入 保存路径/crops_编号.tar, 每次运行新建一个
+        """
+        super().__init__(save_path, source_dir, **options)
+        assert self.options['tile_size'] is None, "tile_size is not supported by StagedProcessor"
+        self.threads = dict(DEFAULT_THREADS, **(threads or {}))
+        assert set(self.threads) <= set(STAGES), f"threads keys must be in {STAGES}"
+        assert all(count > 0 for count in self.threads.values()), "threads must be positive"
+        self.queue_size = queue_size
+        self.profiler = profiler
+        self.queues = {}
+        self.busy = dict.fromkeys(STAGES, 0.0)
+        self.started = None
+        self.lock = threading.Lock()
+
+    def occupancy(self) -> SimpleNamespace:
+        """
+        各阶段的繁忙程度与各阶段输入队列的占用情况, 处理过程中或结束后均可调用;
+        输入队列经常为满、线程利用率接近1的阶段为瓶颈
+        :return: stages: {阶段: {threads, busy(处理耗时总和, 秒), utilization(busy / (线程数 × 运行时间))}},
+                 queues: {阶段: 见 StageQueue.stats}
+        """
+        elapsed = time.perf_counter() - self.started if self.started is not None else 0.0
+        with self.lock:
+            stages = {stage: dict(threads=self.threads[stage], busy=self.busy[stage],
+                                  utilization=self.busy[stage] / (self.threads[stage] * elapsed) if elapsed else 0.0)
+                      for stage in STAGES}
+        return SimpleNamespace(stages=stages, queues={name: item.stats() for name, item in self.queues.items()})
+
+    def _process(self, enumerated: Iterator, skipped: list) -> Iterator[SimpleNamespace]:
+        """
+        在各阶段的线程中处理图像, 见 BatchProcessor._process
+        """
+        self.queues = {stage: StageQueue(stage, self.queue_size, self.profiler) for stage in STAGES}
+        self.busy = dict.fromkeys(STAGES, 0.0)
+        self.started = time.perf_counter()
+        results = queue.SimpleQueue()
+        options = dict(self.options)
+        if self.run_archive is not None:
+            options['archive'] = new_archive(options['save_path'], format=self.run_archive, root=options['save_path'])
+        remaining = dict(self.threads)
+        failures = []
+
+        def feed():
+            try:
+                for index, image in enumerated:
+                    while skipped:
+                        results.put(skipped.pop(0))
+                    if self.cancelled:
+                        break
+                    self.queues['decode'].put(SimpleNamespace(index=index, image_path=image, start=time.time(),
+                                                              trace=Trace(image, self.profiler)))
+                while skipped:
+                    results.put(skipped.pop(0))
+            except Exception as e:
+                failures.append(e)
+            finally:
+                for _ in range(self.threads['decode']):
+                    self.queues['decode'].put(_END)
+
+        def work(stage: str, func: Callable, reuse_buffers: bool):
+            # 流水线的缓冲区不能在线程间共享, 每个线程一个
+            pipeline = Pipeline(**dict(self.pipeline_options, model=self.model, reuse_buffers=reuse_buffers))
+            following = STAGES[STAGES.index(stage) + 1] if stage != STAGES[-1] else None
+            while True:
+                item = self.queues[stage].get()
+                if item is _END:
+                    break
+                start = time.perf_counter()
+                pipeline.trace = item.trace
+                try:
+                    func(pipeline, item)
+                except Exception as e:
+                    # 出错的图像不再进入后续阶段
+                    results.put(SimpleNamespace(index=item.index, image_path=item.image_path, result=None,
+                                                error=f'{type(e).__name__}: {e}', traceback=traceback.format_exc(),
+                                                skipped=False))
+                    continue
+                finally:
+                    pipeline.trace = NULL_TRACE
+                    with self.lock:
+                        self.busy[stage] += time.perf_counter() - start
+                if following is not None:
+                    self.queues[following].put(item)
+                else:
+                    results.put(SimpleNamespace(index=item.index, image_path=item.image_path, result=item.result,
+                                                error=None, traceback=None, skipped=False))
+            # 本阶段最后一个线程结束时通知下一阶段
+            with self.lock:
+                remaining[stage] -= 1
+                last = remaining[stage] == 0
+            if last and following is not None:
+                for _ in range(self.threads[following]):
+                    self.queues[following].put(_END)
+            elif last:
+                results.put(_END)
+
+        def decode(pipeline: Pipeline, item: SimpleNamespace):
+            item.image = pipeline.decode(item.image_path)
+
+        def segment(pipeline: Pipeline, item: SimpleNamespace):
+            blurred = pipeline.blur(item.image, source=item.image_path)
+            # 闭运算结果位于本线程的缓冲区中, 交给下一阶段前复制
+            item.mask = pipeline.morphology(pipeline.classify(blurred)).copy()
+
+        def regions(pipeline: Pipeline, item: SimpleNamespace):
+            item.connect_info = pipeline.regions(item.mask)
+            del item.mask
+
+        def render(pipeline: Pipeline, item: SimpleNamespace):
+            connect_info = pipeline.render(item.image, item.connect_info, Path(item.image_path).name)
+            del item.image, item.connect_info
+            paths = get_output_paths(item.image_path, options['save_path'], options['source_dir'],
+                                     cut_image=options['cut_image'], foreground=options['foreground'])
+            with item.trace.stage('cut'):
+                cut(connect_info, **vars(paths), tag=item.image_path, trace=item.trace, codecs=options['codecs'],
+                    archive=options['archive'])
+            item.result = make_result(item.image_path, connect_info, time.time() - item.start, item.trace)
+
+        functions = dict(decode=(decode, False), segment=(segment, True), regions=(regions, False),
+                         render=(render, False))
+        threads = [threading.Thread(target=feed, name='staged-feed', daemon=True)]
+        for stage in STAGES:
+            threads += [threading.Thread(target=work, args=(stage, *functions[stage]), name=f'staged-{stage}-{i}',
+                                         daemon=True) for i in range(self.threads[stage])]
+        for thread in threads:
+            thread.start()
+        finished = False
+        try:
+            while True:
+                result = results.get()
+                if result is _END:
+                    finished = True
+                    break
+                yield result
+            if failures:
+                raise failures[0]
+        finally:
+            if not finished:
+                # 提前结束迭代: 不再读取新的图像, 已开始的图像完成后结束
+                self._cancel.set()
+            for thread in threads:
+                thread.join()
+            if self.run_archive is not None:
+                options['archive'].close()
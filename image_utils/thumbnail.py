@@ -0,0 +1,60 @@
+import hashlib
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from image_utils.render import load_font
+
+
+def make_thumbnail(image: np.ndarray, boxes: list, max_size: int = 384, color: tuple = (255, 0, 0),
+                   font: str = 'msyhbd.ttc', font_size: int = 14) -> np.ndarray:
+    """
+    生成带标注的缩略图: 先缩小图像, 再在缩略图上绘制外接框与序号, 不需要整幅标注图
+    :param image: 图像数组, 格式为RGB
+    :param boxes: 连通区域坐标 [x_min, y_min, x_max, y_max], x为行、y为列
+    :param max_size: 缩略图的最大边长, 图像更小时不放大
+    :param color: 标注颜色
+    :param font: 序号字体
+    :param font_size: 序号字号
+    :return: 缩略图数组, 格式为RGB
+    """
+    import cv2
+
+    height, width = image.shape[:2]
+    scale = min(1.0, max_size / max(height, width))
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    thumbnail = Image.fromarray(cv2.resize(image[..., :3], size, interpolation=cv2.INTER_AREA), 'RGB')
+    draw = ImageDraw.Draw(thumbnail)
+    index_font = load_font(font, font_size)
+    for index, box in enumerate(boxes):
+        top, left, bottom, right = (int(value * scale) for value in box)
+        draw.rectangle((left, top, right, bottom), outline=color, width=1)
+        draw.text((left + 2, top), f'{index + 1}', font=index_font, fill=color)
+    return np.asarray(thumbnail)
+
+
+def thumbnail_path(directory: str, image: str) -> Path:
+    """
+    缩略图磁盘缓存中的路径, 以图像路径的哈希命名
+    :param directory: 缓存目录
+    :param image: 原始图像路径
+    :return: 缩略图路径(.jpg)
+    """
+    digest = hashlib.sha1(str(Path(image).resolve()).encode('utf-8')).hexdigest()
+    return Path(directory) / digest[:2] / f'{digest}.jpg'
+
+
+def save_thumbnail(thumbnail: np.ndarray, directory: str, image: str, quality: int = 85) -> Path:
+    """
+    把缩略图写入磁盘缓存
+    :param thumbnail: 缩略图数组, 格式为RGB
+    :param directory: 缓存目录
+    :param image: 原始图像路径
+    :param quality: jpeg质量
+    :return: 缩略图路径
+    """
+    path = thumbnail_path(directory, image)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    Image.fromarray(thumbnail, 'RGB').save(path, quality=quality)
+    return path
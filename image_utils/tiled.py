@@ -0,0 +1,387 @@
+from pathlib import Path
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+from PIL import Image, ImageFile
+
+from image_utils.model import SegmentationModel
+from image_utils.pipeline import Pipeline, Foreground
+from image_utils.profiling import NULL_TRACE
+from image_utils.regions import RegionTable
+
+# 分块边缘的重叠宽度: 高斯模糊(5x5)半径2 + 闭运算(5x5, 5次)先膨胀后腐蚀各半径10
+HALO = 2 + 2 * 5 * 2
+
+
+def _window(key, shape: tuple) -> tuple:
+    """
+    把 [top:bottom, left:right] 形式的索引转换为窗口坐标
+    :return: top, left, bottom, right
+    """
+    rows, cols = (key + (slice(None), slice(None)))[:2]
+    assert isinstance(rows, slice) and isinstance(cols, slice), "only slices are supported"
+    top, bottom, row_step = rows.indices(shape[0])
+    left, right, col_step = cols.indices(shape[1])
+    assert row_step == 1 and col_step == 1, "slice step must be 1"
+    return top, left, max(top, bottom), max(left, right)
+
+
+def _open_image(path: str) -> ImageFile.ImageFile:
+    """
+    打开图像但不解码; 不经过 Image.open, 因此不受PIL像素上限的限制, 也不需要修改全局的 Image.MAX_IMAGE_PIXELS
+    """
+    Image.init()
+    format = Image.registered_extensions().get(Path(path).suffix.lower())
+    assert format in Image.OPEN, f"unsupported image format: {path}"
+    return Image.OPEN[format][0](path)
+
+
+def _raw_segments(image: ImageFile.ImageFile) -> list:
+    """
+    未压缩的RGB图像(如未压缩的TIFF, 按条带或分块存储)中各数据段在文件中的位置
+    :return: [[top, left, rows, width, offset, stride]], 首尾相接的整行条带合并为一段; 其他格式为None
+    """
+    if image.mode != 'RGB' or not image.tile:
+        return None
+    width = image.size[0]
+    segments = []
+    for tile in image.tile:
+        args = tile.args if isinstance(tile.args, tuple) else (tile.args,)
+        rawmode, stride, orientation = (args + (0, 1))[:3]
+        if tile.codec_name != 'raw' or rawmode != 'RGB' or orientation != 1:
+            return None
+        x0, y0, x1, y1 = tile.extents
+        segment = [y0, x0, y1 - y0, x1 - x0, tile.offset, stride or (x1 - x0) * 3]
+        previous = segments[-1] if segments else None
+        if previous is not None and x0 == 0 and previous[1] == 0 and previous[3] == x1 - x0 == width \
+                and previous[5] == segment[5] and previous[0] + previous[2] == y0 \
+                and previous[4] + previous[2] * previous[5] == tile.offset:
+            previous[2] += y1 - y0
+        else:
+            segments.append(segment)
+    return segments
+
+
+class TileSource:
+    """
+    按块读取图像
+    图像数组(包括np.memmap)与.npy文件直接切片; 未压缩的RGB图像(如未压缩的TIFF拼接图)按数据段内存映射,
+    只读取所取的区域, 内存只与分块大小有关;
+    JPEG、压缩的TIFF等不能按区域解码的格式由PIL解码一次为uint8像素后切片
+    """
+
+    def __init__(self, image):
+        """
+        :param image: 图像路径或图像数组(格式RGB)
+        """
+        self.array = None
+        self.segments = None
+        if isinstance(image, np.ndarray):
+            self.array = image
+        elif Path(image).suffix.lower() == '.npy':
+            self.array = np.load(image, mmap_mode='r')
+        else:
+            assert Path(image).exists(), "image must be exists"
+            with _open_image(image) as decoded:
+                segments = _raw_segments(decoded)
+                if segments is None:
+                    self.array = np.asarray(decoded.convert('RGB') if decoded.mode != 'RGB' else decoded)
+                else:
+                    width, height = decoded.size
+            if segments is not None:
+                data = np.memmap(image, dtype=np.uint8, mode='r')
+                self.segments = [data[offset:offset + rows * stride].reshape(rows, stride)[:, :columns * 3]
+                                 .reshape(rows, columns, 3)
+                                 for _, _, rows, columns, offset, stride in segments]
+                # [top, left, bottom, right], 分块存储时边缘的块可能超出图像
+                bounds = np.array([(top, left, top + rows, left + columns)
+                                   for top, left, rows, columns, _, _ in segments], dtype=np.int64)
+                self.bounds = np.minimum(bounds, [height, width, height, width])
+                self.shape = (height, width, 3)
+        if self.array is not None:
+            assert self.array.ndim == 3 and self.array.shape[-1] == 3, "image must be RGB"
+            self.shape = self.array.shape
+
+    def read(self, top: int, left: int, bottom: int, right: int) -> np.ndarray:
+        """
+        读取 [top:bottom, left:right] 区域
+        :return: 连续的uint8数组
+        """
+        if self.segments is None:
+            return np.ascontiguousarray(self.array[top:bottom, left:right])
+        window = np.empty((bottom - top, right - left, 3), dtype=np.uint8)
+        b = self.bounds
+        hits = np.flatnonzero((b[:, 0] < bottom) & (b[:, 2] > top) & (b[:, 1] < right) & (b[:, 3] > left))
+        for index in hits:
+            y0, x0, y1, x1 = b[index]
+            t, l, d, r = max(top, y0), max(left, x0), min(bottom, y1), min(right, x1)
+            window[t - top:d - top, l - left:r - left] = self.segments[index][t - y0:d - y0, l - x0:r - x0]
+        return window
+
+    def __getitem__(self, key) -> np.ndarray:
+        """
+        按窗口读取, 如 source[top:bottom, left:right, :], 可直接用于 api.cut 与 pipeline.Foreground
+        :return: 所取区域的数组(新数组)
+        """
+        key = key if isinstance(key, tuple) else (key,)
+        window = self.read(*_window(key, self.shape))
+        return window[(Ellipsis,) + key[2:]] if key[2:] else window
+
+    def sample(self, sample_size: int) -> np.ndarray:
+        """
+        等间隔采样像素, 用于拟合分割模型; 逐行读取, 不需要整幅图像
+        :param sample_size: 大约的采样像素数
+        :return: (n, 1, 3)的像素数组
+        """
+        height, width = self.shape[:2]
+        step = max(1, int(np.sqrt(height * width / sample_size)))
+        if self.segments is None:
+            return np.ascontiguousarray(self.array[::step, ::step]).reshape((-1, 1, 3))
+        rows = [self.read(row, 0, row + 1, width)[:, ::step] for row in range(0, height, step)]
+        return np.concatenate(rows).reshape((-1, 1, 3))
+
+
+class RegionMask:
+    """
+    分块处理得到的前景掩码
+    只保存各保留区域外接框内的掩码, 按窗口切片时合成窗口内的所有保留区域,
+    结果与整图处理的 labeled_img 对应区域一致(前景为255、背景为0)
+    """
+
+    def __init__(self, shape: tuple, boxes: np.ndarray, masks: list):
+        """
+        :param shape: 图像的行列数
+        :param boxes: 各区域的外接框 [x_min, y_min, x_max, y_max], 含边界
+        :param masks: 各区域外接框内的布尔掩码
+        """
+        self.shape = tuple(shape[:2])
+        self.boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+        self.masks = masks
+
+    def __getitem__(self, key) -> np.ndarray:
+        key = key if isinstance(key, tuple) else (key,)
+        top, left, bottom, right = _window(key, self.shape)
+        window = np.zeros((bottom - top, right - left), dtype=np.uint8)
+        b = self.boxes
+        hits = np.flatnonzero((b[:, 0] < bottom) & (b[:, 2] >= top) & (b[:, 1] < right) & (b[:, 3] >= left))
+        for index in hits:
+            y0, x0 = b[index, :2]
+            t, l, d, r = max(top, y0), max(left, x0), min(bottom, b[index, 2] + 1), min(right, b[index, 3] + 1)
+            window[t - top:d - top, l - left:r - left][self.masks[index][t - y0:d - y0, l - x0:r - x0]] = 255
+        return window
+
+
+class _UnionFind:
+    def __init__(self):
+        self.parent = [0]
+
+    def add(self, count: int):
+        self.parent.extend(range(len(self.parent), len(self.parent) + count))
+
+    def find(self, item: int) -> int:
+        root = item
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[item] != root:
+            self.parent[item], item = root, self.parent[item]
+        return root
+
+    def union(self, a: int, b: int):
+        a, b = self.find(a), self.find(b)
+        if a != b:
+            self.parent[max(a, b)] = min(a, b)
+
+
+def _seam_pairs(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    相邻两条边界像素(8连通)中同为前景的标签对
+    :param a: 接缝一侧的标签
+    :param b: 接缝另一侧的标签
+    :return: (n, 2) 的标签对
+    """
+    pairs = [np.stack((a, b), axis=1),
+             np.stack((a[1:], b[:-1]), axis=1),
+             np.stack((a[:-1], b[1:]), axis=1)]
+    pairs = np.concatenate(pairs)
+    pairs = pairs[(pairs[:, 0] > 0) & (pairs[:, 1] > 0)]
+    return np.unique(pairs, axis=0)
+
+
+def fit_tiled_model(images, n_images: int = 8, model: SegmentationModel = None,
+                    sample_size: int = 1000000) -> SegmentationModel:
+    """
+    使用前n_images张图像的等间隔采样像素拟合分割模型, 不需要解码整幅图像, 见 api.fit_segmentation_model
+    :param images: 图像路径的可迭代对象
+    :param n_images: 用于拟合的图像数量
+    :param model: 待拟合的分割模型, 默认新建SegmentationModel
+    :param sample_size: 每张图像的采样像素数
+    :return: 已拟合的分割模型
+    """
+    model = model or SegmentationModel(sample_size=sample_size)
+    images = [image for image, _ in zip(images, range(n_images))]
+    assert images, "images must not be empty"
+    return model.fit(TileSource(image).sample(sample_size) for image in images)
+
+
+def get_connect_part_tiled(image, piex_threshold: int = 5000, tile_size: int = 4096,
+                           model: SegmentationModel = None, backend: str = 'kmeans',
+                           sample_size: int = 1000000, pipeline: Pipeline = None) -> SimpleNamespace:
+    """
+    分块获取连通区域, 用于超大拼接图
+    每块连同HALO宽的重叠边缘一起完成模糊、分类与闭运算, 只对中心部分标记连通区域,
+    跨越分块接缝的连通区域通过并查集合并, 结果与整图处理一致; 峰值内存与tile_size及前景区域的外接框有关
+    分类必须使用整图统一的聚类中心: 未指定model且backend为'kmeans'/'minibatch'时,
+    先在整图的等间隔采样像素上拟合一个分割模型
+    :param image: 图像路径、图像数组(格式RGB, 可为np.memmap)或 TileSource, 读取方式见 TileSource
+    :param piex_threshold: 像素阈值, 连通区域像素值小于piex_threshold的进行过滤
+    :param tile_size: 分块边长(不含重叠边缘)
+    :param model: 分割模型
+    :param backend: 聚类方式, 见 core.cluster_image
+    :param sample_size: 拟合分割模型的采样像素数
+    :param pipeline: 处理流水线, 指定时使用其piex_threshold、model、backend并记录到其当前的 Trace,
+                     忽略上述处理参数; 分块处理不使用由粗到细分割与解码缓存
+    :return: 连通区域, 按第一个像素的行列顺序排列; labeled_img为 RegionMask
+    """
+    assert tile_size > 0, "tile_size must be positive"
+    source = image if isinstance(image, TileSource) else TileSource(image)
+    height, width = source.shape[:2]
+    trace = None
+    if pipeline is not None:
+        piex_threshold, model, backend, trace = pipeline.piex_threshold, pipeline.model, pipeline.backend, \
+            pipeline.trace
+    if model is None and not backend.startswith('lut_'):
+        model = SegmentationModel(sample_size=sample_size).fit([source.sample(sample_size)])
+    pipeline = Pipeline(piex_threshold=piex_threshold, model=model, backend=backend)
+    if trace is not None:
+        pipeline.trace = trace
+
+    rows = range(0, height, tile_size)
+    cols = range(0, width, tile_size)
+    union_find = _UnionFind()
+    stats = []
+    # 各分块连通区域在外接框内的掩码; 不接触接缝且小于阈值的区域一定被过滤, 不保存
+    pieces = []
+    top_edges, bottom_edges, left_edges, right_edges = {}, {}, {}, {}
+    offset = 1
+    for ti, top in enumerate(rows):
+        bottom = min(top + tile_size, height)
+        for tj, left in enumerate(cols):
+            right = min(left + tile_size, width)
+            # 读取带重叠边缘的分块, 处理后只保留中心部分
+            t, l = max(top - HALO, 0), max(left - HALO, 0)
+            b, r = min(bottom + HALO, height), min(right + HALO, width)
+            with pipeline.trace.stage('decode'):
+                tile = source.read(t, l, b, r)
+            mask = pipeline.morphology(pipeline.classify(pipeline.blur(tile)))
+            mask = mask[top - t:bottom - t, left - l:right - l]
+
+            with pipeline.trace.stage('regions'):
+                count, labels, tile_stats, tile_centroids = cv2.connectedComponentsWithStats(mask, connectivity=8)
+                count -= 1
+                union_find.add(count)
+                for index in range(1, count + 1):
+                    x, y, w, h, area = tile_stats[index]
+                    # 第一个像素: 最上一行中最左的像素, 用于确定输出顺序
+                    first_col = x + int(np.argmax(labels[y, x:x + w] == index))
+                    cx, cy = tile_centroids[index]
+                    stats.append((area, top + y, left + x, top + y + h - 1, left + x + w - 1,
+                                  (top + cy) * area, (left + cx) * area, top + y, left + first_col))
+                    seam = (y == 0 and top > 0) or (x == 0 and left > 0) \
+                        or (y + h == bottom - top and bottom < height) or (x + w == right - left and right < width)
+                    pieces.append(labels[y:y + h, x:x + w] == index if seam or area >= piex_threshold else None)
+                labels[labels > 0] += offset - 1
+                top_edges[ti, tj], bottom_edges[ti, tj] = labels[0].copy(), labels[-1].copy()
+                left_edges[ti, tj], right_edges[ti, tj] = labels[:, 0].copy(), labels[:, -1].copy()
+            offset += count
+    pipeline.trace.count('pixels', height * width)
+
+    # 合并跨越接缝的连通区域, 整行/整列拼接后比较以包含对角相邻的像素
+    for ti in range(1, len(rows)):
+        above = np.concatenate([bottom_edges[ti - 1, tj] for tj in range(len(cols))])
+        below = np.concatenate([top_edges[ti, tj] for tj in range(len(cols))])
+        for a, b in _seam_pairs(above, below):
+            union_find.union(int(a), int(b))
+    for tj in range(1, len(cols)):
+        lefts = np.concatenate([right_edges[ti, tj - 1] for ti in range(len(rows))])
+        rights = np.concatenate([left_edges[ti, tj] for ti in range(len(rows))])
+        for a, b in _seam_pairs(lefts, rights):
+            union_find.union(int(a), int(b))
+
+    if not stats:
+        return SimpleNamespace(number_cls=0, labeled_img=RegionMask((height, width), [], []), piex=[], boxes=[],
+                               centroids=[])
+    stats = np.array(stats, dtype=np.float64)
+    roots = np.array([union_find.find(index) for index in range(1, offset)])
+    groups, inverse = np.unique(roots, return_inverse=True)
+    n = len(groups)
+    area = np.bincount(inverse, weights=stats[:, 0], minlength=n)
+    x_min = np.full(n, np.inf)
+    y_min = np.full(n, np.inf)
+    x_max = np.full(n, -np.inf)
+    y_max = np.full(n, -np.inf)
+    np.minimum.at(x_min, inverse, stats[:, 1])
+    np.minimum.at(y_min, inverse, stats[:, 2])
+    np.maximum.at(x_max, inverse, stats[:, 3])
+    np.maximum.at(y_max, inverse, stats[:, 4])
+    sum_x = np.bincount(inverse, weights=stats[:, 5], minlength=n)
+    sum_y = np.bincount(inverse, weights=stats[:, 6], minlength=n)
+    # 合并后区域的第一个像素取各分块中第一个像素的最小者
+    first = np.full(n, np.inf)
+    np.minimum.at(first, inverse, stats[:, 7] * width + stats[:, 8])
+
+    keep = np.flatnonzero(area >= piex_threshold)
+    keep = keep[np.argsort(first[keep], kind='stable')]
+    boxes = np.stack((x_min[keep], y_min[keep], x_max[keep], y_max[keep]), axis=1).astype(np.int64)
+    centroids = np.stack((sum_x[keep] / area[keep], sum_y[keep] / area[keep]), axis=1)
+
+    # 把各分块的掩码拼接为每个保留区域外接框内的掩码
+    order = np.argsort(inverse, kind='stable')
+    members = np.split(order, np.searchsorted(inverse[order], np.arange(1, n)))
+    masks = []
+    for group, box in zip(keep, boxes):
+        mask = np.zeros((box[2] - box[0] + 1, box[3] - box[1] + 1), dtype=bool)
+        for member in members[group]:
+            piece, top, left = pieces[member], int(stats[member, 1]) - box[0], int(stats[member, 2]) - box[1]
+            mask[top:top + piece.shape[0], left:left + piece.shape[1]] |= piece
+        masks.append(mask)
+    pipeline.trace.count('regions', len(keep))
+    return SimpleNamespace(
+        number_cls=len(keep),
+        labeled_img=RegionMask((height, width), boxes, masks),
+        piex=area[keep].astype(np.int64).tolist(),
+        boxes=boxes.tolist(),
+        centroids=centroids.tolist(),
+    )
+
+
+def get_result_tiled(image, filename: str = None, tile_size: int = 4096, pipeline: Pipeline = None,
+                     **options) -> SimpleNamespace:
+    """
+    分块处理的最终结果, 与 api.get_result 格式一致, 可直接用于 api.cut 保存切割图像
+    image为 TileSource, 按窗口读取; foreground按区域由 RegionMask 合成; 整幅图像不在内存中
+    :param image: 图像路径或图像数组, 见 TileSource
+    :param filename: 图像文件名, image为图像数组时必须指定
+    :param tile_size: 分块边长
+    :param pipeline: 处理流水线, 见 get_connect_part_tiled
+    :param options: get_connect_part_tiled 的其余参数
+    :return: 结果
+    """
+    if filename is None:
+        assert not isinstance(image, np.ndarray), "filename is required for image array"
+        filename = Path(image).name
+    source = TileSource(image)
+    connect_info = get_connect_part_tiled(source, tile_size=tile_size, pipeline=pipeline, **options)
+    trace = pipeline.trace if pipeline is not None else NULL_TRACE
+    with trace.stage('render'):
+        regions = RegionTable.from_regions(connect_info.piex, connect_info.boxes, connect_info.centroids)
+        area = regions.area('mm').tolist()
+    return SimpleNamespace(
+        image=source,
+        foreground=Foreground(source, connect_info.labeled_img),
+        cls=connect_info.number_cls,
+        area=area,
+        boxes=connect_info.boxes,
+        regions=regions,
+        filename=filename
+    )
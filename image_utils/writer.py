@@ -0,0 +1,218 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, Future
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+from PIL import Image
+
+from image_utils.archive import CropArchive, write_archive
+from image_utils.codec import Codec
+from image_utils.profiling import Profiler, Trace
+
+
+def save_image(image, path: str, mode: str = None, format: str = None, codec: Codec = None,
+               archive: CropArchive = None, **params):
+    """
+    保存图像
+    :param image: 图像数组或PIL图像
+    :param path: 保存路径, 写入archive时为包内路径, 见 CropArchive.name
+    :param mode: 图像数组的模式, 如'RGB'、'RGBA'
+    :param format: 图像格式, 默认由文件后缀决定
+    :param codec: 图像编码设置, 指定时忽略mode、format与params
+    :param archive: 切割图像包, 指定时写入包中而不是单独的文件, 必须同时指定codec
+    :param params: 传给 PIL.Image.save 的编码参数
+    :return: 写入的字节数
+    """
+    if codec is not None:
+        data = codec.encode(image)
+        if archive is not None:
+            return archive.add(path, data)
+        Path(path).write_bytes(data)
+        return len(data)
+    assert archive is None, "codec is required for archive"
+    if isinstance(image, np.ndarray):
+        image = Image.fromarray(image, mode)
+    image.save(path, format=format, **params)
+    return os.path.getsize(path)
+
+
+def image_nbytes(image) -> int:
+    """
+    估算图像占用的内存
+    :param image: 图像数组或PIL图像
+    :return: 字节数
+    """
+    if isinstance(image, np.ndarray):
+        return image.nbytes
+    return image.width * image.height * len(image.getbands())
+
+
+class ImageWriter:
+    """
+    后台图像写入
+    编码与写盘由若干后台线程完成, 排队中的图像总内存超过max_bytes时submit阻塞(背压),
+    写入错误被记录下来, 在flush/close时返回给调用方
+    """
+
+    def __init__(self, workers: int = 2, max_bytes: int = 256 << 20, profiler: Profiler = None):
+        """
+        :param workers: 编码线程数
+        :param max_bytes: 排队中图像的内存上限
+        :param profiler: 性能分析器, 每次写入记录一个'encode'阶段事件和'bytes_written'计数事件(任务未指定trace时)
+        """
+        assert workers > 0, "workers must be positive"
+        self.max_bytes = max_bytes
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix='image-writer')
+        self.condition = threading.Condition()
+        self.pending = 0
+        self.pending_bytes = 0
+        self.errors = []
+        # 任务标记 -> [未完成的任务数, 全部完成后的回调], 见 when_done
+        self.tags = {}
+        self.profiler = profiler
+        self.bytes_written = 0
+
+    def submit(self, image, path: str, mode: str = None, format: str = None, tag: str = None,
+               trace: Trace = None, **params) -> Future:
+        """
+        提交写入任务, 队列内存超过上限时阻塞直到有任务完成
+        图像数组在写入完成前不能被修改
+        :param image: 图像数组或PIL图像
+        :param path: 保存路径
+        :param mode: 图像数组的模式, 如'RGB'、'RGBA'
+        :param format: 图像格式, 默认由文件后缀决定
+        :param tag: 任务标记(如原始图像路径), 随错误一起返回
+        :param trace: 图像的 Trace, 写入完成后把写入的字节数计入其'bytes_written', 在任务计为完成(flush返回)之前
+        :param params: 传给 save_image 的其余参数, 如codec、archive或PIL的编码参数
+        :return: Future
+        """
+        return self._submit(image_nbytes(image), path, tag, trace, save_image, image, path, mode=mode,
+                            format=format, **params)
+
+    def submit_archive(self, items: list, path: str, codec: Codec, format: str = None,
+                       tag: str = None, trace: Trace = None) -> Future:
+        """
+        提交写入包文件的任务, 一组图像在同一个任务中编码并写入, 见 archive.write_archive
+        :param items: [(包内文件名, 图像数组或PIL图像)]
+        :param path: 包文件路径
+        :param codec: 图像编码设置
+        :param format: 打包格式, 默认由扩展名决定
+        :param tag: 任务标记
+        :param trace: 见 submit
+        :return: Future
+        """
+        size = sum(image_nbytes(image) for _, image in items)
+        return self._submit(size, path, tag, trace, write_archive, path, items, codec, format=format)
+
+    def _submit(self, size: int, path, tag, trace, func, *args, **kwargs) -> Future:
+        with self.condition:
+            # 单张图像超过上限时等待队列清空后写入
+            self.condition.wait_for(lambda: self.pending == 0 or self.pending_bytes + size <= self.max_bytes)
+            self.pending += 1
+            self.pending_bytes += size
+            self.tags.setdefault(tag, [0, []])[0] += 1
+        return self.executor.submit(self._write, size, path, tag, trace, func, args, kwargs)
+
+    def _write(self, size, path, tag, trace, func, args, kwargs):
+        start = time.perf_counter()
+        written = None
+        try:
+            written = func(*args, **kwargs)
+            if self.profiler is not None:
+                self.profiler.stage_event('encode', tag, start, time.perf_counter())
+            if trace is not None:
+                # 同一图像的多个输出可能在不同的写入线程中同时完成; Trace转发给其性能分析器
+                with self.condition:
+                    trace.count('bytes_written', written)
+            elif self.profiler is not None:
+                self.profiler.counter_event('bytes_written', tag, written)
+            return written
+        except Exception as e:
+            with self.condition:
+                self.errors.append(SimpleNamespace(path=str(path), tag=tag, error=f'{type(e).__name__}: {e}'))
+            raise
+        finally:
+            with self.condition:
+                callbacks = self._finish(tag)
+            try:
+                for callback, errors in callbacks:
+                    callback(errors)
+            finally:
+                # 回调执行完才计为完成; 写入字节数与完成在同一次加锁中更新, flush返回时已包含所有写入
+                with self.condition:
+                    if written is not None:
+                        self.bytes_written += written
+                    self.pending -= 1
+                    self.pending_bytes -= size
+                    self.condition.notify_all()
+
+    def _finish(self, tag) -> list:
+        # 在self.condition内调用: 标记的最后一个任务完成时取出回调
+        entry = self.tags[tag]
+        entry[0] -= 1
+        if entry[0] > 0:
+            return []
+        del self.tags[tag]
+        errors = [error for error in self.errors if error.tag == tag]
+        return [(callback, errors) for callback in entry[1]]
+
+    def when_done(self, tag, callback):
+        """
+        标记为tag的任务全部完成后调用callback(errors), 如一张图像的所有输出都写入后再记录到结果清单;
+        已没有未完成的任务时立即在当前线程调用, 否则在完成最后一个任务的写入线程中调用
+        :param tag: 任务标记, 见 submit
+        :param callback: 参数为该标记的写入错误(未被flush取走的), 见 flush
+        """
+        with self.condition:
+            entry = self.tags.get(tag)
+            if entry is not None:
+                entry[1].append(callback)
+                return
+            errors = [error for error in self.errors if error.tag == tag]
+        callback(errors)
+
+    def flush(self) -> list:
+        """
+        等待所有已提交的任务完成
+        :return: 上次flush以来的写入错误, 每项包含 path, tag, error
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.pending == 0)
+            errors, self.errors = self.errors, []
+        return errors
+
+    def close(self) -> list:
+        """
+        等待所有任务完成并结束编码线程
+        :return: 未返回过的写入错误
+        """
+        errors = self.flush()
+        self.executor.shutdown(wait=True)
+        return errors
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def write_image(image, path: str, mode: str = None, writer: ImageWriter = None, tag: str = None,
+                trace: Trace = None, **params):
+    """
+    保存图像, 指定writer时交给后台线程写入, 否则同步写入
+    :param image: 图像数组或PIL图像
+    :param path: 保存路径
+    :param mode: 图像数组的模式
+    :param writer: 后台写入器
+    :param tag: 任务标记, 见 ImageWriter.submit
+    :param trace: 后台写入时写入完成后计入'bytes_written'的 Trace, 见 ImageWriter.submit; 同步写入时不使用
+    :param params: 传给 save_image 的其余参数
+    :return: 同步写入时为写入的字节数, 后台写入时为None
+    """
+    if writer is None:
+        return save_image(image, path, mode=mode, **params)
+    writer.submit(image, Path(path), mode=mode, tag=tag, trace=trace, **params)
@@ -4,6 +4,10 @@ setup(
     name='image_utils',
     version='0.1.3',
     packages=['image_utils'],
+    package_data={'image_utils': ['font/*.ttf']},
+    entry_points={
+        'console_scripts': ['image-utils=image_utils.cli:main'],
+    },
     install_requires=[
         # your dependencies here
     ],